@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Measures how long the check_os CLI takes to start.
+
+  --help         time until check_os --help exits
+  import         time until checkos.main is imported
+  first call     time until a floating IP check (-F) sends its first request to the testbed
+
+For the first call, a local HTTP server plays the keystone of a testbed called bench. It records when the first
+request arrives and answers everything with 401, so the check stops right after it. The first call can only be
+measured where the client libraries are installed.
+
+Usage: python benchmarks/startup.py [-n RUNS]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHECK_OS = os.path.join(ROOT, 'check_os')
+
+CONFIG = """---
+ignore_projects:
+  any: []
+ignore_floating_ips:
+  any: []
+"""
+
+
+class FirstRequest(object):
+    def __init__(self):
+        self.time = None
+        self.event = threading.Event()
+
+    def handler(self):
+        first_request = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                if first_request.time is None:
+                    first_request.time = time.time()
+                    first_request.event.set()
+                self.send_response(401)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{"error": {"code": 401, "title": "Unauthorized", "message": "benchmark"}}')
+
+            do_GET = do_POST = do_HEAD = _answer
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _run(args, env=None):
+    started = time.time()
+    process = subprocess.run([sys.executable] + args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE)
+    return time.time() - started, process
+
+
+def time_help():
+    elapsed, process = _run([CHECK_OS, '--help'])
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode(errors='replace'))
+    return elapsed
+
+
+def time_import():
+    elapsed, process = _run(['-c', 'import checkos.main'])
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode(errors='replace'))
+    return elapsed
+
+
+def time_first_call(directory):
+    first_request = FirstRequest()
+    server = HTTPServer(('127.0.0.1', 0), first_request.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        credentials = os.path.join(directory, 'credentials.json')
+        with open(credentials, 'w') as f:
+            f.write(json.dumps({'bench': {
+                'username': 'admin', 'password': 'admin', 'api_version': 3, 'admin_project_id': 'admin',
+                'auth_url': 'http://127.0.0.1:{}/v3'.format(server.server_port)}}))
+        config = os.path.join(directory, 'config.yml')
+        with open(config, 'w') as f:
+            f.write(CONFIG)
+        started = time.time()
+        process = subprocess.run([sys.executable, CHECK_OS, '--os-cred', credentials, '--config', config, '-F',
+                                  '-t', 'bench', '--dry-run'], cwd=ROOT, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE)
+        if not first_request.event.wait(1):
+            raise RuntimeError('no request reached the testbed: {}'.format(
+                process.stderr.decode(errors='replace').strip().splitlines()[-1:]))
+        return first_request.time - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _report(name, function, runs):
+    try:
+        timings = [function() for _ in range(runs)]
+    except Exception as e:
+        print('{:<12} failed: {}'.format(name, e))
+        return
+    print('{:<12} min {:7.1f} ms   median {:7.1f} ms   max {:7.1f} ms'.format(
+        name, min(timings) * 1000, statistics.median(timings) * 1000, max(timings) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='measure the startup time of check_os')
+    parser.add_argument('-n', '--runs', help='number of runs of each measurement', type=int, default=5)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='checkos-bench-')
+    try:
+        _report('--help', time_help, args.runs)
+        _report('import', time_import, args.runs)
+        _report('first call', lambda: time_first_call(directory), args.runs)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Runs check_testbeds and check_vm_os end to end against a synthetic federation and reports the wall time, the API
+calls per endpoint and the peak memory of each run.
+
+Every scenario gets a freshly generated federation, so the zombies removed by one run are there again for the next.
+The memory is measured with tracemalloc from the start of the run, so it does not include the federation itself;
+tracemalloc slows the run down, use --no-memory for the wall time alone.
+
+Usage: python benchmarks/sweep.py [--testbeds 10] [--projects 1000] [--vms 20] [--latency 0.001] ...
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkos import main as checks  # noqa: E402
+from checkos.limits import Limits  # noqa: E402
+from checkos.policy import compile_policy  # noqa: E402
+from checkos.results import CHECKS, TextRenderer  # noqa: E402
+from tests import fakes  # noqa: E402
+
+SCENARIOS = ['check_testbeds', 'check_vm_os']
+
+
+def run_check_testbeds(federation, config, args):
+    flags = [check in args.checks for check in CHECKS]
+    with open(os.devnull, 'w') as devnull:
+        try:
+            checks.check_testbeds(federation.credentials(), config, *flags, dry_run=args.dry_run,
+                                  parallel_testbeds=args.parallel_testbeds, project_workers=args.project_workers,
+                                  renderer=TextRenderer(devnull))
+        except SystemExit:
+            # the injected errors make checks fail
+            pass
+
+
+def run_check_vm_os(federation, config, args):
+    testbed_name = federation.testbed_names[0]
+    cl = checks.clients.os_client(testbed_name, federation.credentials().get(testbed_name))
+    check_vm = config.get('check-vm')
+    try:
+        checks.check_vm_os(cl, check_vm.get('experiment-manager'), check_vm.get('nfvo'), testbed_name,
+                           ignored_projects=config.get('ignore_projects').get('any'), dry=args.dry_run,
+                           teardown_dict=check_vm.get('teardown'))
+    except fakes.FakeApiError as e:
+        print('check_vm_os failed: {}'.format(e))
+
+
+def run_scenario(name, args, image_path):
+    federation = fakes.Federation(args.testbeds, args.projects, args.vms, args.nsrs, args.floating_ips)
+    config = fakes.create_config(federation, image_path)
+    endpoints = fakes.Endpoints(args.latency, args.error_rate, args.seed)
+    restore = fakes.install(federation, endpoints)
+    if args.limits:
+        # like check_os, which always goes through the limiters
+        checks.clients.limit(Limits(compile_policy(config, federation.testbed_names)))
+    try:
+        if args.memory:
+            tracemalloc.start()
+        started = time.time()
+        {'check_testbeds': run_check_testbeds, 'check_vm_os': run_check_vm_os}.get(name)(federation, config, args)
+        elapsed = time.time() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+    finally:
+        if args.memory:
+            tracemalloc.stop()
+        checks.clients.limit(None)
+        restore()
+    report(name, elapsed, peak, endpoints)
+
+
+def report(name, elapsed, peak, endpoints):
+    print('{}'.format(name))
+    print('  wall time    {:10.3f} s'.format(elapsed))
+    if peak is not None:
+        print('  peak memory  {:10.1f} MiB'.format(peak / 1024.0 / 1024.0))
+    print('  API calls    {:10d}'.format(sum(endpoints.calls.values())))
+    for endpoint in sorted(endpoints.calls):
+        errors = endpoints.errors.get(endpoint)
+        print('    {:<36} {:8d}{}'.format(endpoint, endpoints.calls.get(endpoint),
+                                          '   ({} errors)'.format(errors) if errors else ''))
+    print('')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark check-os against a synthetic federation')
+    parser.add_argument('--testbeds', type=int, default=10)
+    parser.add_argument('--projects', help='experimenter projects per testbed', type=int, default=1000)
+    parser.add_argument('--vms', help='VMs per project', type=int, default=20)
+    parser.add_argument('--nsrs', help='NSRs per experimenter, half of them zombies', type=int, default=4)
+    parser.add_argument('--floating-ips', help='floating IPs per project, half of them unused', type=int,
+                        default=4)
+    parser.add_argument('--latency', help='seconds every API call takes', type=float, default=0.0)
+    parser.add_argument('--error-rate', help='probability that an API call fails', type=float, default=0.0)
+    parser.add_argument('--seed', help='seed of the injected errors', type=int, default=0)
+    parser.add_argument('--checks', help='comma separated checks run by check_testbeds',
+                        default=','.join(CHECKS))
+    parser.add_argument('--scenarios', help='comma separated scenarios out of {}'.format(', '.join(SCENARIOS)),
+                        default=','.join(SCENARIOS))
+    parser.add_argument('--parallel-testbeds', type=int, default=1)
+    parser.add_argument('--project-workers', type=int)
+    parser.add_argument('--dry-run', action='store_true', default=False)
+    parser.add_argument('--no-limits', help='do not limit, retry or break the circuit of the API calls',
+                        dest='limits', action='store_false', default=True)
+    parser.add_argument('--no-memory', help='do not measure the peak memory', dest='memory', action='store_false',
+                        default=True)
+    parser.add_argument('-d', '--debug', help='show the log of the checks', action='store_true')
+    args = parser.parse_args()
+    args.checks = [check for check in args.checks.split(',') if check]
+    unknown = [check for check in args.checks if check not in CHECKS]
+    if unknown:
+        parser.error('unknown checks {}, choose from {}'.format(', '.join(unknown), ', '.join(CHECKS)))
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+    with tempfile.NamedTemporaryFile(prefix='checkos-bench-', suffix='.img') as image:
+        image.write(os.urandom(64 * 1024))
+        image.flush()
+        for scenario in args.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                parser.error('unknown scenario {}, choose from {}'.format(scenario, ', '.join(SCENARIOS)))
+            run_scenario(scenario, args, image.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+from checkos.limits import READ, LimitedClient
+from checkos.metrics import InstrumentedClient, timed_call
+
+
+# The client libraries are only imported when a check first needs them. Importing them pulls in the keystone, nova,
+# neutron and glance clients and takes longer than most short runs, so the CLI must not do it for --help, for
+# argument validation or for checks that do not talk to the service in question.
+
+_metrics = None
+_limits = None
+_tokens = None
+
+
+def instrument(metrics):
+    """
+    Makes the clients created from now on record their calls in metrics, or stop recording if metrics is None.
+    """
+    global _metrics
+    _metrics = metrics
+
+
+def limit(limits):
+    """
+    Makes the OpenStack clients created from now on go through the limiters of limits, or not if limits is None.
+    """
+    global _limits
+    _limits = limits
+
+
+def cache_tokens(tokens):
+    """
+    Makes the OpenStack clients created from now on reuse and keep their keystone tokens in the TokenCache tokens, or
+    authenticate on their own if tokens is None.
+    """
+    global _tokens
+    _tokens = tokens
+
+
+def _new_session(testbed):
+    """
+    :return: a keystoneauth1 session of the admin user and project of the testbed, which authenticates on its first
+    request, like the ones OSClient creates for its clients
+    """
+    from keystoneauth1 import session
+    from keystoneauth1.identity import v2, v3
+    auth_url = testbed.get("auth_url").rstrip('/')
+    if testbed.get("api_version") == 2:
+        auth = v2.Password(auth_url=auth_url, username=testbed.get("username"), password=testbed.get("password"),
+                           tenant_name=testbed.get("admin_tenant_name"))
+    else:
+        auth = v3.Password(auth_url=auth_url, username=testbed.get("username"), password=testbed.get("password"),
+                           project_id=testbed.get("admin_project_id"),
+                           project_domain_name=testbed.get("project_domain_name") or 'Default',
+                           user_domain_name=testbed.get("user_domain_name") or 'Default')
+    return session.Session(auth=auth)
+
+
+def _new_os_client(testbed_name, testbed, session=None):
+    """
+    :param session: if not None, the keystoneauth1 session the clients of the admin project are created from,
+    instead of one new session per client
+    """
+    from sdk.softfire.os_utils import OSClient
+    project_id = testbed.get("admin_project_id")
+    if session is None:
+        return OSClient(testbed_name, testbed, None, project_id)
+
+    class SessionOSClient(OSClient):
+        def _get_session(self, tenant_id=None):
+            # a client of another project, e.g. one the SDK creates on the fly, gets a session of its own
+            if tenant_id in (None, project_id):
+                return session
+            return super(SessionOSClient, self)._get_session(tenant_id)
+
+    return SessionOSClient(testbed_name, testbed, None, project_id)
+
+
+def _new_ob_client(**kwargs):
+    from org.openbaton.sdk.client import OBClient
+    return OBClient(**kwargs)
+
+
+def _new_exp_man_client(**kwargs):
+    from sdk.softfire.exp_man_client import ExpManClient
+    return ExpManClient(**kwargs)
+
+
+def os_client(testbed_name, testbed):
+    """
+    :return: the OSClient of the admin project of the testbed
+    """
+    metrics = _metrics
+    limits = _limits
+    tokens = _tokens
+
+    session = None
+    if tokens is not None:
+        # the session has the cached token before the clients are created from it, so none of them authenticates
+        session = _new_session(testbed)
+        tokens.attach(session, testbed_name, testbed)
+
+    def create():
+        return timed_call(metrics, testbed_name, 'keystone', 'keystone.session', _new_os_client, testbed_name,
+                          testbed, session)
+
+    # authenticating again only issues another token, so the login is retried like a read
+    cl = limits.limiter(testbed_name, 'keystone').call_as(READ, create) if limits is not None else create()
+    if metrics is not None:
+        # inside the limiter, so that every attempt of a retried call is recorded
+        cl = InstrumentedClient(cl, metrics, testbed_name, None)
+    return LimitedClient(cl, limits, testbed_name) if limits is not None else cl
+
+
+def ob_client(**kwargs):
+    """
+    :return: an Open Baton OBClient created with the given arguments
+    """
+    metrics = _metrics
+    # without a project ID, the OBClient logs in and looks the project up while it is created
+    ob = timed_call(metrics, None, 'nfvo', 'nfvo.create_client', _new_ob_client, **kwargs)
+    return InstrumentedClient(ob, metrics, None, 'nfvo', 'nfvo') if metrics is not None else ob
+
+
+def exp_man_client(**kwargs):
+    """
+    :return: an ExpManClient created with the given arguments
+    """
+    metrics = _metrics
+    exp_man = timed_call(metrics, None, 'exp_man', 'exp_man.login', _new_exp_man_client, **kwargs)
+    return InstrumentedClient(exp_man, metrics, None, 'exp_man', 'exp_man') if metrics is not None else exp_man
+
+
+def unauthorized_error():
+    """
+    The exception raised by keystone for wrong credentials, to be used as except unauthorized_error():, which is only
+    evaluated once an exception was raised.
+    """
+    from keystoneauth1.exceptions import Unauthorized
+    return Unauthorized
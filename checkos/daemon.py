@@ -0,0 +1,211 @@
+import logging
+import os
+import signal
+import threading
+import time
+
+from checkos import main as checks, tracing
+from checkos.policy import compile_policy, load_config
+from checkos.results import CHECKS, TextRenderer
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVALS = {
+    'images': 3600,
+    'security_group': 3600,
+    'networks': 3600,
+    'floating_ip': 300,
+    'vm_zombie': 900,
+}
+
+# seconds the daemon waits after a run failed as a whole
+ERROR_WAIT = 60
+
+# config sections that the shared objects of each kind are created from
+SHARED_SECTIONS = {
+    'exp_man': ['check-vm'],
+    'nfvo': ['check-vm'],
+    'zombie_diff': ['check-vm'],
+    'digest_cache': ['image_sync'],
+    'state': ['state'],
+}
+
+
+class Daemon(object):
+    """
+    Runs the checks periodically instead of once.
+
+    Every check has its own interval per testbed, taken from the daemon.intervals section of the config file. The
+    OpenStack clients, the Experiment Manager client and the NFVO login are created once and kept between runs. The
+    config file is read again whenever it changes; objects created from sections that did not change are kept.
+    """
+
+    def __init__(self, testbeds, config_path, enabled_checks, dry_run=False, experimenter=None, parallel_testbeds=1,
+                 project_workers=None, state_dir=None, renderer=None, metrics=None, metrics_file=None,
+                 metrics_port=None, trace_file=None, limits=None, tokens=None):
+        self.testbeds = testbeds
+        self.config_path = config_path
+        self.enabled_checks = [check for check in CHECKS if check in enabled_checks]
+        self.dry_run = dry_run
+        self.experimenter = experimenter
+        self.parallel_testbeds = parallel_testbeds
+        self.project_workers = project_workers
+        self.state_dir = state_dir
+        self.renderer = renderer or TextRenderer()
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.trace_file = trace_file
+        self.limits = limits
+        self.tokens = tokens
+        self.config = None
+        self.policy = None
+        self.shared = {'os_clients': {}}
+        self._config_mtime = None
+        self._last_run = {}
+        self._stop = threading.Event()
+
+    def _read_config(self):
+        return load_config(self.config_path)
+
+    def reload_config(self):
+        """
+        Reads the config file if it changed since the last time.
+        :return: True if it was read
+        """
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError as e:
+            # e.g. while an editor replaces the file; it is read once it is back
+            log.warning('Cannot read the config file {}, keeping the previous one: {}'.format(self.config_path, e))
+            return False
+        if mtime == self._config_mtime:
+            return False
+        try:
+            config = self._read_config()
+            policy = compile_policy(config, self.testbeds)
+        except Exception as e:
+            log.error('Exception while reading the config file {}, keeping the previous one: {}'.format(
+                self.config_path, e))
+            self._config_mtime = mtime
+            return False
+        log.info('Loaded the config file {}'.format(self.config_path))
+        state_dir = self.state_dir or policy.state.get("dir")
+        shared = checks.create_shared(policy, 'images' in self.enabled_checks, 'vm_zombie' in self.enabled_checks,
+                                      state_dir)
+        shared['os_clients'] = self.shared.get('os_clients')
+        for name, sections in SHARED_SECTIONS.items():
+            unchanged = self.config is not None and all(
+                config.get(section) == self.config.get(section) for section in sections)
+            if unchanged and self.shared.get(name) is not None and shared.get(name) is not None:
+                # keep the old object, with its logins and caches, and drop the new one
+                shared[name], discarded = self.shared.get(name), shared.get(name)
+            else:
+                discarded = self.shared.get(name)
+            if name == 'state' and discarded is not None:
+                discarded.close()
+        self.shared = shared
+        self.config = config
+        self.policy = policy
+        if self.limits is not None:
+            self.limits.configure(policy)
+        self._config_mtime = mtime
+        return True
+
+    def intervals(self):
+        intervals = dict(DEFAULT_INTERVALS)
+        if self.policy is not None:
+            # validated by compile_policy, an invalid config file is never taken
+            intervals.update(self.policy.daemon.get('intervals') or {})
+        return intervals
+
+    def due(self, now):
+        """
+        :return: the checks that are due at time now, by testbed name
+        """
+        intervals = self.intervals()
+        due = {}
+        for testbed_name in self.testbeds:
+            for check in self.enabled_checks:
+                last_run = self._last_run.get((testbed_name, check))
+                if last_run is None or now - last_run >= float(intervals.get(check)):
+                    due.setdefault(testbed_name, []).append(check)
+        return due
+
+    def next_due(self):
+        """
+        :return: the time at which the next check is due
+        """
+        intervals = self.intervals()
+        next_times = [self._last_run.get((testbed_name, check), 0) + float(intervals.get(check))
+                      for testbed_name in self.testbeds for check in self.enabled_checks]
+        return min(next_times) if next_times else time.time() + min(intervals.values())
+
+    def run_once(self, due):
+        """
+        Runs the due checks, grouping the testbeds that have the same checks due.
+        """
+        groups = {}
+        for testbed_name, due_checks in due.items():
+            groups.setdefault(tuple(due_checks), {})[testbed_name] = self.testbeds.get(testbed_name)
+        if self.shared.get('exp_man') is not None and any('vm_zombie' in due_checks for due_checks in groups):
+            # experiments come and go between runs, the logins are kept though
+            self.shared.get('exp_man').refresh()
+            self.shared.get('nfvo').refresh()
+            self.shared.get('zombie_diff').refresh()
+        for due_checks, testbeds in groups.items():
+            started = time.time()
+            log.info('Running {} on {}'.format(', '.join(due_checks), ', '.join(testbeds)))
+            flags = [check in due_checks for check in CHECKS]
+            self.renderer.start()
+            results = checks.run_checks(testbeds, self.config, *flags, dry_run=self.dry_run,
+                                        experimenter=self.experimenter, parallel_testbeds=self.parallel_testbeds,
+                                        project_workers=self.project_workers, shared=self.shared,
+                                        renderer=self.renderer, policy=self.policy)
+            checks.print_results(results, *flags, renderer=self.renderer)
+            if results.failed():
+                log.warning('{} failed on {}'.format(', '.join(due_checks), ', '.join(testbeds)))
+            for testbed_name in testbeds:
+                for check in due_checks:
+                    self._last_run[(testbed_name, check)] = started
+        if self.tokens is not None:
+            # so that a restarted daemon does not authenticate again
+            self.tokens.save()
+        if self.metrics is not None:
+            if self.metrics_file:
+                checks.write_metrics(self.metrics, self.metrics_file)
+            else:
+                self.metrics.run_finished()
+        if self.trace_file:
+            tracing.write(self.trace_file)
+
+    def stop(self, *args):
+        log.info('Stopping the Check OS daemon...')
+        self._stop.set()
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        log.info("Starting the Check OS daemon...")
+        server = None
+        if self.metrics is not None and self.metrics_port:
+            server = self.metrics.serve(int(self.metrics_port))
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.reload_config()
+                    # nothing runs until a config file was read
+                    due = self.due(time.time()) if self.policy is not None else {}
+                    if due:
+                        self.run_once(due)
+                    # wake up at least once a minute to notice config changes
+                    wait = max(0, min(self.next_due() - time.time(), 60))
+                except Exception as e:
+                    # the checks that failed are due again, but not at once, in case the error is not going away
+                    log.error('Exception in the Check OS daemon, trying again in {}s: {}'.format(ERROR_WAIT, e))
+                    wait = ERROR_WAIT
+                self._stop.wait(wait)
+        finally:
+            if server is not None:
+                server.shutdown()
+            checks.close_shared(self.shared)
@@ -0,0 +1,23 @@
+import os
+
+
+def write_atomic(path, text, mode=0o666):
+    """
+    Replaces the file at path with text, creating its directory if needed. The text is written to a temporary file
+    next to it, which is then renamed over it, so that a reader sees either the old or the new file, never a partial
+    one.
+    :param mode: the permissions of the new file, less the umask
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        # a file left behind by a crash would keep its permissions
+        os.remove(tmp_path)
+    except OSError:
+        pass
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.rename(tmp_path, path)
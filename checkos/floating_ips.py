@@ -0,0 +1,88 @@
+import logging
+
+from checkos import tracing
+from checkos.workers import map_bounded
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+def _ignore(project, floating_ip_id, successful):
+    pass
+
+
+class FloatingIpReclaimer(object):
+    """
+    Releases the floating IPs of one testbed that are not associated with a port.
+
+    The floating IPs of all projects come from the admin listing of the Inventory. Every floating IP is classified as
+    ignored, if its address is in the ignore list of the config file, associated, if it has a fixed IP, or
+    releasable. The releasable ones are released on a bounded number of threads.
+    """
+
+    def __init__(self, cl, inventory, ignored=None, workers=None, dry_run=False):
+        """
+        :param ignored: the floating IP addresses that are never released
+        """
+        self.cl = cl
+        self.inventory = inventory
+        self.ignored = frozenset(ignored or [])
+        self.workers = max(1, int(workers or DEFAULT_WORKERS))
+        self.dry_run = dry_run
+
+    def classify(self, projects):
+        """
+        :return: (ignored, associated, releasable), each a list of (project, floating IP)
+        """
+        ignored, associated, releasable = [], [], []
+        for project in projects:
+            for fip in self.inventory.list_floatingips(project.id):
+                if fip.get('floating_ip_address') in self.ignored:
+                    ignored.append((project, fip))
+                elif fip.get('fixed_ip_address') is not None:
+                    associated.append((project, fip))
+                else:
+                    releasable.append((project, fip))
+        log.debug('Floating IPs of testbed {}: {} ignored, {} associated, {} releasable'.format(
+            self.cl.testbed_name, len(ignored), len(associated), len(releasable)))
+        return ignored, associated, releasable
+
+    def _release(self, project, fip, on_result):
+        """
+        :return: None if the floating IP was released, the error otherwise
+        """
+        address = fip.get('floating_ip_address')
+        if self.dry_run:
+            log.info('Would release floating IP {} of project {}'.format(address, project.name))
+            return None
+        try:
+            with tracing.span('delete floating IP', 'operation', id=fip.get('id')):
+                self.cl.neutron.delete_floatingip(fip.get('id'))
+            log.debug('Released floating IP {} of project {}'.format(address, project.name))
+            on_result(project, fip.get('id'), True)
+            return None
+        except Exception as e:
+            log.error('Exception while releasing floating IP {} of project {}: {}'.format(address, project.name, e))
+            on_result(project, fip.get('id'), False)
+            return str(e)
+
+    def reclaim(self, projects, on_result=None, admit=None):
+        """
+        :param on_result: if not None, called with (project, floating IP ID, successful) right after every release
+        :param admit: if not None, called with a project before a floating IP of it is released; the floating IPs of
+        the projects it returns False for are kept, see checkos.schedule.Admission
+        :return: a list of (project, address, error) for the releasable floating IPs of the admitted projects, error is
+        None if the floating IP was released, or would have been in a dry run
+        """
+        releasable = self.classify(projects)[2]
+        if admit is not None:
+            releasable = [(project, fip) for project, fip in releasable if admit(project)]
+
+        def release(item):
+            return self._release(item[0], item[1], on_result or _ignore)
+
+        errors = map_bounded(release, releasable, self.workers)
+        if releasable and not self.dry_run:
+            self.inventory.invalidate('floating_ips')
+        return [(project, fip.get('floating_ip_address'), error) for (project, fip), error in zip(releasable, errors)]
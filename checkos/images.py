@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from checkos import tracing
+from checkos.files import write_atomic
+from checkos.workers import map_bounded
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_WORKERS = 2
+
+
+class DigestCache(object):
+    """
+    MD5 digests of local image files, which is what Glance reports as checksum.
+
+    A file is hashed at most once as long as its path, mtime and size do not change. If a path is given, the
+    digests are kept in that JSON file between runs.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._dirty = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self._digests = json.loads(f.read())
+            except Exception as e:
+                log.warning('Ignoring unreadable image digest cache {}: {}'.format(path, e))
+
+    def digest(self, image_path):
+        stat = os.stat(image_path)
+        with self._lock:
+            entry = self._digests.get(image_path)
+            if entry and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+                return entry.get('md5')
+        log.debug('Hashing image file {}'.format(image_path))
+        md5 = hashlib.md5()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                md5.update(chunk)
+        with self._lock:
+            self._digests[image_path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'md5': md5.hexdigest()}
+            self._dirty = True
+        return md5.hexdigest()
+
+    def save(self):
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            write_atomic(self.path, json.dumps(self._digests))
+            self._dirty = False
+
+
+class ImageSync(object):
+    """
+    Makes sure the configured images exist on one testbed.
+
+    Glance is listed once. An image counts as present if an active image with its name exists, for shared images with
+    any owner and for the others owned by the project. If Glance reports a checksum that differs from the digest of
+    the local file, the image check fails. Shared images are uploaded once per testbed as public images; the others
+    are uploaded once for every project missing them, owned by that project. Uploads stream the file from disk in
+    chunks and run on a bounded number of threads; the image record of a failed upload is deleted again.
+    """
+
+    def __init__(self, cl, digest_cache=None, workers=None, dry_run=False):
+        self.cl = cl
+        self.digest_cache = digest_cache or DigestCache()
+        self.workers = max(1, int(workers or DEFAULT_WORKERS))
+        self.dry_run = dry_run
+
+    def _local_digest(self, name, image):
+        try:
+            return self.digest_cache.digest(image.get('path'))
+        except Exception as e:
+            log.warning('Could not hash the file {} of image {}: {}'.format(image.get('path'), name, e))
+            return None
+
+    def _verify(self, name, image, glance_image):
+        """
+        :return: False if Glance reports a checksum that differs from the digest of the local file, True otherwise
+        """
+        checksum = getattr(glance_image, 'checksum', None)
+        if not checksum:
+            return True
+        digest = self._local_digest(name, image)
+        if digest is not None and digest != checksum:
+            log.error('Image {} ({}) differs from the local file {}'.format(name, glance_image.id, image.get('path')))
+            return False
+        return True
+
+    def plan(self, images, projects):
+        """
+        :param images: the image definitions of the config file, by image name
+        :param projects: the projects that need the images
+        :return: (uploads, differing), lists of (image name, project or None for shared images) of the images that
+        have to be uploaded and of the present images that differ from their local file
+        """
+        by_name = {}
+        for glance_image in self.cl.glance.images.list():
+            if getattr(glance_image, 'status', None) != 'active':
+                # queued, saving or killed, e.g. left behind by an upload that did not finish
+                log.debug('Ignoring image {} ({}), it is {}'.format(glance_image.name, glance_image.id,
+                                                                    getattr(glance_image, 'status', None)))
+                continue
+            by_name.setdefault(glance_image.name, []).append(glance_image)
+        uploads = []
+        differing = []
+        for name in sorted(images):
+            image = images.get(name)
+            existing = by_name.get(name, [])
+            if image.get('shared'):
+                if existing:
+                    log.debug("Image %s is available" % name)
+                    if not self._verify(name, image, existing[0]):
+                        differing.append((name, None))
+                else:
+                    log.debug('Image %s is not available' % name)
+                    uploads.append((name, None))
+                continue
+            owners = {getattr(glance_image, 'owner', None): glance_image for glance_image in existing}
+            for project in projects:
+                if project.id in owners:
+                    log.debug("Image %s is available in project %s" % (name, project.name))
+                    if not self._verify(name, image, owners.get(project.id)):
+                        differing.append((name, project))
+                else:
+                    log.debug('Image %s is not available in project %s' % (name, project.name))
+                    uploads.append((name, project))
+        return uploads, differing
+
+    def _upload(self, name, image, project=None):
+        location = image.get('path')
+        if self.dry_run:
+            log.info('Would upload image {} from {}{}'.format(
+                name, location, ' to project {}'.format(project.name) if project else ''))
+            return True
+        glance_image = None
+        try:
+            properties = dict(name=name,
+                              visibility='private' if project else 'public',
+                              disk_format=image.get('diskFormat', 'qcow2'),
+                              container_format=image.get('containerFormat', 'bare'))
+            if project is not None:
+                properties['owner'] = project.id
+            glance_image = self.cl.glance.images.create(**properties)
+            with open(location, 'rb') as f:
+                # glance reads the file object in chunks, it is never loaded into memory as a whole
+                self.cl.glance.images.upload(glance_image.id, f, image_size=os.path.getsize(location))
+            log.info("Successfully Uploaded: %s file: %s" % (name, location))
+            return True
+        except Exception as e:
+            log.error('Exception while uploading image {} from {}: {}'.format(name, location, e))
+            if glance_image is not None:
+                self._delete(name, glance_image)
+            return False
+
+    def _delete(self, name, glance_image):
+        try:
+            self.cl.glance.images.delete(glance_image.id)
+            log.info('Deleted the image record {} of image {}'.format(glance_image.id, name))
+        except Exception as e:
+            log.error('Exception while deleting the image record {} of image {}: {}'.format(glance_image.id, name, e))
+
+    def sync(self, images, projects, on_result=None, admit=None):
+        """
+        :param on_result: if not None, called with (image name, project or None, successful) right after every upload
+        :param admit: if not None, called with (image name, project or None) right before every upload; the uploads
+        it returns False for are skipped, and neither count as uploaded nor as failed
+        :return: (successful, uploaded) where uploaded lists the names of the uploaded images; not successful if an
+        upload failed or a present image differs from its local file
+        """
+        uploads, differing = self.plan(images, projects)
+        log.debug("Images to upload are: %s" % [name for name, _ in uploads])
+
+        def upload(item):
+            name, project = item
+            if admit is not None and not admit(name, project):
+                return None
+            with tracing.span('upload image', 'operation', image=name, project=project.name if project else None):
+                successful = self._upload(name, images.get(name), project)
+            if on_result is not None and not self.dry_run:
+                on_result(name, project, successful)
+            return successful
+
+        results = map_bounded(upload, uploads, self.workers)
+        self.digest_cache.save()
+        uploaded = [name for (name, _), successful in zip(uploads, results) if successful is True]
+        return not differing and False not in results, uploaded
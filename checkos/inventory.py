@@ -0,0 +1,155 @@
+import logging
+import threading
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# servers and floating IPs are listed in pages of this size
+DEFAULT_PAGE_SIZE = 500
+
+# the fields of a floating IP the checks use; neutron only returns these
+FLOATING_IP_FIELDS = ['id', 'floating_ip_address', 'fixed_ip_address', 'tenant_id', 'project_id']
+
+# what the checks use of a server, instead of the whole document nova returns
+Server = namedtuple('Server', ['id', 'name', 'tenant_id'])
+
+
+def _project_id_of(resource):
+    if isinstance(resource, dict):
+        return resource.get('project_id') or resource.get('tenant_id')
+    return getattr(resource, 'project_id', None) or getattr(resource, 'tenant_id', None)
+
+
+def iter_servers(cl, search_opts, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Lists the servers page by page, each page starting after the last server of the previous one. Nova caps the page
+    size at its osapi_max_limit, so a page shorter than page_size does not mean that it was the last one; the listing
+    ends with an empty page.
+    :return: a generator of Server, which fetches the next page when the current one is consumed
+    """
+    marker = None
+    while True:
+        page = cl.nova.servers.list(search_opts=search_opts, marker=marker, limit=page_size)
+        if not page:
+            return
+        for server in page:
+            yield Server(server.id, getattr(server, 'name', None), _project_id_of(server))
+        if page[-1].id == marker:
+            log.warning('Nova returned the server {} the page started after, stopping the listing'.format(marker))
+            return
+        marker = page[-1].id
+
+
+def iter_floatingips(cl, page_size=DEFAULT_PAGE_SIZE, **filters):
+    """
+    Lists the floating IPs page by page, neutron following the next links with markers.
+    :return: a generator of floating IPs with the FLOATING_IP_FIELDS only
+    """
+    for page in cl.neutron.list_floatingips(retrieve_all=False, limit=page_size, fields=FLOATING_IP_FIELDS,
+                                            **filters):
+        for fip in page.get('floatingips'):
+            yield {field: fip.get(field) for field in FLOATING_IP_FIELDS}
+
+
+def _index_by_project(resources):
+    index = {}
+    for resource in resources:
+        index.setdefault(_project_id_of(resource), []).append(resource)
+    return index
+
+
+class Inventory(object):
+    """
+    In-memory snapshot of the resources of one testbed.
+
+    Every resource type is listed at most once, with admin scope and across all tenants, the first time it is needed.
+    The results are indexed by project ID. The list methods have the same names as the ones of OSClient, so the check
+    functions can read from either of them. Servers and floating IPs are listed in pages of page_size and only the
+    fields the checks use are kept of them, so that a testbed with thousands of them does not have all their documents
+    in memory at once.
+
+    If an experimenter name is given, only the project of that experimenter is looked up and the resource listings
+    are restricted to it.
+    """
+
+    def __init__(self, cl, experimenter=None, page_size=DEFAULT_PAGE_SIZE):
+        self.cl = cl
+        self.experimenter = experimenter
+        self.page_size = page_size
+        self._lock = threading.RLock()
+        self._snapshot = {}
+
+    def _get(self, resource_type, fetch):
+        with self._lock:
+            if resource_type not in self._snapshot:
+                log.debug('Fetching {} of testbed {}'.format(resource_type, self.cl.testbed_name))
+                self._snapshot[resource_type] = fetch()
+            return self._snapshot.get(resource_type)
+
+    def invalidate(self, resource_type):
+        """
+        Drops a resource type from the snapshot, so that it is listed again the next time it is needed.
+        """
+        with self._lock:
+            self._snapshot.pop(resource_type, None)
+
+    def _tenant_filter(self):
+        """
+        :return: the query parameters that restrict a neutron listing to the experimenter's project, if any
+        """
+        if self.experimenter is None:
+            return {}
+        projects = self.list_tenants()
+        if len(projects) != 1:
+            return {}
+        return {'tenant_id': projects[0].id}
+
+    def _fetch_tenants(self):
+        if self.experimenter is None:
+            return list(self.cl.list_tenants())
+        if self.cl.api_version == 3:
+            return list(self.cl.keystone.projects.list(name=self.experimenter))
+        return [project for project in self.cl.list_tenants() if project.name == self.experimenter]
+
+    def list_tenants(self):
+        return list(self._get('tenants', self._fetch_tenants))
+
+    def _fetch_security_groups(self):
+        return _index_by_project(self.cl.neutron.list_security_groups(**self._tenant_filter()).get('security_groups'))
+
+    def list_sec_group(self, project_id):
+        return list(self._get('security_groups', self._fetch_security_groups).get(project_id, []))
+
+    def _fetch_networks(self):
+        networks = self.cl.neutron.list_networks(retrieve_all=True).get('networks')
+        common = [net for net in networks if net.get('shared') or net.get('router:external')]
+        private = _index_by_project(
+            [net for net in networks if not (net.get('shared') or net.get('router:external'))])
+        return common, private
+
+    def list_networks(self, project_id=None):
+        common, private = self._get('networks', self._fetch_networks)
+        return list(private.get(project_id, [])) + list(common)
+
+    def list_common_networks(self):
+        """
+        :return: the shared and external networks, which every project sees
+        """
+        return list(self._get('networks', self._fetch_networks)[0])
+
+    def list_private_networks(self, project_id):
+        return list(self._get('networks', self._fetch_networks)[1].get(project_id, []))
+
+    def _fetch_floating_ips(self):
+        return _index_by_project(iter_floatingips(self.cl, self.page_size, **self._tenant_filter()))
+
+    def list_floatingips(self, project_id):
+        return list(self._get('floating_ips', self._fetch_floating_ips).get(project_id, []))
+
+    def _fetch_servers(self):
+        search_opts = {'all_tenants': 1}
+        search_opts.update(self._tenant_filter())
+        return _index_by_project(iter_servers(self.cl, search_opts, self.page_size))
+
+    def list_server(self, project_id):
+        return list(self._get('servers', self._fetch_servers).get(project_id, []))
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FSYNC_BATCH = 50
+DEFAULT_FSYNC_INTERVAL = 1.0
+
+
+class Journal(object):
+    """
+    Append-only record of the actions of one run, so that an interrupted run can be resumed.
+
+    Every line is one JSON event. A work unit, a check of one project of one testbed or of a whole testbed if the
+    project is None, can have a plan event listing the actions it is going to take, a done event per action it took and
+    a complete event once it is finished. A run starts with a begin event, which empties the journal, and ends with an
+    end event; a resumed run adds a resume event instead of starting over.
+
+    Every event is written to the file at once, so it survives the process being killed, and the file is fsync'd every
+    fsync_batch events or fsync_interval seconds, whichever comes first, so that at most that many events are lost if
+    the machine goes down. A line cut short by a crash is dropped when the journal is read.
+    """
+
+    def __init__(self, path, fsync_batch=DEFAULT_FSYNC_BATCH, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.fsync_interval = float(fsync_interval)
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._completed = {}
+        self._planned = {}
+        self._done = {}
+
+    def _read(self):
+        """
+        Loads the events of the last run.
+        :return: (True if that run ended, the length of the valid part of the file)
+        """
+        ended = False
+        valid = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    event = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    log.warning('Ignoring the end of the journal {} after {} bytes, it was cut short'.format(
+                        self.path, valid))
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid += len(line)
+                unit = (event.get('testbed'), event.get('check'), event.get('project'))
+                if event.get('event') == 'plan':
+                    self._planned[unit] = event.get('actions') or []
+                elif event.get('event') == 'done':
+                    self._done.setdefault(unit, {})[(event.get('kind'), event.get('id'))] = event.get('successful')
+                elif event.get('event') == 'complete':
+                    self._completed[unit] = event.get('successful')
+                ended = event.get('event') == 'end'
+        return ended, valid
+
+    def begin(self, resume=False):
+        """
+        Opens the journal for a new run or, if resume is True and the last run did not end, for the rest of that run.
+        :return: True if a run is resumed
+        """
+        with self._lock:
+            resumed = False
+            if resume and os.path.isfile(self.path):
+                ended, valid = self._read()
+                if ended:
+                    log.info('The last run of the journal {} ended, there is nothing to resume'.format(self.path))
+                else:
+                    resumed = True
+            if resumed:
+                log.info('Resuming the run of the journal {}: {} units complete, {} planned'.format(
+                    self.path, len(self._completed), len(self._planned)))
+                self._file = open(self.path, 'r+b')
+                self._file.truncate(valid)
+                self._file.seek(valid)
+            else:
+                self._completed, self._planned, self._done = {}, {}, {}
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._file = open(self.path, 'wb')
+            self._write({'event': 'resume' if resumed else 'begin', 'time': time.time()}, True)
+            return resumed
+
+    def _write(self, event, sync=False):
+        if self._file is None:
+            return
+        self._file.write((json.dumps(event, sort_keys=True, default=str) + '\n').encode('utf-8'))
+        self._file.flush()
+        self._unsynced += 1
+        if sync or self._unsynced >= self.fsync_batch or \
+                time.monotonic() - self._synced_at >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._synced_at = time.monotonic()
+
+    def _event(self, name, testbed_name, check, project_id, **fields):
+        event = dict(fields, event=name, testbed=testbed_name, check=check, project=project_id)
+        with self._lock:
+            try:
+                self._write(event)
+            except (IOError, OSError) as e:
+                # the run goes on, it just cannot be resumed where it stopped
+                log.error('Exception while writing to the journal {}: {}'.format(self.path, e))
+
+    def completed(self, testbed_name, check, project_id=None):
+        """
+        :return: None if the resumed run did not complete the unit, otherwise whether the unit was successful
+        """
+        with self._lock:
+            return self._completed.get((testbed_name, check, project_id))
+
+    def remaining(self, testbed_name, check, project_id=None):
+        """
+        :return: the planned actions of the unit that the resumed run did not take or that failed, None if it did not
+        plan the unit
+        """
+        with self._lock:
+            unit = (testbed_name, check, project_id)
+            if unit not in self._planned:
+                return None
+            done = self._done.get(unit, {})
+            return [action for action in self._planned.get(unit)
+                    if not done.get((action.get('kind'), action.get('id')))]
+
+    def plan(self, testbed_name, check, project_id, actions):
+        """
+        :param actions: dicts with the kind and the id of the resource and whatever else is needed to take the action
+        without looking the resource up again
+        """
+        self._event('plan', testbed_name, check, project_id, actions=list(actions))
+
+    def done(self, testbed_name, check, project_id, kind, resource_id, successful=True):
+        self._event('done', testbed_name, check, project_id, kind=kind, id=resource_id, successful=successful)
+
+    def complete(self, testbed_name, check, project_id=None, successful=True):
+        self._event('complete', testbed_name, check, project_id, successful=bool(successful))
+
+    def recorder(self, testbed_name, check, project_id=None):
+        """
+        :return: a function taking (kind, resource ID, successful) that records the actions of the unit
+        """
+        def record(kind, resource_id, successful=True):
+            self.done(testbed_name, check, project_id, kind, resource_id, successful)
+        return record
+
+    def end(self):
+        """
+        Marks the run as ended, so that it is not resumed, and closes the journal.
+        """
+        with self._lock:
+            self._write({'event': 'end', 'time': time.time()}, True)
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._file.close()
+                    self._file = None
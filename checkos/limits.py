@@ -0,0 +1,362 @@
+import logging
+import random
+import threading
+import time
+import types
+
+from checkos import tracing
+from checkos.metrics import NESTED_CLIENTS, OS_CLIENT_SERVICES
+
+log = logging.getLogger(__name__)
+
+# the settings of a limiter unless the limits section of the config file says otherwise
+DEFAULTS = {
+    'concurrency': 8,
+    'min-concurrency': 1,
+    'max-concurrency': 64,
+    'rate': None,
+    'burst': None,
+    'retries': 3,
+    'backoff': 0.5,
+    'max-backoff': 10.0,
+}
+
+CIRCUIT_BREAKER_DEFAULTS = {
+    'failures': 10,
+    'reset': 60.0,
+}
+
+# overload, or a gateway in front of a busy service; the calls are slowed down and count towards the circuit breaker
+TRANSIENT_STATUSES = frozenset([429, 502, 503, 504])
+
+# the service turned the request away, so it was not processed; a 502 or 504 only says that a gateway gave up
+# waiting, the service may have processed the request anyway
+REJECTED_STATUSES = frozenset([429, 503])
+
+# how a call is retried after a transient error: a read whatever the error, a write only if it was rejected or the
+# connection could not be made, so that nothing is created twice, and an upload never, as its file object would be
+# sent on from where the failed attempt left it
+READ = 'read'
+WRITE = 'write'
+NO_RETRY = 'no retry'
+
+READ_PREFIXES = ('list', 'get', 'show', 'find')
+NOT_RETRIED = frozenset(['upload', 'upload_image'])
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a testbed whose circuit breaker is open.
+    """
+    pass
+
+
+def _status_of(error):
+    # neutronclient sets status_code, keystoneauth1 http_status, novaclient and glanceclient code
+    for attribute in ('status_code', 'http_status', 'code'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def is_transient(error):
+    """
+    :return: True if the call failed because the service is overloaded or could not be reached
+    """
+    if _status_of(error) in TRANSIENT_STATUSES:
+        return True
+    return isinstance(error, ConnectionError) or type(error).__name__ in ('ConnectFailure', 'ConnectionError')
+
+
+def _not_connected(error):
+    # keystoneauth1 raises ConnectFailure, and its subclass ConnectTimeout, when no connection could be made
+    return isinstance(error, ConnectionRefusedError) or type(error).__name__ in ('ConnectFailure', 'ConnectTimeout')
+
+
+def call_kind(method_name):
+    """
+    :return: READ, WRITE or NO_RETRY for a method of a client
+    """
+    if method_name in NOT_RETRIED:
+        return NO_RETRY
+    if method_name.startswith(READ_PREFIXES):
+        return READ
+    return WRITE
+
+
+def is_retryable(error, kind):
+    """
+    :param kind: READ, WRITE or NO_RETRY, see call_kind
+    :return: True if a call of that kind that failed with error can be sent again
+    """
+    if kind == NO_RETRY:
+        return False
+    if kind == READ:
+        return is_transient(error)
+    status = _status_of(error)
+    if status is not None:
+        return status in REJECTED_STATUSES
+    return _not_connected(error)
+
+
+class TokenBucket(object):
+    """
+    Allows rate calls per second on average and bursts of up to burst calls.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limits the calls in flight with additive increase and multiplicative decrease: every successful call raises the
+    limit by 1/limit, so by about one per round of calls, and an overload halves it. Only calls that started after the
+    last decrease can decrease it again, so one burst of errors halves the limit once.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.limit = float(min(max(int(initial), self.minimum), self.maximum))
+        self.in_flight = 0
+        self._decreased = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        :return: the time the call started, to be passed to release
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, overloaded=False):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                if started >= self._decreased:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self._decreased = time.monotonic()
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failures transient errors in a row; while it is open, calls fail at once with CircuitOpenError. After
+    reset seconds one call is let through, which closes the breaker if it gets a response and opens it again if not.
+    """
+
+    def __init__(self, name, failures=10, reset=60.0):
+        self.name = name
+        self.failures = max(1, int(failures))
+        self.reset = float(reset)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened = None
+        self._trial = False
+
+    def check(self):
+        with self._lock:
+            if self._opened is None:
+                return
+            if self._trial or time.monotonic() - self._opened < self.reset:
+                raise CircuitOpenError('Circuit breaker of {} is open after {} failed calls'.format(self.name,
+                                                                                                   self._count))
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            if self._opened is not None:
+                log.info('Circuit breaker of {} closed'.format(self.name))
+            self._count = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or (self._opened is None and self._count >= self.failures):
+                log.warning('Circuit breaker of {} opened after {} failed calls, skipping it for {}s'.format(
+                    self.name, self._count, self.reset))
+                self._opened = time.monotonic()
+                self._trial = False
+
+
+class Limiter(object):
+    """
+    Limits the calls to one service of one testbed: a token bucket caps the rate, if configured, and
+    AdaptiveConcurrency the calls in flight. Calls failing with a transient error are retried with exponential
+    backoff and full jitter, writes only if the error shows that they were not processed, see is_retryable. The
+    circuit breaker is shared by all services of the testbed.
+    """
+
+    def __init__(self, name, settings, breaker):
+        self.name = name
+        self.concurrency = AdaptiveConcurrency(settings.get('concurrency'), settings.get('min-concurrency'),
+                                               settings.get('max-concurrency'))
+        self.bucket = TokenBucket(settings.get('rate'), settings.get('burst')) if settings.get('rate') else None
+        self.retries = int(settings.get('retries') or 0)
+        self.backoff = float(settings.get('backoff') or 0)
+        self.max_backoff = float(settings.get('max-backoff') or 0)
+        self.breaker = breaker
+
+    def acquire(self):
+        self.breaker.check()
+        if self.bucket is not None:
+            self.bucket.acquire()
+        return self.concurrency.acquire()
+
+    def release(self, started, error=None):
+        """
+        :return: True if the call failed with a transient error
+        """
+        transient = error is not None and is_transient(error)
+        self.concurrency.release(started, transient)
+        if transient:
+            self.breaker.failure()
+        else:
+            # any response, an error one included, shows that the testbed is up
+            self.breaker.success()
+        return transient
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function as a WRITE, see call_as.
+        """
+        return self.call_as(WRITE, function, *args, **kwargs)
+
+    def call_as(self, kind, function, *args, **kwargs):
+        """
+        :param kind: READ, WRITE or NO_RETRY, which decides the errors after which the call is sent again
+        """
+        attempt = 0
+        while True:
+            started = self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                self.release(started, e)
+                if not is_retryable(e, kind) or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                attempt += 1
+                log.warning('Call to {} failed: {}, retry {} of {} in {:.2f}s'.format(self.name, e, attempt,
+                                                                                    self.retries, delay))
+                tracing.sleep(delay)
+                continue
+            self.release(started)
+            if isinstance(result, types.GeneratorType):
+                return _limited_generator(result, self)
+            return result
+
+
+def _limited_generator(generator, limiter):
+    # a generator cannot be resumed after it raised, so the pages of a listing are limited but not retried
+    while True:
+        started = limiter.acquire()
+        try:
+            item = next(generator)
+        except StopIteration:
+            limiter.release(started)
+            return
+        except Exception as e:
+            limiter.release(started, e)
+            raise
+        limiter.release(started)
+        yield item
+
+
+class Limits(object):
+    """
+    The limiters of all testbeds and services, created when they are first needed, with the settings compiled from
+    the limits and circuit_breaker sections of the config file.
+    """
+
+    def __init__(self, policy=None):
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._breakers = {}
+        self._settings = {}
+        self._breaker_settings = dict(CIRCUIT_BREAKER_DEFAULTS)
+        if policy is not None:
+            self.configure(policy)
+
+    def configure(self, policy):
+        """
+        Takes the settings from a newly compiled policy. The limiters start over, the circuit breakers are kept.
+        """
+        with self._lock:
+            self._settings = {testbed_name: policy.testbed(testbed_name).limits
+                              for testbed_name in policy.testbeds()}
+            self._breaker_settings = dict(CIRCUIT_BREAKER_DEFAULTS, **policy.circuit_breaker)
+            self._limiters = {}
+
+    def limiter(self, testbed_name, service):
+        with self._lock:
+            limiter = self._limiters.get((testbed_name, service))
+            if limiter is None:
+                breaker = self._breakers.get(testbed_name)
+                if breaker is None:
+                    breaker = self._breakers[testbed_name] = CircuitBreaker(
+                        testbed_name, self._breaker_settings.get('failures'), self._breaker_settings.get('reset'))
+                limits = self._settings.get(testbed_name) or {}
+                settings = dict(DEFAULTS, **(limits.get('default') or {}))
+                settings.update(limits.get(service) or {})
+                limiter = self._limiters[(testbed_name, service)] = Limiter(
+                    '{} of testbed {}'.format(service, testbed_name), settings, breaker)
+            return limiter
+
+
+class LimitedClient(object):
+    """
+    Wraps a client so that every call of one of its public methods, and of the methods of its nested clients, goes
+    through the limiter of its testbed and service. Everything else goes to the wrapped client unchanged.
+    :param service: the service of the calls, None to look it up per method in OS_CLIENT_SERVICES
+    """
+
+    def __init__(self, target, limits, testbed_name, service=None):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_limits', limits)
+        object.__setattr__(self, '_testbed_name', testbed_name)
+        object.__setattr__(self, '_service', service)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith('_'):
+            return value
+        if name in NESTED_CLIENTS and not callable(value):
+            return LimitedClient(value, self._limits, self._testbed_name, self._service or name)
+        if not callable(value):
+            return value
+        limiter = self._limits.limiter(self._testbed_name, self._service or OS_CLIENT_SERVICES.get(name, 'openstack'))
+        kind = call_kind(name)
+
+        def limited(*args, **kwargs):
+            return limiter.call_as(kind, value, *args, **kwargs)
+
+        return limited
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
@@ -2,31 +2,41 @@ import argparse
 import json
 import logging.config
 import os
+import sqlite3
 import sys
-import time
-import yaml
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from keystoneauth1.exceptions import Unauthorized
-from org.openbaton.sdk.client import OBClient
-
-from sdk.softfire.exp_man_client import ExpManClient
-from sdk.softfire.os_utils import OSClient
+from checkos import clients, tracing
+from checkos.floating_ips import FloatingIpReclaimer
+from checkos.images import DigestCache, ImageSync
+from checkos.inventory import Inventory
+from checkos.journal import DEFAULT_FSYNC_BATCH, DEFAULT_FSYNC_INTERVAL, Journal
+from checkos.limits import Limits
+from checkos.metrics import Metrics
+from checkos.networks import NetworkVerifier, is_common
+from checkos.nfvo import NfvoSessionPool
+from checkos.policy import ConfigError, compile_policy, load_config
+from checkos.resources import ExperimentManagerSnapshot
+from checkos.results import CHECK, CHECKS, DEFERRED, EXCEPTION, FLOATING_IP, IMAGE, NETWORK, NSD, NSR, \
+    SECURITY_GROUP, VM, RENDERERS, ResultStore, ResultsFileError, TextRenderer, create_renderer, merge_results, \
+    read_results, write_results
+from checkos.schedule import Scheduler
+from checkos.security_groups import SecurityGroupReconciler
+from checkos.shard import parse_shard
+from checkos.state import DEFAULT_TTL as DEFAULT_STATE_TTL, StateStore, fingerprint
+from checkos.teardown import TeardownEngine
+from checkos.tokens import DEFAULT_MARGIN as DEFAULT_TOKEN_MARGIN, TokenCache
+from checkos.workers import map_bounded
+from checkos.zombies import PlanError, ZombieDiff, apply_plan, create_plan, read_plan, write_plan
 
 log = logging.getLogger(__name__)
 
-image_list = list()
-sec_grp_list = list()
-network_list = list()
-float_list = list()
-master = list()
-
-network_not_matched_list = list()
-sec_grp_not_matched_list = list()
-images_uploaded = list()
-
 
 def check_testbeds(testbeds, config, check_images, check_security_group, check_networks, check_floating_ip,
-                   check_vm_zombie, dry_run, experimenter=None):
+                   check_vm_zombie, dry_run, experimenter=None, parallel_testbeds=1, project_workers=None,
+                   state_dir=None, full=False, renderer=None, shard=None, results_file=None, journal=None,
+                   resume=False, deadline=None):
     """
     :param testbeds:
     :param config:
@@ -37,410 +47,597 @@ def check_testbeds(testbeds, config, check_images, check_security_group, check_n
     :param check_vm_zombie:
     :param dry_run:
     :param experimenter: if not None, then checks are only executed for this experimenter name
+    :param parallel_testbeds: number of testbeds that are checked concurrently
+    :param project_workers: number of projects that are checked concurrently on each testbed, and of workers of the
+    image, security group, floating IP and teardown pools whose section of the config file does not set workers;
+    project_workers of the config file wins for its testbeds. None for one project at a time and the default pools
+    :param state_dir: if not None, the directory of the state store used to skip the projects that did not change
+    since the last run
+    :param full: if True, no project is skipped, even if it did not change
+    :param renderer: the renderer of the results, see checkos.results; the text report if None
+    :param shard: if not None, only the work units of this Shard are checked, see checkos.shard
+    :param results_file: if not None, the records are also written to this file, so that the results of all shards
+    can be merged with merge_results
+    :param journal: if not None, the Journal the actions of a run that is not dry are recorded in
+    :param resume: if True, the run recorded in the journal is continued if it did not end
+    :param deadline: the number of seconds the run may take, overrides schedule.deadline of the config file; once
+    they are over, the units that did not start are deferred, see checkos.schedule
     :return:
+    :raise ConfigError: if the config does not have the expected structure, before anything is checked
     """
     log.info("Starting the Check OS tool...")
-    nsd_results = {}
-    nsr_results = {}
-    vm_results = {}
-    check_vm_zombie_exceptions = {}
-    ignored_projects_in_any_tb = config.get('ignore_projects').get('any') if config.get(
-        'ignore_projects') is not None and config.get('ignore_projects').get('any') is not None else []
-    fip_results = {}
-    for testbed_name, testbed in testbeds.items():
+    policy = compile_policy(config, testbeds)
+    renderer = renderer or TextRenderer()
+    renderer.start()
+    shared = create_shared(policy, check_images, check_vm_zombie, state_dir, full)
+    if journal is not None and not dry_run:
+        try:
+            journal.begin(resume)
+            shared['journal'] = journal
+        except (IOError, OSError) as e:
+            log.warning('Cannot open the journal {}, the run cannot be resumed: {}'.format(journal.path, e))
+    scheduler = None
+    if deadline is not None or policy.schedule:
+        if deadline is None:
+            deadline = policy.schedule.get('deadline')
+        scheduler = Scheduler(policy.schedule.get('priorities'), deadline, shared.get('state'))
+    try:
+        results = run_checks(testbeds, config, check_images, check_security_group, check_networks, check_floating_ip,
+                             check_vm_zombie, dry_run, experimenter, parallel_testbeds, project_workers, shared,
+                             renderer, policy, shard, scheduler)
+        if shared.get('journal') is not None:
+            journal.end()
+    finally:
+        close_shared(shared)
+    print_results(results, check_images, check_security_group, check_networks, check_floating_ip, check_vm_zombie,
+                  renderer)
+    if results.records(DEFERRED):
+        log.warning('The time ran out, {} work units were deferred to the next run'.format(
+            len(results.records(DEFERRED))))
+    if results_file:
+        write_results(results, results_file, _checks(check_images, check_security_group, check_networks,
+                                                     check_floating_ip, check_vm_zombie),
+                      list(testbeds), shard)
+    if results.failed():
+        sys.exit(1)
+
+
+def create_shared(policy, check_images, check_vm_zombie, state_dir=None, full=False):
+    """
+    Creates the objects shared by all testbeds, so that experimenters and resources are fetched, the NFVO is logged
+    into, the zombie NSRs of an NFVO project are removed and image files are hashed only once per run.
+    :param policy: the compiled config
+    :return: a dict that can be passed to run_checks
+    """
+    shared = {'os_clients': {}}
+    check_vm = policy.check_vm
+    if check_vm_zombie and check_vm is not None:
+        shared['exp_man'] = ExperimentManagerSnapshot(check_vm.experiment_manager)
+        shared['nfvo'] = NfvoSessionPool(check_vm.nfvo)
+        shared['zombie_diff'] = ZombieDiff(shared.get('exp_man'), shared.get('nfvo'), check_vm.ignored_vm_ids,
+                                           check_vm.ignored_nsr_ids)
+    if check_images:
+        shared['digest_cache'] = DigestCache(policy.image_sync.get("digest-cache"))
+    if state_dir:
+        try:
+            shared['state'] = StateStore(state_dir, policy.state.get("ttl", DEFAULT_STATE_TTL), full)
+        except (OSError, sqlite3.Error) as e:
+            log.warning('Cannot open the state store in {}, no project is skipped: {}'.format(state_dir, e))
+    return shared
+
+
+def close_shared(shared):
+    if shared.get('journal') is not None:
+        shared.get('journal').close()
+    if shared.get('state') is not None:
+        shared.get('state').expire()
+        shared.get('state').close()
+
+
+def run_checks(testbeds, config, check_images, check_security_group, check_networks, check_floating_ip,
+               check_vm_zombie, dry_run, experimenter=None, parallel_testbeds=1, project_workers=None, shared=None,
+               renderer=None, policy=None, shard=None, scheduler=None):
+    """
+    Executes the selected checks on the testbeds, see check_testbeds.
+    :param shared: the objects created by create_shared
+    :param renderer: if not None, every record is passed to it as soon as it is produced
+    :param policy: the config compiled by compile_policy for the testbeds, compiled from config if None
+    :param shard: if not None, only the work units of this Shard are checked
+    :param scheduler: if not None, the Scheduler that orders the checks and defers them once the time is up; the
+    checks are then run one after the other on all testbeds instead of all checks on one testbed after the other
+    :return: the ResultStore with the records of all testbeds
+    """
+    policy = policy or compile_policy(config, testbeds)
+    parallel_testbeds = max(1, parallel_testbeds or 1)
+    listeners = [renderer.record] if renderer is not None else []
+    flags = [check_images, check_security_group, check_networks, check_floating_ip, check_vm_zombie]
+    steps = [flags]
+    if scheduler is not None:
+        steps = [[check == name for name in CHECKS] for check in scheduler.checks(_checks(*flags))]
+        # every testbed is visited once per check, its projects and resources are only listed the first time
+        shared = dict(shared or {}, scheduler=scheduler, inventories={})
+    results = ResultStore()
+    with ThreadPoolExecutor(max_workers=parallel_testbeds) as executor:
+        for step in steps:
+            futures = [executor.submit(_check_testbed, testbed_name, testbed, policy, *step, dry_run=dry_run,
+                                       experimenter=experimenter, project_workers=project_workers, shared=shared,
+                                       listeners=listeners, shard=shard)
+                       for testbed_name, testbed in testbeds.items()]
+            # merge in the order of the credentials file so that the report does not depend on scheduling
+            for future in futures:
+                results.extend(future.result())
+    if scheduler is not None:
+        deferred = ResultStore(listeners)
+        # in the order of the credentials file, like the other records, not in the order the testbeds got there
+        testbed_names = list(testbeds)
+        for testbed_name, check, project, item in sorted(scheduler.deferred(),
+                                                          key=lambda unit: testbed_names.index(unit[0])):
+            deferred.add(testbed_name, project.name if project is not None else None, DEFERRED, check, True, item)
+        results.extend(deferred)
+    return results
+
+
+def print_results(results, check_images, check_security_group, check_networks, check_floating_ip, check_vm_zombie,
+                  renderer=None):
+    checks = _checks(check_images, check_security_group, check_networks, check_floating_ip, check_vm_zombie)
+    (renderer or TextRenderer()).finish(results, checks)
+
+
+def _checks(check_images, check_security_group, check_networks, check_floating_ip, check_vm_zombie):
+    return [check for check, enabled in zip(CHECKS, [check_images, check_security_group, check_networks,
+                                                     check_floating_ip, check_vm_zombie]) if enabled]
+
+
+def _check_testbed(testbed_name, testbed, policy, check_images, check_security_group, check_networks,
+                   check_floating_ip, check_vm_zombie, dry_run, experimenter=None, project_workers=None, shared=None,
+                   listeners=None, shard=None):
+    """
+    Executes the selected checks on one testbed. Nothing in here writes to module level state, so that multiple
+    testbeds can be checked concurrently.
+    :param policy: the compiled config, see compile_policy
+    :param shared: the objects shared by all testbeds of the run, see check_testbeds
+    :param listeners: called with every record as soon as it is produced
+    :param shard: if not None, only the work units of this Shard are checked
+    :return: a ResultStore with the records of the testbed
+    """
+    result = ResultStore(listeners)
+    thread = threading.current_thread()
+    thread_name = thread.name
+    thread.name = testbed_name
+    try:
+        with tracing.span(testbed_name, 'testbed'):
+            _run_testbed_checks(result, testbed_name, testbed, policy, check_images, check_security_group,
+                                check_networks, check_floating_ip, check_vm_zombie, dry_run, experimenter,
+                                project_workers, shared or {}, shard)
+    except Exception as e:
+        log.error('Exception while checking testbed {}: {}'.format(testbed_name, e))
+        result.add(testbed_name, None, EXCEPTION, 'testbed', False, str(e))
+        result.add(testbed_name, None, CHECK, 'testbed', False)
+        # do not keep reusing a client that may be broken
+        (shared or {}).get('os_clients', {}).pop(testbed_name, None)
+    finally:
+        thread.name = thread_name
+    return result
+
+
+def _run_testbed_checks(result, testbed_name, testbed, policy, check_images, check_security_group, check_networks,
+                        check_floating_ip, check_vm_zombie, dry_run, experimenter, project_workers, shared,
+                        shard=None):
+    os_clients = shared.get('os_clients', {})
+    cl = os_clients.get(testbed_name)
+    if cl is None:
         try:
-            cl = OSClient(testbed_name, testbed, None, testbed.get("admin_project_id"))
+            with tracing.span('create OpenStack client', 'client'):
+                cl = clients.os_client(testbed_name, testbed)
         except Exception as e:
             log.error('Exception while creating the OpenStack client for testbed {}: {}'.format(testbed_name, e))
             log.warning('Skipping testbed {}.'.format(testbed_name))
-            continue
-        log.info("Checking Testbed %s" % testbed_name)
-        ignored_projects = config.get('ignore_projects').get(testbed_name) if config.get(
-            'ignore_projects') is not None and config.get('ignore_projects').get(
-            testbed_name) is not None else []
-        ignored_projects.extend(ignored_projects_in_any_tb)
-
-        if check_images:
-            log.info("~~~~~~~~~~~~~~~~~~~~Check & Update Images~~~~~~~~~~~~~~~~~~~~~~")
-            for project in cl.list_tenants():
-                if experimenter is not None and project.name != experimenter:
-                    continue
-                if project.name in ignored_projects:
-                    log.info('Ignoring project {}'.format(project.name))
-                    continue
+            return
+        os_clients[testbed_name] = cl
+    log.info("Checking Testbed %s" % testbed_name)
+    plan = policy.testbed(testbed_name)
+    check_vm = policy.check_vm
+    project_workers = plan.project_workers or project_workers
+    inventories = shared.get('inventories')
+    inventory = inventories.get(testbed_name) if inventories is not None else None
+    if inventory is None or inventory.cl is not cl:
+        inventory = Inventory(cl, experimenter)
+        if inventories is not None:
+            inventories[testbed_name] = inventory
+    state = shared.get('state')
+    journal = shared.get('journal')
+    scheduler = shared.get('scheduler')
+    ignored_projects = plan.ignored_projects
+
+    if check_images and _owns(shard, testbed_name, None, 'images') and _admit(scheduler, testbed_name, 'images'):
+        log.info("~~~~~~~~~~~~~~~~~~~~Check & Update Images~~~~~~~~~~~~~~~~~~~~~~")
+        with tracing.span('images', 'phase'):
+            completed = journal.completed(testbed_name, 'images') if journal is not None else None
+            if completed is not None:
+                log.info('Images of testbed {} were checked before the run was interrupted'.format(testbed_name))
+                result.add(testbed_name, None, CHECK, 'images', completed)
+            else:
+                projects = _select_projects(inventory.list_tenants(), ignored_projects, experimenter)
+                uploaded = []
+                deferred = []
+                admit = None
+                if scheduler is not None:
+                    def admit(name, project):
+                        if scheduler.admit(testbed_name, 'images', project, name):
+                            return True
+                        deferred.append(name)
+                        return False
+
                 im = check_and_upload_images(cl,
-                                             config.get("images").get(testbed_name),
-                                             config.get("images").get("any"),
-                                             project.id,
-                                             project.name,
-                                             dry_run)
-
-                image_list.append(im)
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-
-        if check_security_group:
-            log.info("~~~~~~~~~~~~~~~~~~~~Check & Update Security Group~~~~~~~~~~~~~~~~~~~~~~")
-            for project in cl.list_tenants():
-                if experimenter is not None and project.name != experimenter:
-                    continue
-                if project.name not in ignored_projects:
-                    sg = check_and_add_sec_grp(cl, config.get("security_group").get(testbed_name),
-                                               config.get("security_group").get("any"), project.id, project.name)
-                    sec_grp_list.append(sg)
-                else:
-                    log.info("Ignoring project %s" % project.name)
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-
-        if check_networks:
-            log.info("~~~~~~~~~~~~~~~~~~~~Check Networks~~~~~~~~~~~~~~~~~~~~~~")
-            for project in cl.list_tenants():
-                if experimenter is not None and project.name != experimenter:
-                    continue
-                if project.name in ignored_projects:
-                    log.info('Ignoring project {}'.format(project.name))
+                                             plan.images,
+                                             None,
+                                             projects,
+                                             dry_run,
+                                             uploaded_list=uploaded,
+                                             image_sync_dict=_with_workers(policy.image_sync, project_workers),
+                                             digest_cache=shared.get('digest_cache'),
+                                             journal=journal,
+                                             admit=admit)
+                for name in uploaded:
+                    result.add(testbed_name, None, IMAGE, name)
+                result.add(testbed_name, None, CHECK, 'images', im)
+                if journal is not None and not deferred:
+                    journal.complete(testbed_name, 'images', None, im)
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+
+    if check_security_group and _admit(scheduler, testbed_name, 'security_group'):
+        log.info("~~~~~~~~~~~~~~~~~~~~Check & Update Security Group~~~~~~~~~~~~~~~~~~~~~~")
+        with tracing.span('security_group', 'phase'):
+            expected_sec_grps = sorted(plan.security_groups)
+
+            def security_group_fingerprint(project):
+                return fingerprint(expected_sec_grps,
+                                   sorted(sec.get('name') for sec in inventory.list_sec_group(project.id)))
+
+            projects, _ = _select_changed(
+                state, testbed_name, 'security_group',
+                _ordered(scheduler, testbed_name, 'security_group', _sharded(
+                    shard, testbed_name, 'security_group',
+                    _select_projects(inventory.list_tenants(), ignored_projects, experimenter))),
+                security_group_fingerprint)
+            sync = _with_workers(policy.security_group_sync, project_workers)
+            reconciler = SecurityGroupReconciler(cl, inventory, plan.security_group_rules, sync.get('workers'),
+                                                 sync.get('batch-size'), dry_run)
+            admit = _admission(scheduler, testbed_name, 'security_group')
+            missing = {}
+            for project, name, error in reconciler.reconcile(expected_sec_grps, projects, admit):
+                missing.setdefault(project.id, []).append((name, error))
+            for project in projects:
+                if admit is not None and admit.deferred(project):
                     continue
-                net = check_os_networks(cl, config.get("networks").get(testbed_name), project.id, project.name)
+                sg = True
+                for name, error in missing.get(project.id, []):
+                    # in a dry run the group is still missing
+                    created = error is None and not dry_run
+                    result.add(testbed_name, project.name, SECURITY_GROUP, name, created, error)
+                    sg = sg and created
+                result.add(testbed_name, project.name, CHECK, 'security_group', sg)
+                # the reconciler dropped the security groups from the inventory, they are listed again with the new
+                # ones
+                _record_check(state, dry_run, testbed_name, project, 'security_group', security_group_fingerprint, sg,
+                              lambda project: [sec.get('id') for sec in inventory.list_sec_group(project.id)])
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+
+    if check_networks and _admit(scheduler, testbed_name, 'networks'):
+        log.info("~~~~~~~~~~~~~~~~~~~~Check Networks~~~~~~~~~~~~~~~~~~~~~~")
+        with tracing.span('networks', 'phase'):
+            # shared and external networks are the same for every project, so they are checked once for the testbed
+            verifier = NetworkVerifier(plan.networks, inventory.list_common_networks())
+            if _owns(shard, testbed_name, None, 'networks'):
+                for network in verifier.missing_common:
+                    result.add(testbed_name, None, NETWORK, network.get('name'), False, dict(network))
+                if verifier.common_expected:
+                    result.add(testbed_name, None, CHECK, 'networks', not verifier.missing_common)
+
+            def check_project_networks(project):
+                not_matched = []
+                net = check_os_networks(cl, plan.networks, project.id, project.name,
+                                        not_matched_list=not_matched, inventory=inventory, verifier=verifier)
+                return net, not_matched
 
-                network_list.append(net)
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+            def network_fingerprint(project):
+                return fingerprint([dict(network) for network in plan.networks],
+                                   sorted([net.get('name'), net.get('shared'), net.get('router:external')]
+                                          for net in inventory.list_private_networks(project.id)))
 
-        if check_floating_ip:
-            log.info("~~~~~~~~~~~~~~~~~~~~Check Floating Ips~~~~~~~~~~~~~~~~~~~~~~")
+            projects, fingerprints = _select_changed(
+                state, testbed_name, 'networks',
+                _ordered(scheduler, testbed_name, 'networks', _sharded(
+                    shard, testbed_name, 'networks',
+                    _select_projects(inventory.list_tenants(), ignored_projects, experimenter))),
+                network_fingerprint)
+            checked = _map_projects(check_project_networks, projects, project_workers or 1,
+                                    _admission(scheduler, testbed_name, 'networks'))
+            for project, outcome in zip(projects, checked):
+                if outcome is None:
+                    continue
+                net, not_matched = outcome
+                for network in not_matched:
+                    result.add(testbed_name, project.name, NETWORK, network.get('name'), False, dict(network))
+                result.add(testbed_name, project.name, CHECK, 'networks', net)
+                # the networks check changes nothing, the fingerprint is the one it started from
+                _record_check(state, dry_run, testbed_name, project, 'networks',
+                              lambda project: fingerprints.get(project.id), net,
+                              lambda project: [net.get('id') for net in inventory.list_private_networks(project.id)])
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+
+    if check_floating_ip and _admit(scheduler, testbed_name, 'floating_ip'):
+        log.info("~~~~~~~~~~~~~~~~~~~~Check Floating Ips~~~~~~~~~~~~~~~~~~~~~~")
+        with tracing.span('floating_ip', 'phase'):
             log.debug('Testbed: {}'.format(testbed_name))
             try:
-                for project in cl.list_tenants():
-                    if experimenter is not None and project.name != experimenter:
-                        continue
-                    if project.name in ignored_projects:
-                        log.info('Ignoring project {}'.format(project.name))
-                        continue
-                    released_fips, exception = check_floating_ips(cl, project.id, project.name, config.get("ignore_floating_ips").get(testbed_name),
-                                             config.get("ignore_floating_ips").get("any"),
-                                             dry_run)
-                    if fip_results.get(testbed_name) is None:
-                        fip_results[testbed_name] = {}
-                    if fip_results.get(testbed_name).get(project.name) is None:
-                        fip_results.get(testbed_name)[project.name] = {'released': [], 'exceptions':[]}
-                    if released_fips is not None:
-                        fip_results.get(testbed_name).get(project.name).get('released').extend(released_fips)
+                ignored_fips = sorted(plan.ignored_floating_ips)
+
+                def floating_ip_fingerprint(project):
+                    return fingerprint(ignored_fips,
+                                       sorted([fip.get('id'), fip.get('floating_ip_address'),
+                                               fip.get('fixed_ip_address')]
+                                              for fip in inventory.list_floatingips(project.id)))
+
+                projects, _ = _select_changed(
+                    state, testbed_name, 'floating_ip',
+                    _ordered(scheduler, testbed_name, 'floating_ip', _unfinished(
+                        journal, testbed_name, 'floating_ip', _sharded(
+                            shard, testbed_name, 'floating_ip',
+                            _select_projects(inventory.list_tenants(), ignored_projects, experimenter)))),
+                    floating_ip_fingerprint)
+                sync = _with_workers(policy.floating_ip_sync, project_workers)
+                reclaimer = FloatingIpReclaimer(cl, inventory, plan.ignored_floating_ips, sync.get('workers'), dry_run)
+                on_result = None
+                if journal is not None:
+                    def on_result(project, fip_id, successful):
+                        journal.done(testbed_name, 'floating_ip', project.id, FLOATING_IP, fip_id, successful)
+
+                admit = _admission(scheduler, testbed_name, 'floating_ip')
+                failed = set()
+                for project, address, error in reclaimer.reclaim(projects, on_result, admit):
+                    if error is None:
+                        result.add(testbed_name, project.name, FLOATING_IP, address)
                     else:
-                        fip_results.get(testbed_name).get(project.name).get('exceptions').append(exception)
+                        failed.add(project.id)
+                        result.add(testbed_name, project.name, EXCEPTION, 'floating_ip', False,
+                                   '{}: {}'.format(address, error))
+                for project in projects:
+                    if admit is not None and admit.deferred(project):
+                        continue
+                    # the reclaimer dropped the floating IPs from the inventory, they are listed again without the
+                    # released ones
+                    _record_check(state, dry_run, testbed_name, project, 'floating_ip', floating_ip_fingerprint,
+                                  project.id not in failed,
+                                  lambda project: [fip.get('id') for fip in inventory.list_floatingips(project.id)])
+                    if journal is not None:
+                        journal.complete(testbed_name, 'floating_ip', project.id, project.id not in failed)
             except Exception as e:
                 log.error('Exception while checking floating IPs on testbed {}: {}'.format(testbed_name, e))
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-        if check_vm_zombie and config.get("check-vm") and config.get("check-vm").get(
-                "experiment-manager") and config.get("check-vm").get("nfvo"):
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~Check VMs~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+    if check_vm_zombie and check_vm is not None and _admit(scheduler, testbed_name, 'vm_zombie'):
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~Check VMs~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        with tracing.span('vm_zombie', 'phase'):
             try:
                 nsds, nsrs, vms = check_vm_os(cl,
-                                              config.get("check-vm").get("experiment-manager"),
-                                              config.get("check-vm").get("nfvo"),
+                                              check_vm.experiment_manager,
+                                              check_vm.nfvo,
                                               testbed_name,
-                                              config.get("check-vm").get("ignore-vm-ids"),
-                                              config.get("check-vm").get("ignore-nsr-ids"),
+                                              check_vm.ignored_vm_ids,
+                                              check_vm.ignored_nsr_ids,
                                               ignored_projects=ignored_projects,
                                               dry=dry_run,
-                                              experimenter=experimenter)
-                nsd_results = {**nsd_results, **nsds}
-                nsr_results = {**nsr_results, **nsrs}
-                vm_results = {**vm_results, **vms}
+                                              experimenter=experimenter,
+                                              inventory=inventory,
+                                              exp_man=shared.get('exp_man'),
+                                              nfvo=shared.get('nfvo'),
+                                              diff=shared.get('zombie_diff'),
+                                              state=state,
+                                              teardown_dict=_with_workers(check_vm.teardown, project_workers),
+                                              shard=shard,
+                                              journal=journal,
+                                              scheduler=scheduler)
+                for kind, removals in [(NSR, nsrs), (NSD, nsds), (VM, vms)]:
+                    for resource_id, removal in removals.items():
+                        result.add(testbed_name, removal.get('project'), kind, resource_id, removal.get('successful'))
             except Exception as e:
                 log.error('Exception while checking VMs on testbed {}: {}'.format(testbed_name, e))
-                check_vm_zombie_exceptions[testbed_name] = e
-                master.append(False)
-
-            log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-    master.extend(sec_grp_list)
-    master.extend(network_list)
-    master.extend(float_list)
-    master.extend(image_list)
-    if check_vm_zombie:
-        print_check_vm_os_results(nsd_results, nsr_results, vm_results, check_vm_zombie_exceptions)
-    if check_floating_ip:
-        print_fip_results(fip_results)
-    if check_networks:
-        print("Networks Not Found", network_not_matched_list)
-    if check_security_group:
-        print("Security Groups Not Found", sec_grp_not_matched_list)
-    if check_images:
-        print("Images Uploaded", images_uploaded)
-    if False in master:
-        sys.exit(1)
+                result.add(testbed_name, None, EXCEPTION, 'vm_zombie', False, str(e))
+                result.add(testbed_name, None, CHECK, 'vm_zombie', False)
 
+        log.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-def print_check_vm_os_results(nsd_results, nsr_results, vm_results, exceptions):
-    print('~~~~~~~~~~~~~~~~~~~~~ Check for Zombie VMs ~~~~~~~~~~~~~~~~~~~~~~~~')
-    projects = list(set([nsd_results.get(x).get('project') for x in nsd_results]
-                        + [nsr_results.get(x).get('project') for x in nsr_results]
-                        + [vm_results.get(x).get('project') for x in vm_results]))
-    testbeds = list(set([vm_results.get(x).get('testbed') for x in vm_results]))
-
-    if len(nsd_results) + len(nsr_results) > 0:
-        print('======== NSDs and NSRs ========\n')
-        for project in projects:
-            deleted_nsrs_in_project = [nsr for nsr in nsr_results if
-                                       nsr_results.get(nsr).get('project') == project and nsr_results.get(nsr).get(
-                                           'successful')]
-            failed_nsrs_in_project = [nsr for nsr in nsr_results if
-                                      nsr_results.get(nsr).get('project') == project and nsr_results.get(nsr).get(
-                                          'successful') is False]
-            deleted_nsds_in_project = [nsd for nsd in nsd_results if
-                                       nsd_results.get(nsd).get('project') == project and nsd_results.get(nsd).get(
-                                           'successful')]
-            failed_nsds_in_project = [nsd for nsd in nsd_results if
-                                      nsd_results.get(nsd).get('project') == project and nsd_results.get(nsd).get(
-                                          'successful') is False]
-
-            if len(deleted_nsrs_in_project + failed_nsrs_in_project +
-                           deleted_nsds_in_project + failed_nsds_in_project) == 0:
-                continue
-            print('Project {}'.format(project))
-
-            if len(deleted_nsrs_in_project + failed_nsrs_in_project) > 0:
-                print('  NSRs')
-            if len(deleted_nsrs_in_project) > 0:
-                print('    Removed {}: {}'.format(len(deleted_nsrs_in_project), ', '.join(deleted_nsrs_in_project)))
-            if len(failed_nsrs_in_project) > 0:
-                print('    Failed to remove {}: {}'.format(len(failed_nsrs_in_project),
-                                                           ', '.join(failed_nsrs_in_project)))
-
-            if len(deleted_nsds_in_project + failed_nsds_in_project) > 0:
-                print('  NSDs')
-            if len(deleted_nsds_in_project) > 0:
-                print('    Removed {}: {}'.format(len(deleted_nsds_in_project), ', '.join(deleted_nsds_in_project)))
-            if len(failed_nsds_in_project) > 0:
-                print('    Failed to remove {}: {}'.format(len(failed_nsds_in_project),
-                                                           ', '.join(failed_nsds_in_project)))
-            print('')
-        print('')
-
-    if len(vm_results) > 0:
-        print('============= VMs =============\n')
-        for testbed in testbeds:
-            vm_projects = list(set(
-                [vm.get('project') for vm in [vm_results.get(vm) for vm in vm_results] if
-                 vm.get('testbed') == testbed]))
-            if len(vm_projects) == 0:
-                continue
-            print('Testbed {}'.format(testbed))
-            for project in vm_projects:
-                deleted_vms_in_project = [vm for vm in vm_results if
-                                          vm_results.get(vm).get('testbed') == testbed and vm_results.get(vm).get(
-                                              'project') == project and vm_results.get(vm).get('successful')]
-                failed_vms_in_project = [vm for vm in vm_results if
-                                         vm_results.get(vm).get('testbed') == testbed and vm_results.get(vm).get(
-                                             'project') == project and vm_results.get(vm).get('successful') is False]
-                if len(deleted_vms_in_project) + len(failed_vms_in_project) == 0:
-                    continue
-                print('  Project {}'.format(project))
-                if len(deleted_vms_in_project) > 0:
-                    print('    Removed {}: {}'.format(len(deleted_vms_in_project), ', '.join(deleted_vms_in_project)))
-                if len(failed_vms_in_project) > 0:
-                    print(
-                        '    Failed to remove {}: {}'.format(len(failed_vms_in_project),
-                                                             ', '.join(failed_vms_in_project)))
-            print('')
-        print('')
-
-    if len(exceptions) > 0:
-        print('========= Exceptions ==========\n')
-        for testbed in exceptions:
-            print('Testbed {}'.format(testbed))
-            print('  {}\n'.format(exceptions.get(testbed)))
-
-def print_fip_results(fip_results):
-    print('~~~~~~~~~~~~~~~~~~~~ Check floating IPs ~~~~~~~~~~~~~~~~~~~~~~~')
-    for tb in fip_results:
-        print('Testbed {}'.format(tb))
-        for project in fip_results.get(tb):
-            if len(fip_results.get(tb).get(project).get('released')) + len(fip_results.get(tb).get(project).get('exceptions')) > 0:
-                print('  Project {}'.format(project))
-                if len(fip_results.get(tb).get(project).get('released')) > 0:
-                    print('    Released floating IPs: {}'.format(', '.join(fip_results.get(tb).get(project).get('released'))))
-                if len(fip_results.get(tb).get(project).get('exceptions')) > 0:
-                    print('    Exceptions: {}'.format(', '.join(fip_results.get(tb).get(project).get('exceptions'))))
-        print()
-
-
-def check_and_upload_images(cl, images, img_any, project_id, project_name="", dry_run=False):
-    try:
-        log.info("Checking project %s (%s)" % (project_name, project_id))
-        images_to_upload = []
-        img_any.update(images)
-        os_images = cl.list_images(project_id)
-        openstack_image_names = [img.name for img in os_images]
-        for image in img_any:
-            if image in openstack_image_names:
-                log.debug("Image %s is available" % image)
-            else:
-                log.debug('Image %s is not available' % image)
-                images_to_upload.append(image)
-
-        log.debug("Images to upload are: %s" % images_to_upload)
-        if images_to_upload:
-            for image_to_upload in images_to_upload:
-                location = img_any.get(image_to_upload).get('path')
-                if not dry_run:
-                    cl.upload_image(image_to_upload, location)
-                else:
-                    log.info("Executing cl.upload_image(image_to_upload, location)...")
-                    time.sleep(2)
-                log.info("Successfully Uploaded: %s file: %s" % (image_to_upload, location))
-        return True
-    except Unauthorized:
-        log.warning("Not authorized on project %s" % project_id)
-        return False
 
+def _with_workers(settings, workers):
+    """
+    :param settings: the settings of a worker pool from the config file
+    :return: the settings, with workers as the number of workers of the pool if they do not set one
+    """
+    if not workers or (settings or {}).get('workers'):
+        return settings
+    return dict(settings or {}, workers=workers)
 
-def check_and_add_sec_grp(cl, sec_grp, sec_grp_any, project_id, project_name=""):
-    try:
-        log.info("Checking project %s (%s)" % (project_name, project_id))
-        sec_grp_any.extend(sec_grp)
-        sec_grp_any = set(sec_grp_any)
-        os_secgrp = cl.list_sec_group(project_id)
-
-        openstack_security_groups = [sec.get('name') for sec in os_secgrp]
-        for secg in sec_grp_any:
-            if secg in openstack_security_groups:
-                log.debug('Security Group already present %s' % secg)
-            else:
-                log.debug('Security Group missing %s' % secg)
-                sec_grp_not_matched_list.append(secg)
-                # cl.create_security_group(sec.get("tenant_id"), secg)
-        if sec_grp_not_matched_list:
-            return False
-        return True
 
-    except Unauthorized:
-        log.warning("Not authorized on project %s" % project_id)
-        return False
+def _select_projects(projects, ignored_projects, experimenter=None):
+    """
+    :return: the projects that are neither ignored nor filtered out by the experimenter name, in their original order
+    """
+    selected = []
+    for project in projects:
+        if experimenter is not None and project.name != experimenter:
+            continue
+        if project.name in ignored_projects:
+            log.info('Ignoring project {}'.format(project.name))
+            continue
+        selected.append(project)
+    return selected
 
 
-def check_os_networks(cl, networks, project_id, project_name=""):
-    try:
-        log.info("Checking project %s (%s)" % (project_name, project_id))
-        os_networks = cl.list_networks(project_id)
-        os_net_names = [net.get("name") for net in os_networks]
-        log.debug("Found networks: %s" % os_net_names)
-        for n in networks:
-            found = False
-            for os_net in os_networks:
-                shared = os_net.get("shared")
-                router = os_net.get("router:external")
-                if ((os_net.get("name") == n.get("name"))
-                    and (shared == n.get("shared"))
-                    and (router == n.get("router:external"))):
-                    found = True
-                    break
-            if not found:
-                network_not_matched_list.append(os_networks)
-        if network_not_matched_list:
-            log.error("Missing networks: %s" % network_not_matched_list)
-            return False
-        return True
-    except Unauthorized:
-        log.warning("Not authorized on project %s" % project_id)
+def _owns(shard, testbed_name, project_id, check):
+    return shard is None or shard.owns(testbed_name, project_id, check)
+
+
+def _sharded(shard, testbed_name, check, projects):
+    """
+    :return: the projects whose unit of the check belongs to the shard, all of them if shard is None
+    """
+    return projects if shard is None else shard.select(testbed_name, check, projects)
+
+
+def _admit(scheduler, testbed_name, check):
+    """
+    :return: True if the check of the testbed can be started, False if the scheduler deferred it
+    """
+    return scheduler is None or scheduler.admit(testbed_name, check)
+
+
+def _admission(scheduler, testbed_name, check):
+    """
+    :return: the Admission of the projects of the check of the testbed, None if there is no scheduler
+    """
+    return scheduler.admission(testbed_name, check) if scheduler is not None else None
+
+
+def _ordered(scheduler, testbed_name, check, projects):
+    return projects if scheduler is None else scheduler.order(testbed_name, check, projects)
+
+
+def _unfinished(journal, testbed_name, check, projects):
+    """
+    :return: the projects whose unit of the check was not completed by the run the journal resumes
+    """
+    if journal is None:
+        return projects
+    return [project for project in projects if journal.completed(testbed_name, check, project.id) is None]
 
 
-def check_floating_ips(cl, project_id, project_name="", ignore_floatingip=[], ignore_floatingip_any=[], dry_run=False):
+def _select_changed(state, testbed_name, kind, projects, fingerprint_of):
+    """
+    :return: (projects, fingerprints) the projects whose check cannot be skipped according to the state store, if
+    any, and the fingerprints of the inputs of the check by project ID
+    """
+    if state is None:
+        return projects, {}
+    return state.select(testbed_name, kind, projects, fingerprint_of)
+
+
+def _record_check(state, dry_run, testbed_name, project, kind, fingerprint_of, successful, resources_of):
+    """
+    Records the outcome of the check of a project in the state store, if any.
+    :param fingerprint_of: function computing the fingerprint of the inputs of the check for a project; it is called
+    after the check fixed what it could, so that the next run skips the project if nothing changes in between
+    :param resources_of: function listing the IDs of the resources of a project the check looked at
+    """
+    # a dry run does not fix anything, so it must not make later runs skip the project
+    if state is not None and not dry_run:
+        state.record(testbed_name, project.id, kind, fingerprint_of(project), successful, resources_of(project))
+
+
+def _map_projects(function, projects, workers=1, admit=None):
+    """
+    Calls function for every project, using at most workers threads.
+    :param admit: if not None, called with every project right before function; the projects it returns False for
+    are skipped
+    :return: the results in the same order as projects, regardless of the order in which they finished; None for the
+    skipped projects
+    """
+    def traced(project):
+        if admit is not None and not admit(project):
+            return None
+        with tracing.span(project.name, 'project'):
+            return function(project)
+
+    if workers <= 1 or len(projects) <= 1:
+        return [traced(project) for project in projects]
+    testbed_name = threading.current_thread().name
+
+    def run(project):
+        thread = threading.current_thread()
+        thread_name = thread.name
+        thread.name = '{}/{}'.format(testbed_name, project.name)
+        try:
+            return traced(project)
+        finally:
+            thread.name = thread_name
+
+    return map_bounded(run, projects, workers)
+
+
+def check_and_upload_images(cl, images, img_any, projects, dry_run=False, uploaded_list=None, image_sync_dict=None,
+                            digest_cache=None, journal=None, admit=None):
     """
     :param cl:
-    :param project_id:
-    :param project_name:
-    :param ignore_floatingip:
-    :param ignore_floatingip_any:
+    :param images: the image definitions of the testbed
+    :param img_any: the image definitions for any testbed
+    :param projects: the projects that need the images
     :param dry_run:
-    :return: ([removed_fip_addresses], exception) exception is None if no exception occured, otherwise [removed_fip_addresses] is None
+    :param uploaded_list: if not None, the names of the uploaded images are appended to it
+    :param image_sync_dict: the image_sync section of the config file
+    :param digest_cache: the DigestCache of the local image files, shared by the testbeds
+    :param journal: if not None, the Journal the uploads are recorded in
+    :param admit: if not None, called with (image name, project or None) before every upload, which is skipped if it
+    returns False
+    :return: False if an image could not be uploaded, True otherwise
     """
     try:
-        log.info("Checking project %s (%s)" % (project_name, project_id))
-        ignore_floatingip = ignore_floatingip or []
-        ignore_floatingip_any = ignore_floatingip_any or []
-        ignore_floatingip_any.extend(ignore_floatingip)
-        ignore_floatingip_any = set(ignore_floatingip_any)
-        log.debug("Ignoring floating ips: %s" % ignore_floatingip_any)
-        floating_ips = cl.list_floatingips(project_id)
-        log.debug("List of all floating IPs allocated to project %s: %s" % (
-            project_name, ', '.join([f.get("floating_ip_address") for f in floating_ips])))
-        ignored_fips_ids = list()
-        for fip in floating_ips:
-            if fip.get("floating_ip_address") in ignore_floatingip_any:
-                log.debug("Ignore Floating IP %s because it is in ignore list" % fip.get("floating_ip_address"))
-                ignored_fips_ids.append(fip.get("id"))
-            elif fip.get("fixed_ip_address") is None:
-                log.debug("Floating IP to be released: %s" % fip.get("floating_ip_address"))
-            else:
-                log.debug("Ignoring Floating IP %s because it is allocated" % fip.get("floating_ip_address"))
-                ignored_fips_ids.append(fip.get("id"))
-        all_fips = cl.list_floatingips(project_id)
-        remove_fips = [fip for fip in all_fips if fip.get('id') not in ignored_fips_ids]
-        remove_fip_addresses = [fip.get('floating_ip_address') for fip in remove_fips]
-        if not dry_run:
-            cl.release_floating_ips(project_id, keep_fip_id_list=ignored_fips_ids)
-        else:
-            if len(remove_fip_addresses) > 0:
-                log.info('Releasing the following floating IPs in project {}: {}'.format(project_name, ', '.join(
-                    remove_fip_addresses)))
-        return remove_fip_addresses, None
-    except Unauthorized as ex:
-        log.warning("Not authorized on project %s" % project_id)
-        log.error("Exception: ", ex)
-        return None, ex
-    except Exception as e:
-        log.error('Exception while checking floating IPs on project {}: {}'.format(project_name, e))
-        return None, e
+        log.info("Checking images of %d projects" % len(projects))
+        img_any = {**(img_any or {}), **(images or {})}
+        image_sync_dict = image_sync_dict or {}
+        image_sync = ImageSync(cl, digest_cache, image_sync_dict.get('workers'), dry_run)
+        on_result = None
+        if journal is not None:
+            record = journal.recorder(cl.testbed_name, 'images')
 
+            def on_result(name, project, upload_successful):
+                record(IMAGE, '{}/{}'.format(project.id if project else '', name), upload_successful)
 
-def _check_resource(resource, nsr_to_keep, vms_to_keep,  project_name, testbed):
-    if resource.get('username') != project_name or resource.get('node_type') not in ['NfvResource', 'SecurityResource', 'MonitoringResource']:
-        return
+        successful, uploaded = image_sync.sync(img_any, projects, on_result, admit)
+        if uploaded_list is not None:
+            uploaded_list.extend(uploaded)
+        return successful
+    except clients.unauthorized_error():
+        log.warning("Not authorized on testbed %s" % cl.testbed_name)
+        return False
 
-    res_str = resource.get("value")
-    try:
-        value = json.loads(res_str)
-        assert type(value) == dict
-    except Exception as e:
-        log.debug('Resource value: {}'.format(res_str))
-        log.error(
-            'Exception while parsing value of resource {} of experiment {}: {}'.format(resource.get('resource_id'),
-                                                                                       resource.get(
-                                                                                           'experiment_id'),
-                                                                                       e))
-        return
 
-    if resource.get('node_type') == 'NfvResource':
-        nsr_id = value.get('id')
-        if nsr_id is not None and nsr_id != '':
-            log.debug('Softfire knows of NSR with ID {}'.format(nsr_id))
-            nsr_to_keep.append(nsr_id)
-        else:
-            if resource.get('status') != 'RESERVED':
-                log.warning('Expected an NSR ID for NFV resource {} in experiment {}, but it was None or empty string.'.format(
-                    resource.get('resource_id'), resource.get('experiment_id')))
-    elif resource.get('node_type') == 'SecurityResource':
-        nsr_id = value.get('nsr_id')
-        if nsr_id is None or nsr_id == '':
-            if resource.get('status') != 'RESERVED':
-                log.warning('Expected an NSR ID for security resource {} in experiment {}, but it was None or empty string.'.format(
-                    resource.get('resource_id'), resource.get('experiment_id')))
+def check_os_networks(cl, networks, project_id, project_name="", not_matched_list=None, inventory=None,
+                      verifier=None):
+    """
+    :param cl:
+    :param networks: the expected network definitions
+    :param project_id:
+    :param project_name:
+    :param not_matched_list: if not None, the definitions of the missing networks are appended to it
+    :param inventory: if not None, the networks are taken from this snapshot instead of being listed
+    :param verifier: the NetworkVerifier of the testbed; if given, only the project-private networks are checked and
+    the shared and external ones are left to the caller
+    :return: False if an expected network is missing, True otherwise
+    """
+    try:
+        log.info("Checking project %s (%s)" % (project_name, project_id))
+        if verifier is None:
+            os_networks = (inventory or cl).list_networks(project_id)
+            missing = NetworkVerifier(networks, [net for net in os_networks if is_common(net)]).missing(os_networks)
         else:
-            nsr_to_keep.append(nsr_id)
-    elif resource.get('node_type') == 'MonitoringResource':
-        testbed_name = value.get('testbed')
-        if testbed_name is None or testbed_name == testbed:
-            vm_id = value.get('vm_id')
-            if vm_id is not None and vm_id != '':
-                vms_to_keep.append(vm_id)
-            else:
-                if resource.get('status') != 'RESERVED':
-                    log.warning('Expected a VM ID for monitoring resource {} in experiment {}, but it was None or empty string.'.format(
-                        resource.get('resource_id'), resource.get('experiment_id')))
+            os_networks = inventory.list_private_networks(project_id) if inventory is not None else cl.list_networks(
+                project_id)
+            missing = verifier.missing_private(os_networks)
+        log.debug("Found networks: %s" % [net.get("name") for net in os_networks])
+        if not_matched_list is not None:
+            not_matched_list.extend(missing)
+        if missing:
+            log.error("Missing networks: %s" % [dict(network) for network in missing])
+            return False
+        return True
+    except clients.unauthorized_error():
+        log.warning("Not authorized on project %s" % project_id)
 
 
-def check_vm_os(cl, exp_man_dict, nfvo_dict, testbed_name, vms_to_keep_arg=[], nsrs_to_keep_arg=[],
-                ignored_projects=[],
-                dry=False, experimenter=None):
+def check_vm_os(cl, exp_man_dict, nfvo_dict, testbed_name, vms_to_keep_arg=None, nsrs_to_keep_arg=None,
+                ignored_projects=None,
+                dry=False, experimenter=None, inventory=None, exp_man=None, nfvo=None, teardown_dict=None,
+                state=None, shard=None, journal=None, scheduler=None, diff=None):
     """
     :param cl:
     :param exp_man_dict:
@@ -451,104 +648,281 @@ def check_vm_os(cl, exp_man_dict, nfvo_dict, testbed_name, vms_to_keep_arg=[], n
     :param ignored_projects:
     :param dry:
     :param experimenter: if not None, then the check is only performed for this experimenter name
+    :param inventory: if not None, projects and servers are taken from this snapshot instead of being listed
+    :param exp_man: if not None, the ExperimentManagerSnapshot to take experimenters and resources from; otherwise
+    they are fetched using exp_man_dict
+    :param nfvo: if not None, the NfvoSessionPool to get the Open Baton clients from; otherwise one is created using
+    nfvo_dict
+    :param teardown_dict: the settings of the TeardownEngine that deletes the zombies
+    :param state: if not None, the StateStore used to skip the projects that did not change since the last run
+    :param shard: if not None, only the projects that belong to this Shard are checked; the unit is the NFVO project,
+    its NSRs and NSDs and its VMs on every testbed, so that they are all removed by the same shard, NSRs first
+    :param journal: if not None, the Journal the removals are planned and recorded in; the projects the resumed run
+    completed are skipped, and the ones it planned only get the removals it did not finish, without looking again
+    :param scheduler: if not None, the Scheduler that orders the projects and defers them once the time is up
+    :param diff: the ZombieDiff shared by the testbeds of the run, so that the NSRs and NSDs of an NFVO project are
+    only removed once; if None, one is created for this testbed
     :return: (nsds, nsrs, vms) a tuple containing the results of the removals of the nsds, nsrs and vms
     """
 
-    exp_man_cl = ExpManClient(username=exp_man_dict.get("username"),
-                              password=exp_man_dict.get("password"),
-                              experiment_manager_ip=exp_man_dict.get("ip"),
-                              experiment_manager_port=exp_man_dict.get("port"),
-                              debug=exp_man_dict.get("debug", "true").lower() == "true")
-
-    experimenters = exp_man_cl.get_all_experimenters()
+    diff = diff or ZombieDiff(exp_man or ExperimentManagerSnapshot(exp_man_dict), nfvo or NfvoSessionPool(nfvo_dict),
+                              vms_to_keep_arg, nsrs_to_keep_arg)
+    experimenters = diff.experimenters()
+    teardown = TeardownEngine(teardown_dict)
+    ignored_projects = set(ignored_projects or [])
 
+    inventory = inventory or Inventory(cl, experimenter)
     nsds = {}
     nsrs = {}
     vms = {}
-    for project in cl.list_tenants():
+    for project in _ordered(scheduler, testbed_name, 'vm_zombie', inventory.list_tenants()):
         if experimenter is not None and project.name != experimenter:
             continue
-        vms_to_keep = vms_to_keep_arg
-        nsrs_to_keep = nsrs_to_keep_arg
         if project.name not in experimenters:
             log.debug("Skipping project %s not belonging to softfire" % project.name)
             continue
         elif project.name in ignored_projects:
             log.info('Ignoring project {}'.format(project.name))
             continue
+        # the NSRs of an NFVO project have to be removed before its VMs, so the project is one unit for all testbeds
+        if not _owns(shard, None, project.name, 'vm_zombie'):
+            continue
+        owns_vms = True
+        if journal is not None and journal.completed(testbed_name, 'vm_zombie', project.id) is not None:
+            log.info('Skipping check VM on project {}, it was done before the run was interrupted'.format(
+                project.name))
+            owns_vms = False
+        if scheduler is not None and not scheduler.admit(testbed_name, 'vm_zombie', project):
+            continue
         else:
             log.info("Executing check VM on project %s" % project.name)
-        project_name = project.name
-        resources = exp_man_cl.get_all_resources()
-        ob_client = OBClient(nfvo_ip=nfvo_dict.get("ip"),
-                             nfvo_port=nfvo_dict.get("port"),
-                             username=nfvo_dict.get("username"),
-                             password=nfvo_dict.get("password"),
-                             https=nfvo_dict.get("https", "false").lower() == "true",
-                             project_name=project_name)
-        if not ob_client.project_id:
-            log.warning("Openstack project %s was not found on OB so it will be skipped." % project_name)
-            continue
-        for res in [res for res in resources if res.get('username') == project_name]:
-            if type(res) is list:
-                for r in res:
-                    _check_resource(r, nsrs_to_keep, vms_to_keep, project_name, testbed_name)
-            else:
-                _check_resource(res, nsrs_to_keep, vms_to_keep, project_name, testbed_name)
-
-        ob_nsrs = ob_client.list_nsrs()
-        nsrs_to_remove = [nsr for nsr in ob_nsrs if nsr.get("id") not in nsrs_to_keep]
-        nsrs_to_keep = [nsr for nsr in ob_nsrs if nsr.get("id") in nsrs_to_keep]
-        nsd_ids_to_keep = [nsr.get('descriptor_reference') for nsr in nsrs_to_keep]
-        for nsr in nsrs_to_remove:
-            if dry:
-                nsrs[nsr.get('id')] = {'project': project_name, 'successful': True}
+        with tracing.span(project.name, 'project'):
+            project_name = project.name
+            remaining = journal.remaining(testbed_name, 'vm_zombie', project.id) \
+                if journal is not None and owns_vms else None
+            project_fingerprint = None
+            if remaining is not None:
+                log.info('Resuming the removals of project {}'.format(project_name))
+                ob_client = diff.nfvo.client(project_name)
+                if ob_client is None:
+                    log.warning("Openstack project %s was not found on OB so it will be skipped." % project_name)
+                    continue
+                vm_ids = [action.get('id') for action in remaining if action.get('kind') == VM]
             else:
-                try:
-                    ob_client.delete_nsr(nsr.get("id"))
-                    nsrs[nsr.get('id')] = {'project': project_name, 'successful': True}
-                except Exception as e:
-                    log.error('Exception while deleting the NSR {}: {}'.format(nsr.get('id'), e))
-                    nsrs[nsr.get('id')] = {'project': project_name, 'successful': False}
-                time.sleep(2)
-            nsd_id = nsr.get('descriptor_reference')
-            if nsd_id not in nsd_ids_to_keep:
-                if dry:
-                    nsds[nsd_id] = {'project': project_name, 'successful': True}
-                else:
-                    try:
-                        ob_client.delete_nsd(nsd_id)
-                        nsds[nsd_id] = {'project': project_name, 'successful': True}
-                    except Exception as e:
-                        log.error('Exception while deleting the NSD {}: {}'.format(nsr.get('descriptor_reference'), e))
-                        nsds[nsd_id] = {'project': project_name, 'successful': False}
-
-        for nsr in nsrs_to_keep:
-            for vnfr in nsr.get("vnfr"):
-                for vdu in vnfr.get("vdu"):
-                    for vnfci in vdu.get("vnfc_instance"):
-                        if vnfci.get("vc_id"):
-                            vms_to_keep.append(vnfci.get("vc_id"))
-
-        for vm in cl.list_server(cl.get_project_from_name(project_name).id):
-            if vm.id not in vms_to_keep:
-                if dry:
-                    vms[vm.id] = {'testbed': testbed_name, 'project': project_name, 'successful': True}
-                else:
-                    try:
-                        log.debug('Removing VM {}'.format(vm.id))
-                        # TODO passing the project ID does not make sense; consider changing the SDK
-                        cl.delete_server(vm.id, ob_client.project_id)
-                        vms[vm.id] = {'testbed': testbed_name, 'project': project_name, 'successful': True}
-                    except Exception as e:
-                        log.error('Exception while deleting VM {}: {}'.format(vm.id, e))
-                        vms[vm.id] = {'testbed': testbed_name, 'project': project_name, 'successful': False}
+                nsrs_to_keep, vms_to_keep = diff.keep(project_name, testbed_name)
+                server_ids = [vm.id for vm in inventory.list_server(project.id)]
+                nfvo_project = diff.nfvo_project(project_name)
+                if nfvo_project is None:
+                    log.warning("Openstack project %s was not found on OB so it will be skipped." % project_name)
+                    continue
+                project_fingerprint = _zombie_fingerprint(server_ids, [nsr.get('id') for nsr in nfvo_project.nsrs],
+                                                          nsrs_to_keep, vms_to_keep, nfvo_project)
+                if state is not None and state.unchanged(testbed_name, project.id, 'vm_zombie', project_fingerprint):
+                    log.debug('Skipping check VM on project {}, nothing changed since the last run'.format(
+                        project_name))
+                    continue
+                ob_client = nfvo_project.client
+                vm_ids = diff.zombie_vms(project_name, testbed_name, server_ids, nfvo_project) if owns_vms else []
+                if journal is not None and not dry and owns_vms:
+                    journal.plan(testbed_name, 'vm_zombie', project.id, [{'kind': VM, 'id': vm_id} for vm_id in vm_ids])
+            project_nsds, project_nsrs = _remove_zombie_nsrs(diff, teardown, project_name, dry, journal)
+            nsds.update(project_nsds)
+            nsrs.update(project_nsrs)
+            if not owns_vms:
+                continue
+
+            on_result = journal.recorder(testbed_name, 'vm_zombie', project.id) if journal is not None else None
+            project_vms = teardown.delete_servers(cl, vm_ids, ob_client.project_id, project_name, testbed_name, dry,
+                                                  on_result=on_result)
+            vms.update(project_vms)
+            successful = all(record.get('successful') for record in list(project_nsds.values()) +
+                             list(project_nsrs.values()) + list(project_vms.values()))
+            if state is not None and not dry and project_fingerprint is not None:
+                # what the next run finds if nothing changes in between, so that it can skip the project
+                remaining_ids = [vm_id for vm_id in server_ids
+                                 if not (project_vms.get(vm_id) or {}).get('successful')]
+                state.record(testbed_name, project.id, 'vm_zombie',
+                             _zombie_fingerprint(remaining_ids, diff.remaining_nsr_ids(project_name, nfvo_project),
+                                                 nsrs_to_keep, vms_to_keep, nfvo_project),
+                             successful, remaining_ids)
+            if journal is not None and not dry:
+                journal.complete(testbed_name, 'vm_zombie', project.id, successful)
     return nsds, nsrs, vms
 
 
+def _zombie_fingerprint(server_ids, nsr_ids, nsrs_to_keep, vms_to_keep, nfvo_project):
+    """
+    :param nsr_ids: the IDs of the zombie NSRs of the NFVO project
+    :return: the fingerprint of the inputs of the zombie VM check of a project
+    """
+    return fingerprint(sorted(server_ids), sorted(nsr_ids), sorted(nsrs_to_keep), sorted(vms_to_keep),
+                       sorted(nfvo_project.vm_ids_to_keep))
+
+
+def _remove_zombie_nsrs(diff, teardown, project_name, dry=False, journal=None):
+    """
+    Deletes the zombie NSRs of an NFVO project and their NSDs, once per run however many testbeds the project is on,
+    see ZombieDiff.remove_once. In the journal they are a unit of their own, with no testbed and the name of the
+    project.
+    :return: (nsds, nsrs) the results of the removals, empty if another testbed removed them
+    """
+    def remove():
+        if journal is not None and journal.completed(None, 'vm_zombie', project_name) is not None:
+            log.info('The NSRs of project {} were removed before the run was interrupted'.format(project_name))
+            return {}, {}
+        remaining = journal.remaining(None, 'vm_zombie', project_name) if journal is not None else None
+        if remaining is not None:
+            ob_client = diff.nfvo.client(project_name)
+            if ob_client is None:
+                log.warning("Openstack project %s was not found on OB so it will be skipped." % project_name)
+                return {}, {}
+            nsrs_to_remove = [{'id': action.get('id'), 'descriptor_reference': action.get('descriptor_reference')}
+                              for action in remaining if action.get('kind') == NSR]
+            nsd_ids = [action.get('id') for action in remaining if action.get('kind') == NSD]
+        else:
+            nfvo_project = diff.nfvo_project(project_name)
+            if nfvo_project is None:
+                log.warning("Openstack project %s was not found on OB so it will be skipped." % project_name)
+                return {}, {}
+            ob_client = nfvo_project.client
+            nsrs_to_remove = nfvo_project.nsrs
+            nsd_ids = nfvo_project.nsd_ids
+            if journal is not None and not dry:
+                journal.plan(None, 'vm_zombie', project_name,
+                             [dict(nsr, kind=NSR) for nsr in nsrs_to_remove] +
+                             [{'kind': NSD, 'id': nsd_id} for nsd_id in nsd_ids])
+        on_result = journal.recorder(None, 'vm_zombie', project_name) if journal is not None else None
+        project_nsds, project_nsrs = teardown.delete_nsrs(ob_client, nsrs_to_remove, set(), project_name, dry,
+                                                          nsd_ids=nsd_ids, on_result=on_result)
+        if journal is not None and not dry:
+            journal.complete(None, 'vm_zombie', project_name,
+                             all(record.get('successful') for record in list(project_nsds.values()) +
+                                 list(project_nsrs.values())))
+        return project_nsds, project_nsrs
+
+    return diff.remove_once(project_name, remove) or ({}, {})
+
+
+def plan_zombies(testbeds, policy, experimenter=None):
+    """
+    Finds the zombie NSRs, NSDs and VMs of all testbeds without deleting anything.
+    :param policy: the compiled config, its check-vm section must be complete
+    :return: the cleanup plan, see checkos.zombies
+    """
+    check_vm = policy.check_vm
+    diff = ZombieDiff(ExperimentManagerSnapshot(check_vm.experiment_manager), NfvoSessionPool(check_vm.nfvo),
+                      check_vm.ignored_vm_ids, check_vm.ignored_nsr_ids)
+    experimenters = diff.experimenters()
+    scopes = []
+    errors = []
+    for testbed_name, testbed in testbeds.items():
+        try:
+            with tracing.span('create OpenStack client', 'client'):
+                cl = clients.os_client(testbed_name, testbed)
+            inventory = Inventory(cl, experimenter)
+            projects = [project for project in _select_projects(inventory.list_tenants(),
+                                                                policy.testbed(testbed_name).ignored_projects,
+                                                                experimenter)
+                        if project.name in experimenters]
+        except Exception as e:
+            log.error('Exception while listing the projects of testbed {}: {}'.format(testbed_name, e))
+            errors.append({'testbed': testbed_name, 'error': str(e)})
+            continue
+        scopes.append((testbed_name, inventory, projects))
+    plan = create_plan(diff, scopes)
+    plan['errors'] = errors + plan.get('errors')
+    return plan
+
+
+def apply_zombie_plan(plan, testbeds, policy, dry_run=False, renderer=None):
+    """
+    Executes a cleanup plan created by plan_zombies.
+    :param renderer: if not None, every record is passed to it as soon as it is produced
+    :return: the ResultStore with the removals
+    """
+    check_vm = policy.check_vm
+    os_clients = {}
+
+    def os_client(testbed_name):
+        if testbed_name not in os_clients:
+            if testbed_name not in testbeds:
+                raise KeyError('No credentials for testbed {}'.format(testbed_name))
+            os_clients[testbed_name] = clients.os_client(testbed_name, testbeds.get(testbed_name))
+        return os_clients.get(testbed_name)
+
+    nsds, nsrs, vms = apply_plan(plan, os_client, NfvoSessionPool(check_vm.nfvo), check_vm.teardown, dry_run)
+    results = ResultStore([renderer.record] if renderer is not None else None)
+    for kind, removals in [(NSR, nsrs), (NSD, nsds), (VM, vms)]:
+        for resource_id, removal in removals.items():
+            results.add(removal.get('testbed'), removal.get('project'), kind, resource_id, removal.get('successful'))
+    results.add(None, None, CHECK, 'vm_zombie',
+                all(removal.get('successful') for removals in (nsds, nsrs, vms) for removal in removals.values()))
+    return results
+
+
+def merge_shards(paths, renderer=None):
+    """
+    Merges the results files written by the shards of a run into the results of the whole run.
+    :param renderer: if not None, every record is passed to it as it is merged
+    :return: (the ResultStore, the names of the checks)
+    :raise ResultsFileError: if a file cannot be read or the files are not the shards of one run
+    """
+    parts = [read_results(path) for path in paths]
+    shards = {}
+    counts = set()
+    indexes = []
+    for path, part in zip(paths, parts):
+        try:
+            shard = parse_shard(part.get('shard')) if part.get('shard') else None
+        except ValueError as e:
+            raise ResultsFileError('{} has an invalid shard: {}'.format(path, e))
+        if shard is None:
+            if len(paths) > 1:
+                raise ResultsFileError('{} is not the results file of a shard'.format(path))
+            indexes.append(0)
+            continue
+        indexes.append(shard.index)
+        if shard.index in shards:
+            raise ResultsFileError('{} and {} are both shard {}'.format(shards.get(shard.index), path, shard))
+        shards[shard.index] = path
+        counts.add(shard.count)
+    if len(counts) > 1:
+        raise ResultsFileError('The files are shards of runs split {} ways'.format(
+            ' and '.join(str(count) for count in sorted(counts))))
+    # the order of the files on the command line does not matter
+    parts = [part for part, shard in sorted(zip(parts, indexes), key=lambda item: item[1])]
+    results = ResultStore([renderer.record] if renderer is not None else None)
+    checks = merge_results(parts, results)
+    missing = ['{}/{}'.format(index, count) for count in counts for index in range(1, count + 1)
+               if index not in shards]
+    if missing:
+        # the report would look complete without the projects of the missing shards, so the run counts as failed
+        log.error('The results of shards {} are missing'.format(', '.join(missing)))
+        results.add(None, None, CHECK, 'shards', False, 'missing {}'.format(', '.join(missing)))
+    return results, checks
+
+
+def _shard(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     logging_file = "etc/logging.ini"
     parser = argparse.ArgumentParser(description='check Open Stack tenants for softfire')
+    parser.add_argument('command', nargs='?', choices=['check', 'plan', 'apply', 'merge'], default='check',
+                        help='check runs the selected checks (default); plan only finds the zombie NSRs, NSDs and VMs '
+                             'and writes a cleanup plan, which apply executes; merge reports the results files of '
+                             'the shards of a run')
+    parser.add_argument('files', nargs='*', help='the cleanup plan file executed by apply, or the results files of '
+                                                 'all shards for merge')
+    parser.add_argument("-o", "--output", help="file the plan command writes the cleanup plan to, stdout if not "
+                                               "given; with --shard, file the results of the shard are written to")
+    parser.add_argument("--shard", help="check only shard I of N of the projects of all testbeds, e.g. 2/4; the "
+                                        "shards can run on different nodes and their results files are combined "
+                                        "with merge", type=_shard)
     parser.add_argument('--os-cred',
                         help='openstack credentials file',
                         default='/etc/softfire/openstack-credentials.json')
@@ -566,13 +940,61 @@ def main():
     parser.add_argument("-t", "--testbed", help="perform checks only on the given testbed")
 
     parser.add_argument("-dry", "--dry-run", help="Execute dry run", action="store_true", default=False)
+    parser.add_argument("--parallel-testbeds", help="number of testbeds to check concurrently", type=int, default=1)
+    parser.add_argument("--project-workers", help="number of projects to check concurrently on each testbed, and "
+                                                  "of workers of the image, security group, floating IP and teardown "
+                                                  "pools whose section of the config file does not set workers",
+                        type=int)
+    parser.add_argument("--state-dir", help="directory of the state store used to skip unchanged projects, "
+                                            "overrides state.dir of the config file")
+    parser.add_argument("--token-cache", help="directory in which the keystone tokens are kept for the next runs, "
+                                              "overrides token_cache.dir of the config file")
+    parser.add_argument("--journal", help="file the actions of the run are recorded in, so that it can be resumed if "
+                                          "it is interrupted; overrides journal.path of the config file")
+    parser.add_argument("--resume", help="continue the run recorded in the journal if it did not end, skipping what "
+                                         "it already did", action="store_true", default=False)
+    parser.add_argument("--deadline", help="number of seconds the run may take; once they are over, the checks and "
+                                           "projects not started yet are deferred to the next run and reported, "
+                                           "overrides schedule.deadline of the config file", type=float)
+    parser.add_argument("--full", help="check all projects, even if they did not change since the last run",
+                        action="store_true", default=False)
+    parser.add_argument("--format", help="format of the results; json and ndjson stream the records to stdout as "
+                                         "they are produced", choices=list(RENDERERS), default='text')
+    parser.add_argument("--metrics-file", help="write the API call metrics to this file in the Prometheus textfile "
+                                               "format after every run, overrides metrics.textfile of the config file")
+    parser.add_argument("--metrics-port", help="in daemon mode, serve the API call metrics on this port, overrides "
+                                               "metrics.port of the config file", type=int)
+    parser.add_argument("--trace", help="write the spans of the run to this file as Chrome trace events, which "
+                                        "Perfetto or speedscope can open; in daemon mode it is rewritten after every "
+                                        "run")
+    parser.add_argument("--daemon", help="keep running and execute each check at the interval configured in the "
+                                         "daemon section of the config file; if no check is selected, all are run",
+                        action="store_true", default=False)
 
     args = parser.parse_args()
+    if args.command == 'apply' and len(args.files) != 1:
+        parser.error('apply needs the cleanup plan file')
+    if args.command == 'merge' and not args.files:
+        parser.error('merge needs the results files of the shards')
+    if args.command in ('check', 'plan') and args.files:
+        parser.error('{} does not take files'.format(args.command))
+    if args.command != 'check' and args.daemon:
+        parser.error('{} cannot run as a daemon'.format(args.command))
+    if args.shard is not None and (args.command != 'check' or args.daemon):
+        parser.error('--shard only works with a single run of check')
+    if args.resume and (args.command != 'check' or args.daemon or args.dry_run):
+        parser.error('--resume only works with a single run of check that is not dry')
+    if args.full and args.daemon:
+        parser.error('--full only works with a single run of check')
+    if args.deadline is not None and (args.command != 'check' or args.daemon):
+        parser.error('--deadline only works with a single run of check')
+    if args.shard is not None and not args.output:
+        parser.error('--shard needs -o/--output for the results file of the shard')
 
     openstack_credentials = args.os_cred  # '/etc/softfire/openstack-credentials.json'
     config = args.config
 
-    print()
+    renderer = create_renderer(args.format)
     if args.debug:
         if os.path.isfile(logging_file):
             logging.config.fileConfig(logging_file)
@@ -581,6 +1003,18 @@ def main():
     else:
         logging.basicConfig(level=logging.WARNING)
 
+    if args.command == 'merge':
+        renderer.start()
+        try:
+            results, checks = merge_shards(args.files, renderer)
+        except ResultsFileError as e:
+            log.error(e)
+            sys.exit(2)
+        renderer.finish(results, checks)
+        if results.failed():
+            sys.exit(1)
+        return
+
     with open(openstack_credentials, "r") as f:
         testbeds = json.loads(f.read())
     if args.testbed is not None:
@@ -590,8 +1024,93 @@ def main():
                 testbeds.pop(testbed)
         if len(testbeds) == 0:
             log.warning('No testbed with name {} found in file {}'.format(args.testbed, openstack_credentials))
-    with open(config, "r") as f:
-        config_dict = yaml.load(f)
-        check_testbeds(testbeds, config_dict, args.check_images, args.check_security_group, args.check_networks,
-                       args.check_floating_ip, args.check_vm_zombie, dry_run=args.dry_run,
-                       experimenter=args.experimenter)
+    try:
+        config_dict = load_config(config)
+        # fail before the first client is created rather than halfway through the checks
+        policy = compile_policy(config_dict, testbeds)
+    except ConfigError as e:
+        log.error('Invalid config file {}: {}'.format(config, e))
+        sys.exit(2)
+    if args.command != 'check' and policy.check_vm is None:
+        log.error('The {} command needs the experiment-manager and nfvo of the check-vm section of the config file '
+                  '{}'.format(args.command, config))
+        sys.exit(2)
+    plan = None
+    if args.command == 'apply':
+        try:
+            plan = read_plan(args.files[0])
+        except PlanError as e:
+            log.error(e)
+            sys.exit(2)
+    limits = Limits(policy)
+    clients.limit(limits)
+    try:
+        tokens = TokenCache(args.token_cache or policy.token_cache.get("dir"),
+                            policy.token_cache.get("margin", DEFAULT_TOKEN_MARGIN))
+    except OSError as e:
+        log.error('Cannot create the token cache, the tokens are not kept: {}'.format(e))
+        tokens = TokenCache(None, policy.token_cache.get("margin", DEFAULT_TOKEN_MARGIN))
+    clients.cache_tokens(tokens)
+    metrics_file = args.metrics_file or policy.metrics.get("textfile")
+    metrics_port = (args.metrics_port or policy.metrics.get("port")) if args.daemon else None
+    metrics = None
+    if metrics_file or metrics_port:
+        metrics = Metrics()
+        clients.instrument(metrics)
+    if args.trace:
+        tracing.start()
+    if args.daemon:
+        from checkos.daemon import CHECKS, Daemon
+        selected = [check for check, enabled in zip(CHECKS, [args.check_images, args.check_security_group,
+                                                             args.check_networks, args.check_floating_ip,
+                                                             args.check_vm_zombie]) if enabled]
+        Daemon(testbeds, config, selected or CHECKS, dry_run=args.dry_run, experimenter=args.experimenter,
+               parallel_testbeds=args.parallel_testbeds, project_workers=args.project_workers,
+               state_dir=args.state_dir, renderer=renderer, metrics=metrics, metrics_file=metrics_file,
+               metrics_port=metrics_port, trace_file=args.trace, limits=limits, tokens=tokens).run_forever()
+        return
+    state_dir = args.state_dir or policy.state.get("dir")
+    journal_path = args.journal or policy.journal.get("path")
+    if args.resume and not journal_path:
+        log.error('--resume needs the journal, set --journal or journal.path in the config file {}'.format(config))
+        sys.exit(2)
+    journal = Journal(journal_path, policy.journal.get("fsync-batch", DEFAULT_FSYNC_BATCH),
+                      policy.journal.get("fsync-interval", DEFAULT_FSYNC_INTERVAL)) if journal_path else None
+    try:
+        if args.command == 'plan':
+            plan = plan_zombies(testbeds, policy, args.experimenter)
+            log.info('Planned the removal of {} NSRs, {} NSDs and {} VMs'.format(
+                len(plan.get('nsrs')), len(plan.get('nsds')), len(plan.get('vms'))))
+            if args.output:
+                write_plan(plan, args.output)
+            else:
+                print(json.dumps(plan, indent=2, sort_keys=True))
+            if plan.get('errors'):
+                sys.exit(1)
+        elif args.command == 'apply':
+            renderer.start()
+            results = apply_zombie_plan(plan, testbeds, policy, args.dry_run, renderer)
+            print_results(results, False, False, False, False, True, renderer)
+            if results.failed():
+                sys.exit(1)
+        else:
+            check_testbeds(testbeds, config_dict, args.check_images, args.check_security_group, args.check_networks,
+                           args.check_floating_ip, args.check_vm_zombie, dry_run=args.dry_run,
+                           experimenter=args.experimenter, parallel_testbeds=args.parallel_testbeds,
+                           project_workers=args.project_workers, state_dir=state_dir, full=args.full,
+                           renderer=renderer, shard=args.shard, results_file=args.output if args.shard else None,
+                           journal=journal, resume=args.resume, deadline=args.deadline)
+    finally:
+        tokens.save()
+        if metrics_file:
+            write_metrics(metrics, metrics_file)
+        if args.trace:
+            tracing.write(args.trace)
+
+
+def write_metrics(metrics, metrics_file):
+    metrics.run_finished()
+    try:
+        metrics.write_textfile(metrics_file)
+    except Exception as e:
+        log.error('Exception while writing the metrics to {}: {}'.format(metrics_file, e))
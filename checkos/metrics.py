@@ -0,0 +1,270 @@
+import json
+import logging
+import threading
+import time
+import types
+
+from checkos.files import write_atomic
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# the attributes of the clients that are client objects themselves, e.g. OSClient.nova and nova.servers
+NESTED_CLIENTS = ('neutron', 'nova', 'glance', 'keystone', 'servers', 'images', 'projects')
+
+# the services called by the methods of OSClient itself
+OS_CLIENT_SERVICES = {
+    'list_tenants': 'keystone',
+    'upload_image': 'glance',
+    'list_sec_group': 'neutron',
+    'create_security_group': 'neutron',
+    'list_networks': 'neutron',
+    'list_floatingips': 'neutron',
+    'release_floating_ips': 'neutron',
+    'list_server': 'nova',
+    'delete_server': 'nova',
+}
+
+
+def _payload_size(payload):
+    """
+    :return: the approximate size in bytes of a response, as it would be encoded in JSON
+    """
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, str)):
+        return len(payload)
+    if hasattr(payload, '_info'):
+        # novaclient and keystoneclient resources keep the decoded response in _info
+        payload = payload._info
+    if isinstance(payload, (dict, list, tuple)):
+        try:
+            return len(json.dumps(payload, default=str))
+        except Exception:
+            return 0
+    return 0
+
+
+class _Endpoint(object):
+    __slots__ = ('calls', 'errors', 'bytes', 'latency_sum', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+def _label(value):
+    return str(value or '').replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Call counts, errors, approximate response sizes and latency histograms of the API calls, by testbed, service and
+    endpoint. The values add up over the lifetime of the object, like Prometheus counters.
+
+    Calls to the Experiment Manager and the NFVO are not made for a particular testbed, their testbed label is empty.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.last_run = None
+
+    def observe(self, testbed_name, service, endpoint, latency, error=False, size=0):
+        key = (testbed_name or '', service, endpoint)
+        with self._lock:
+            values = self._endpoints.get(key)
+            if values is None:
+                values = self._endpoints[key] = _Endpoint()
+            values.calls += 1
+            values.errors += 1 if error else 0
+            values.bytes += size
+            values.latency_sum += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    values.buckets[i] += 1
+                    break
+
+    def run_finished(self):
+        self.last_run = time.time()
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+
+            def family(name, metric_type, help_text, samples):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                lines.extend(samples)
+
+            def labels(key, **extra):
+                testbed_name, service, endpoint = key
+                pairs = [('testbed', testbed_name), ('service', service), ('endpoint', endpoint)] + sorted(
+                    extra.items())
+                return '{' + ','.join('{}="{}"'.format(name, _label(value)) for name, value in pairs) + '}'
+
+            family('checkos_api_calls_total', 'counter', 'API calls made by check-os.',
+                   ['checkos_api_calls_total{} {}'.format(labels(key), values.calls) for key, values in endpoints])
+            family('checkos_api_errors_total', 'counter', 'API calls that raised an exception.',
+                   ['checkos_api_errors_total{} {}'.format(labels(key), values.errors)
+                    for key, values in endpoints])
+            family('checkos_api_response_bytes_total', 'counter',
+                   'Approximate size of the API responses, as JSON.',
+                   ['checkos_api_response_bytes_total{} {}'.format(labels(key), values.bytes)
+                    for key, values in endpoints])
+            histogram = []
+            for key, values in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, values.buckets):
+                    cumulative += count
+                    histogram.append('checkos_api_latency_seconds_bucket{} {}'.format(labels(key, le=bound),
+                                                                                     cumulative))
+                histogram.append('checkos_api_latency_seconds_bucket{} {}'.format(labels(key, le='+Inf'),
+                                                                                 values.calls))
+                histogram.append('checkos_api_latency_seconds_sum{} {:.6f}'.format(labels(key), values.latency_sum))
+                histogram.append('checkos_api_latency_seconds_count{} {}'.format(labels(key), values.calls))
+            family('checkos_api_latency_seconds', 'histogram', 'Latency of the API calls.', histogram)
+            if self.last_run is not None:
+                family('checkos_last_run_timestamp_seconds', 'gauge', 'Time at which the last run finished.',
+                       ['checkos_last_run_timestamp_seconds {:.3f}'.format(self.last_run)])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Writes the metrics for the textfile collector of the node exporter. The file is replaced atomically, so the
+        collector never reads a partial file.
+        """
+        write_atomic(path, self.render())
+
+    def serve(self, port, address=''):
+        """
+        Serves the metrics on http://address:port/metrics from a background thread.
+        :return: the server, call shutdown() on it to stop serving
+        """
+        # only the daemon serves the metrics, the other runs do not need to import the HTTP server
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics request from {}: {}'.format(self.client_address[0], format % args))
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name='metrics')
+        thread.daemon = True
+        thread.start()
+        log.info('Serving metrics on port {}'.format(server.server_port))
+        return server
+
+
+class InstrumentedClient(object):
+    """
+    Wraps a client so that every call of one of its public methods, and of the methods of its nested clients, is
+    recorded in the metrics. Everything else, including setting attributes, goes to the wrapped client unchanged.
+    Generators returned by a method, e.g. paginated listings, are timed until they are exhausted.
+    :param service: the service of the calls, None to look it up per method in OS_CLIENT_SERVICES
+    """
+
+    def __init__(self, target, metrics, testbed_name, service, prefix=None):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_metrics', metrics)
+        object.__setattr__(self, '_testbed_name', testbed_name)
+        object.__setattr__(self, '_service', service)
+        object.__setattr__(self, '_prefix', prefix)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith('_'):
+            return value
+        if name in NESTED_CLIENTS and not callable(value):
+            service = self._service or name
+            prefix = '{}.{}'.format(self._prefix, name) if self._prefix else name
+            return InstrumentedClient(value, self._metrics, self._testbed_name, service, prefix)
+        if not callable(value):
+            return value
+        service = self._service or OS_CLIENT_SERVICES.get(name, 'openstack')
+        endpoint = '{}.{}'.format(self._prefix or service, name)
+        return self._timed(value, service, endpoint)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def _timed(self, function, service, endpoint):
+        metrics = self._metrics
+        testbed_name = self._testbed_name
+
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                metrics.observe(testbed_name, service, endpoint, time.time() - started, error=True)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return _timed_generator(result, metrics, testbed_name, service, endpoint, time.time() - started)
+            metrics.observe(testbed_name, service, endpoint, time.time() - started, size=_payload_size(result))
+            return result
+
+        return timed
+
+
+def _timed_generator(generator, metrics, testbed_name, service, endpoint, latency):
+    size = 0
+    error = False
+    try:
+        while True:
+            started = time.time()
+            try:
+                item = next(generator)
+            except StopIteration:
+                latency += time.time() - started
+                return
+            except Exception:
+                latency += time.time() - started
+                error = True
+                raise
+            latency += time.time() - started
+            size += _payload_size(item)
+            yield item
+    finally:
+        metrics.observe(testbed_name, service, endpoint, latency, error=error, size=size)
+
+
+def timed_call(metrics, testbed_name, service, endpoint, function, *args, **kwargs):
+    """
+    Calls function and records the call, e.g. the creation of a client that logs in.
+    """
+    if metrics is None:
+        return function(*args, **kwargs)
+    started = time.time()
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        metrics.observe(testbed_name, service, endpoint, time.time() - started, error=True)
+        raise
+    metrics.observe(testbed_name, service, endpoint, time.time() - started)
+    return result
@@ -0,0 +1,50 @@
+def network_key(network):
+    """
+    :return: what identifies a network for the networks check, for an OpenStack network as well as for a network
+    definition of the config file
+    """
+    return network.get('name'), bool(network.get('shared')), bool(network.get('router:external'))
+
+
+def is_common(network):
+    """
+    :return: True if the network is shared or external, in which case it is the same for all projects of a testbed
+    """
+    return bool(network.get('shared')) or bool(network.get('router:external'))
+
+
+class NetworkVerifier(object):
+    """
+    Finds the expected networks that are missing on a testbed.
+
+    Shared and external networks are visible to every project, so they are looked up once for the testbed when the
+    verifier is created. Only the expected project-private networks are looked up per project, in a set of the keys
+    of the project's networks rather than by comparing every expected network with every network of the project.
+    """
+
+    def __init__(self, expected, common_networks):
+        """
+        :param expected: the expected network definitions, see network_key
+        :param common_networks: the shared and external networks of the testbed
+        """
+        self.common_expected = [network for network in expected if is_common(network)]
+        self.private_expected = [network for network in expected if not is_common(network)]
+        common_keys = set(network_key(network) for network in common_networks)
+        self.missing_common = [network for network in self.common_expected
+                               if network_key(network) not in common_keys]
+
+    def missing_private(self, project_networks):
+        """
+        :param project_networks: the networks of a project; shared and external ones may be included
+        :return: the expected project-private network definitions that the project does not have, in config order
+        """
+        if not self.private_expected:
+            return []
+        keys = set(network_key(network) for network in project_networks)
+        return [network for network in self.private_expected if network_key(network) not in keys]
+
+    def missing(self, project_networks):
+        """
+        :return: all expected network definitions that the project cannot use
+        """
+        return self.missing_common + self.missing_private(project_networks)
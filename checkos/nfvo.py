@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from checkos import clients, tracing
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_TTL = 1800
+
+
+class NfvoSessionPool(object):
+    """
+    Shares one NFVO login between all projects and testbeds of a run.
+
+    The pool authenticates once, resolves project names to project IDs with a single listing and hands out
+    project-scoped OBClients that use the pool's token instead of logging in again. A token is renewed when it is
+    older than the token-ttl of the nfvo config section, or as soon as one of the clients finds out it expired;
+    in that case all the clients pick up the new one.
+    """
+
+    def __init__(self, nfvo_dict):
+        """
+        :param nfvo_dict: the nfvo section of check-vm, as compiled by compile_policy
+        """
+        self.nfvo_dict = nfvo_dict
+        self.token_ttl = nfvo_dict.get("token-ttl", DEFAULT_TOKEN_TTL)
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_time = 0
+        self._project_ids = None
+        self._projects_lock = threading.Lock()
+        self._admin_client = self._new_client()
+        self._login = self._rest_client(self._admin_client)._get_token
+
+    def _new_client(self, project_id=None):
+        return clients.ob_client(nfvo_ip=self.nfvo_dict.get("ip"),
+                                 nfvo_port=self.nfvo_dict.get("port"),
+                                 username=self.nfvo_dict.get("username"),
+                                 password=self.nfvo_dict.get("password"),
+                                 https=self.nfvo_dict.get("https", "false").lower() == "true",
+                                 project_id=project_id)
+
+    @staticmethod
+    def _rest_client(ob_client):
+        # the OBClient has no public way of setting the token, so it is handed to its REST client directly
+        return ob_client.agent_factory._client
+
+    def _fetch_token(self):
+        log.debug('Logging into the NFVO as user {}'.format(self.nfvo_dict.get("username")))
+        with tracing.span('NFVO login', 'client'):
+            self._token = self._login()
+        self._token_time = time.time()
+
+    def token(self):
+        with self._lock:
+            if self._token is None or time.time() - self._token_time > self.token_ttl:
+                self._fetch_token()
+            return self._token
+
+    def _renew_token(self, stale_token):
+        with self._lock:
+            # several clients may notice the expiry at once, only the first one logs in again
+            if self._token is None or self._token == stale_token:
+                self._fetch_token()
+            return self._token
+
+    def _attach(self, ob_client):
+        rest_client = self._rest_client(ob_client)
+        rest_client.token = self.token()
+        rest_client._get_token = lambda: self._renew_token(rest_client.token)
+        return ob_client
+
+    def project_id(self, project_name):
+        """
+        :return: the ID of the NFVO project with the given name or None if there is no such project
+        """
+        with self._projects_lock:
+            if self._project_ids is None:
+                projects = self._attach(self._admin_client).list_projects()
+                self._project_ids = {project.get('name'): project.get('id') for project in projects}
+        return self._project_ids.get(project_name)
+
+    def refresh(self):
+        """
+        Forgets the project names resolved so far, so that new NFVO projects are found. The token is kept.
+        """
+        with self._projects_lock:
+            self._project_ids = None
+
+    def client(self, project_name):
+        """
+        :return: an OBClient scoped to the NFVO project with the given name or None if there is no such project
+        """
+        project_id = self.project_id(project_name)
+        if not project_id:
+            return None
+        return self._attach(self._new_client(project_id))
@@ -0,0 +1,318 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+import yaml
+
+from checkos.results import CHECKS
+
+ANY = 'any'
+
+NETWORK_KEYS = ('name', 'shared', 'router:external')
+
+LIMIT_KEYS = ('concurrency', 'min-concurrency', 'max-concurrency', 'rate', 'burst', 'retries', 'backoff',
+              'max-backoff')
+
+# the kind of value of every setting of the sections that configure the files and the metrics of a run
+PATH = 'path'
+NUMBER = 'number'
+PORT = 'port'
+COUNT = 'count'
+STATE_KEYS = {'dir': PATH, 'ttl': NUMBER}
+JOURNAL_KEYS = {'path': PATH, 'fsync-batch': NUMBER, 'fsync-interval': NUMBER}
+TOKEN_CACHE_KEYS = {'dir': PATH, 'margin': NUMBER}
+METRICS_KEYS = {'textfile': PATH, 'port': PORT}
+IMAGE_SYNC_KEYS = {'workers': COUNT, 'digest-cache': PATH}
+SECURITY_GROUP_SYNC_KEYS = {'workers': COUNT, 'batch-size': COUNT}
+FLOATING_IP_SYNC_KEYS = {'workers': COUNT}
+TEARDOWN_KEYS = {'workers': COUNT, 'poll-interval': NUMBER, 'max-poll-interval': NUMBER, 'timeout': NUMBER}
+
+
+class ConfigError(Exception):
+    """
+    The config file does not have the expected structure.
+    """
+    pass
+
+
+# what the checks of one testbed need from the config file, with the values for any and for the testbed merged
+TestbedPolicy = namedtuple('TestbedPolicy', [
+    'testbed',
+    'images',  # image name -> image definition, the testbed's definition wins over the one for any
+    'security_groups',  # frozenset of security group names
+    'security_group_rules',  # security group name -> tuple of rule templates, the testbed's templates win
+    'networks',  # tuple of network definitions, each a mapping of NETWORK_KEYS
+    'ignored_projects',  # frozenset of project names
+    'ignored_floating_ips',  # frozenset of floating IP addresses
+    'project_workers',  # number of projects checked concurrently, None if not configured
+    'limits',  # service or default -> limiter settings, the testbed's settings win key by key
+])
+
+# the settings of the zombie VM check, shared by all testbeds
+CheckVmPolicy = namedtuple('CheckVmPolicy', [
+    'experiment_manager',
+    'nfvo',
+    'teardown',
+    'ignored_vm_ids',  # frozenset
+    'ignored_nsr_ids',  # frozenset
+])
+
+
+class Policy(object):
+    """
+    The config file compiled into immutable per-testbed plans, so that the checks neither evaluate nor change the
+    config while they run.
+    """
+
+    def __init__(self, testbeds, check_vm=None, image_sync=None, security_group_sync=None, floating_ip_sync=None,
+                 circuit_breaker=None, schedule=None, daemon=None, state=None, journal=None, token_cache=None,
+                 metrics=None):
+        self._testbeds = MappingProxyType(dict(testbeds))
+        self.check_vm = check_vm
+        self.image_sync = image_sync or MappingProxyType({})
+        self.security_group_sync = security_group_sync or MappingProxyType({})
+        self.floating_ip_sync = floating_ip_sync or MappingProxyType({})
+        self.circuit_breaker = circuit_breaker or MappingProxyType({})
+        self.schedule = schedule or MappingProxyType({})
+        self.daemon = daemon or MappingProxyType({})
+        self.state = state or MappingProxyType({})
+        self.journal = journal or MappingProxyType({})
+        self.token_cache = token_cache or MappingProxyType({})
+        self.metrics = metrics or MappingProxyType({})
+
+    def testbed(self, testbed_name):
+        policy = self._testbeds.get(testbed_name)
+        if policy is None:
+            raise KeyError('No policy compiled for testbed {}'.format(testbed_name))
+        return policy
+
+    def testbeds(self):
+        return list(self._testbeds)
+
+
+def load_config(path):
+    """
+    Reads the config file.
+    :raise ConfigError: if it cannot be parsed or is not a mapping
+    """
+    try:
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise ConfigError('Cannot parse the config file {}: {}'.format(path, e))
+    if config is None:
+        return {}
+    if not isinstance(config, dict):
+        raise ConfigError('The config file {} must contain a mapping'.format(path))
+    return config
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _mapping(value, where):
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ConfigError('{} must be a mapping, not {}'.format(where, type(value).__name__))
+    return value
+
+
+def _list(value, where):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ConfigError('{} must be a list, not {}'.format(where, type(value).__name__))
+    return value
+
+
+def _names(section, section_name, testbed_name):
+    """
+    :return: the frozenset of the entries for any and for the testbed in a section of lists of names
+    """
+    names = set()
+    for key in (ANY, testbed_name):
+        for name in _list(section.get(key), '{}.{}'.format(section_name, key)):
+            if not isinstance(name, (str, int, float)):
+                raise ConfigError('{}.{} must only contain names, not {}'.format(section_name, key, name))
+            names.add(str(name))
+    return frozenset(names)
+
+
+def _images(section, testbed_name):
+    images = {}
+    for key in (ANY, testbed_name):
+        for name, image in _mapping(section.get(key), 'images.{}'.format(key)).items():
+            where = 'images.{}.{}'.format(key, name)
+            image = _mapping(image, where)
+            if not isinstance(image.get('path'), str) or not image.get('path'):
+                raise ConfigError('{} must have a path'.format(where))
+            images[str(name)] = _freeze(image)
+    return MappingProxyType(images)
+
+
+def _security_group_rules(section, testbed_name):
+    rules = {}
+    for key in (ANY, testbed_name):
+        for name, templates in _mapping(section.get(key), 'security_group_rules.{}'.format(key)).items():
+            where = 'security_group_rules.{}.{}'.format(key, name)
+            rules[str(name)] = tuple(_freeze(_mapping(template, where)) for template in _list(templates, where))
+    return MappingProxyType(rules)
+
+
+def _networks(section, testbed_name):
+    networks = []
+    for key in (ANY, testbed_name):
+        for i, network in enumerate(_list(section.get(key), 'networks.{}'.format(key))):
+            where = 'networks.{}[{}]'.format(key, i)
+            network = _mapping(network, where)
+            if not isinstance(network.get('name'), str) or not network.get('name'):
+                raise ConfigError('{} must have a name'.format(where))
+            for flag in NETWORK_KEYS[1:]:
+                if not isinstance(network.get(flag, False), bool):
+                    raise ConfigError('{}.{} must be true or false'.format(where, flag))
+            network = MappingProxyType({'name': network.get('name'), 'shared': network.get('shared', False),
+                                        'router:external': network.get('router:external', False)})
+            if network not in networks:
+                networks.append(network)
+    return tuple(networks)
+
+
+def _project_workers(section, testbed_name):
+    workers = section.get(testbed_name) or section.get(ANY)
+    if workers is None:
+        return None
+    if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+        raise ConfigError('project_workers must be positive integers, not {}'.format(workers))
+    return workers
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ConfigError('{} must be a non-negative number, not {}'.format(where, value))
+    return value
+
+
+def _limits(section, testbed_name):
+    limits = {}
+    for key in (ANY, testbed_name):
+        for service, settings in _mapping(section.get(key), 'limits.{}'.format(key)).items():
+            merged = limits.setdefault(str(service), {})
+            for name, value in _mapping(settings, 'limits.{}.{}'.format(key, service)).items():
+                where = 'limits.{}.{}.{}'.format(key, service, name)
+                if name not in LIMIT_KEYS:
+                    raise ConfigError('{} is unknown, choose from {}'.format(where, ', '.join(LIMIT_KEYS)))
+                merged[name] = _number(value, where)
+    return _freeze(limits)
+
+
+def _circuit_breaker(section):
+    for name, value in section.items():
+        if name not in ('failures', 'reset'):
+            raise ConfigError('circuit_breaker.{} is unknown, choose from failures, reset'.format(name))
+        _number(value, 'circuit_breaker.{}'.format(name))
+    return _freeze(section)
+
+
+def _schedule(section):
+    for name, value in section.items():
+        if name == 'deadline':
+            _number(value, 'schedule.deadline')
+        elif name == 'priorities':
+            for check, priority in _mapping(value, 'schedule.priorities').items():
+                if check not in CHECKS:
+                    raise ConfigError('schedule.priorities.{} is unknown, choose from {}'.format(
+                        check, ', '.join(CHECKS)))
+                _number(priority, 'schedule.priorities.{}'.format(check))
+        else:
+            raise ConfigError('schedule.{} is unknown, choose from deadline, priorities'.format(name))
+    return _freeze(section)
+
+
+def _daemon(section):
+    for name, value in section.items():
+        if name != 'intervals':
+            raise ConfigError('daemon.{} is unknown, choose from intervals'.format(name))
+        for check, interval in _mapping(value, 'daemon.intervals').items():
+            if check not in CHECKS:
+                raise ConfigError('daemon.intervals.{} is unknown, choose from {}'.format(check, ', '.join(CHECKS)))
+            _number(interval, 'daemon.intervals.{}'.format(check))
+    return _freeze(section)
+
+
+def _settings(section, section_name, kinds):
+    """
+    Checks a section whose keys are known settings.
+    :param kinds: setting name -> PATH, NUMBER, PORT or COUNT
+    """
+    for name, value in section.items():
+        where = '{}.{}'.format(section_name, name)
+        kind = kinds.get(name)
+        if kind is None:
+            raise ConfigError('{} is unknown, choose from {}'.format(where, ', '.join(sorted(kinds))))
+        if kind == PATH and (not isinstance(value, str) or not value):
+            raise ConfigError('{} must be a path, not {}'.format(where, value))
+        if kind == NUMBER:
+            _number(value, where)
+        if kind == PORT and (isinstance(value, bool) or not isinstance(value, int) or not 0 < value < 65536):
+            raise ConfigError('{} must be a port number, not {}'.format(where, value))
+        if kind == COUNT and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            raise ConfigError('{} must be a positive integer, not {}'.format(where, value))
+    return _freeze(section)
+
+
+def _check_vm(section):
+    if not section.get('experiment-manager') or not section.get('nfvo'):
+        # without them the zombie VM check is skipped, like it always was
+        return None
+    nfvo = _mapping(section.get('nfvo'), 'check-vm.nfvo')
+    if 'token-ttl' in nfvo:
+        _number(nfvo.get('token-ttl'), 'check-vm.nfvo.token-ttl')
+    return CheckVmPolicy(
+        experiment_manager=_freeze(_mapping(section.get('experiment-manager'), 'check-vm.experiment-manager')),
+        nfvo=_freeze(nfvo),
+        teardown=_settings(_mapping(section.get('teardown'), 'check-vm.teardown'), 'check-vm.teardown',
+                           TEARDOWN_KEYS),
+        ignored_vm_ids=frozenset(str(vm_id) for vm_id in _list(section.get('ignore-vm-ids'),
+                                                                 'check-vm.ignore-vm-ids')),
+        ignored_nsr_ids=frozenset(str(nsr_id) for nsr_id in _list(section.get('ignore-nsr-ids'),
+                                                                    'check-vm.ignore-nsr-ids')))
+
+
+def compile_policy(config, testbed_names):
+    """
+    Compiles the config file for the given testbeds.
+    :param config: the parsed config file
+    :raise ConfigError: if the config does not have the expected structure
+    """
+    config = _mapping(config, 'The config file')
+    sections = {name: _mapping(config.get(name), name) for name in
+                ['images', 'security_group', 'security_group_rules', 'security_group_sync', 'networks',
+                 'ignore_projects', 'ignore_floating_ips', 'floating_ip_sync', 'project_workers', 'check-vm',
+                 'image_sync', 'limits', 'circuit_breaker', 'schedule', 'daemon', 'state', 'journal', 'token_cache',
+                 'metrics']}
+    testbeds = {}
+    for testbed_name in testbed_names:
+        testbeds[testbed_name] = TestbedPolicy(
+            testbed=testbed_name,
+            images=_images(sections.get('images'), testbed_name),
+            security_groups=_names(sections.get('security_group'), 'security_group', testbed_name),
+            security_group_rules=_security_group_rules(sections.get('security_group_rules'), testbed_name),
+            networks=_networks(sections.get('networks'), testbed_name),
+            ignored_projects=_names(sections.get('ignore_projects'), 'ignore_projects', testbed_name),
+            ignored_floating_ips=_names(sections.get('ignore_floating_ips'), 'ignore_floating_ips', testbed_name),
+            project_workers=_project_workers(sections.get('project_workers'), testbed_name),
+            limits=_limits(sections.get('limits'), testbed_name))
+    return Policy(testbeds, _check_vm(sections.get('check-vm')),
+                  _settings(sections.get('image_sync'), 'image_sync', IMAGE_SYNC_KEYS),
+                  _settings(sections.get('security_group_sync'), 'security_group_sync', SECURITY_GROUP_SYNC_KEYS),
+                  _settings(sections.get('floating_ip_sync'), 'floating_ip_sync', FLOATING_IP_SYNC_KEYS),
+                  _circuit_breaker(sections.get('circuit_breaker')), _schedule(sections.get('schedule')),
+                  _daemon(sections.get('daemon')), _settings(sections.get('state'), 'state', STATE_KEYS),
+                  _settings(sections.get('journal'), 'journal', JOURNAL_KEYS),
+                  _settings(sections.get('token_cache'), 'token_cache', TOKEN_CACHE_KEYS),
+                  _settings(sections.get('metrics'), 'metrics', METRICS_KEYS))
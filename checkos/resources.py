@@ -0,0 +1,160 @@
+import json
+import logging
+import threading
+
+from checkos import clients, tracing
+
+log = logging.getLogger(__name__)
+
+NODE_TYPES = ['NfvResource', 'SecurityResource', 'MonitoringResource']
+
+
+def _flatten(resources):
+    for res in resources or []:
+        if type(res) is list:
+            for r in res:
+                yield r
+        else:
+            yield res
+
+
+def _parse_value(resource):
+    res_str = resource.get("value")
+    try:
+        value = json.loads(res_str)
+        assert type(value) == dict
+        return value
+    except Exception as e:
+        log.debug('Resource value: {}'.format(res_str))
+        log.error(
+            'Exception while parsing value of resource {} of experiment {}: {}'.format(resource.get('resource_id'),
+                                                                                       resource.get(
+                                                                                           'experiment_id'),
+                                                                                       e))
+        return None
+
+
+class ResourceIndex(object):
+    """
+    The resources known by the Experiment Manager, grouped by username and node_type.
+
+    The resource values are parsed once while the index is built, and the IDs of the NSRs and VMs they refer to
+    are kept in sets, so that looking up what has to be kept for an experimenter does not depend on the number of
+    resources in the federation.
+    """
+
+    def __init__(self, resources):
+        self._resources = {}
+        self._nsr_ids = {}
+        self._vm_ids = {}
+        for resource in _flatten(resources):
+            self._add(resource)
+
+    def _add(self, resource):
+        username = resource.get('username')
+        node_type = resource.get('node_type')
+        self._resources.setdefault(username, {}).setdefault(node_type, []).append(resource)
+        if node_type not in NODE_TYPES:
+            return
+        value = _parse_value(resource)
+        if value is None:
+            return
+
+        if node_type == 'NfvResource':
+            nsr_id = value.get('id')
+            if nsr_id is not None and nsr_id != '':
+                log.debug('Softfire knows of NSR with ID {}'.format(nsr_id))
+                self._nsr_ids.setdefault(username, set()).add(nsr_id)
+            elif resource.get('status') != 'RESERVED':
+                log.warning(
+                    'Expected an NSR ID for NFV resource {} in experiment {}, but it was None or empty string.'.format(
+                        resource.get('resource_id'), resource.get('experiment_id')))
+        elif node_type == 'SecurityResource':
+            nsr_id = value.get('nsr_id')
+            if nsr_id is not None and nsr_id != '':
+                self._nsr_ids.setdefault(username, set()).add(nsr_id)
+            elif resource.get('status') != 'RESERVED':
+                log.warning(
+                    'Expected an NSR ID for security resource {} in experiment {}, but it was None or empty '
+                    'string.'.format(resource.get('resource_id'), resource.get('experiment_id')))
+        elif node_type == 'MonitoringResource':
+            vm_id = value.get('vm_id')
+            if vm_id is not None and vm_id != '':
+                self._vm_ids.setdefault(username, {}).setdefault(value.get('testbed'), set()).add(vm_id)
+            elif resource.get('status') != 'RESERVED':
+                log.warning(
+                    'Expected a VM ID for monitoring resource {} in experiment {}, but it was None or empty '
+                    'string.'.format(resource.get('resource_id'), resource.get('experiment_id')))
+
+    def resources(self, username, node_type):
+        return list(self._resources.get(username, {}).get(node_type, []))
+
+    def nsr_ids(self, username):
+        """
+        :return: the IDs of the NSRs referenced by the NFV and security resources of the experimenter
+        """
+        return set(self._nsr_ids.get(username, set()))
+
+    def vm_ids(self, username, testbed_name):
+        """
+        :return: the IDs of the VMs referenced by the monitoring resources of the experimenter on the testbed,
+        including those of monitoring resources that do not name a testbed
+        """
+        vm_ids = self._vm_ids.get(username, {})
+        return vm_ids.get(testbed_name, set()) | vm_ids.get(None, set())
+
+
+class ExperimentManagerSnapshot(object):
+    """
+    The experimenters and the resource index of the Experiment Manager, fetched once on first use and then shared
+    by all the testbeds of a run.
+
+    If fetching fails, the exception is raised again on every later access, so that each testbed reports it.
+    After refresh the data is fetched again on the next access, reusing the logged in client.
+    """
+
+    def __init__(self, exp_man_dict):
+        self.exp_man_dict = exp_man_dict
+        self._lock = threading.Lock()
+        self._client = None
+        self._loaded = False
+        self._exception = None
+        self._experimenters = None
+        self._resources = None
+
+    def _load(self):
+        with self._lock:
+            if not self._loaded:
+                try:
+                    with tracing.span('fetch Experiment Manager resources', 'client'):
+                        if self._client is None:
+                            self._client = clients.exp_man_client(
+                                username=self.exp_man_dict.get("username"),
+                                password=self.exp_man_dict.get("password"),
+                                experiment_manager_ip=self.exp_man_dict.get("ip"),
+                                experiment_manager_port=self.exp_man_dict.get("port"),
+                                debug=self.exp_man_dict.get("debug", "true").lower() == "true")
+                        self._experimenters = frozenset(self._client.get_all_experimenters())
+                        self._resources = ResourceIndex(self._client.get_all_resources())
+                except Exception as e:
+                    # the session may have expired, log in again next time
+                    self._client = None
+                    self._exception = e
+                self._loaded = True
+        if self._exception is not None:
+            raise self._exception
+
+    def refresh(self):
+        with self._lock:
+            self._loaded = False
+            self._exception = None
+            self._experimenters = None
+            self._resources = None
+
+    def experimenters(self):
+        self._load()
+        return self._experimenters
+
+    def resources(self):
+        self._load()
+        return self._resources
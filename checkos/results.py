@@ -0,0 +1,372 @@
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+from checkos.files import write_atomic
+
+log = logging.getLogger(__name__)
+
+CHECKS = ['images', 'security_group', 'networks', 'floating_ip', 'vm_zombie']
+
+# the outcome of a check of a project, or of a whole testbed if the project is None; these decide the exit code
+CHECK = 'check'
+IMAGE = 'image'
+SECURITY_GROUP = 'security_group'
+NETWORK = 'network'
+FLOATING_IP = 'floating_ip'
+NSR = 'nsr'
+NSD = 'nsd'
+VM = 'vm'
+EXCEPTION = 'exception'
+# a check of a project, or of a whole testbed if the project is None, left for the next run when the time ran out;
+# for a single upload of the image check, its detail is the image
+DEFERRED = 'deferred'
+
+RESULTS_VERSION = 1
+
+
+class ResultsFileError(Exception):
+    """
+    A results file that cannot be read or has the wrong version.
+    """
+    pass
+
+
+class Record(object):
+    """
+    One result of a check: an image that was uploaded, a security group or network that is missing, a floating IP,
+    NSR, NSD or VM that was removed, an exception, or the outcome of a check.
+    :param item: what the record is about, e.g. the ID of a VM or the name of a check
+    :param detail: anything else worth reporting, has to be JSON serializable or is reported as string
+    """
+    __slots__ = ('testbed', 'project', 'kind', 'item', 'successful', 'detail')
+
+    def __init__(self, testbed, project, kind, item, successful=True, detail=None):
+        self.testbed = testbed
+        self.project = project
+        self.kind = kind
+        self.item = item
+        self.successful = successful
+        self.detail = detail
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class ResultStore(object):
+    """
+    The records of a run, indexed by kind, testbed and project in the order they were added.
+
+    Listeners are called with every record as soon as it is added, which is how records are streamed. Records can
+    be added from multiple threads.
+    """
+
+    def __init__(self, listeners=None):
+        self.listeners = list(listeners or [])
+        self._lock = threading.Lock()
+        self._records = []
+        self._by_kind = {}
+        self._by_testbed = {}
+        self._by_project = {}
+        self._failed = False
+
+    def add(self, testbed, project, kind, item, successful=True, detail=None):
+        record = Record(testbed, project, kind, item, successful, detail)
+        self._add(record)
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                # e.g. a closed pipe, which must not interrupt the check that produced the record
+                log.error('Exception while streaming a {} record: {}'.format(kind, e))
+        return record
+
+    def _add(self, record):
+        with self._lock:
+            self._records.append(record)
+            self._by_kind.setdefault(record.kind, []).append(record)
+            self._by_testbed.setdefault(record.kind, OrderedDict()).setdefault(
+                record.testbed, OrderedDict()).setdefault(record.project, []).append(record)
+            self._by_project.setdefault(record.kind, OrderedDict()).setdefault(record.project, []).append(record)
+            if record.kind == CHECK and record.successful is False:
+                self._failed = True
+
+    def extend(self, store):
+        """
+        Adds the records of another store, without passing them to the listeners again.
+        """
+        for record in store.records():
+            self._add(record)
+
+    def records(self, kind=None, testbed=None, project=None):
+        with self._lock:
+            if kind is None:
+                return [record for record in self._records
+                        if (testbed is None or record.testbed == testbed)
+                        and (project is None or record.project == project)]
+            if testbed is None:
+                if project is None:
+                    return list(self._by_kind.get(kind, []))
+                return list(self._by_project.get(kind, {}).get(project, []))
+            by_project = self._by_testbed.get(kind, {}).get(testbed, {})
+            if project is None:
+                return [record for records in by_project.values() for record in records]
+            return list(by_project.get(project, []))
+
+    def testbeds(self, kind):
+        with self._lock:
+            return list(self._by_testbed.get(kind, {}))
+
+    def projects(self, kind, testbed=None):
+        with self._lock:
+            if testbed is None:
+                return list(self._by_project.get(kind, {}))
+            return list(self._by_testbed.get(kind, {}).get(testbed, {}))
+
+    def failed(self):
+        """
+        :return: True if a check failed
+        """
+        return self._failed
+
+
+def _items(records, successful):
+    # an NSR or NSD reached from several testbeds is reported once, with the outcome of the last removal
+    outcomes = OrderedDict((record.item, record.successful) for record in records)
+    return [item for item, outcome in outcomes.items() if outcome is successful]
+
+
+class TextRenderer(object):
+    """
+    The human readable report printed at the end of a run.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def start(self):
+        print(file=self.stream)
+
+    def record(self, record):
+        pass
+
+    def finish(self, store, checks):
+        if 'vm_zombie' in checks:
+            self._vm_zombie(store)
+        if 'floating_ip' in checks:
+            self._floating_ip(store)
+        if 'networks' in checks:
+            self._print("Networks Not Found", [record.detail for record in store.records(NETWORK)])
+        if 'security_group' in checks:
+            security_groups = store.records(SECURITY_GROUP)
+            self._print("Security Groups Not Found", [record.item for record in security_groups
+                                                      if not record.successful])
+            self._print("Security Groups Created", [record.item for record in security_groups if record.successful])
+        if 'images' in checks:
+            self._print("Images Uploaded", [record.item for record in store.records(IMAGE)])
+        if store.records(DEFERRED):
+            self._deferred(store)
+
+    def _deferred(self, store):
+        self._print('~~~~~~~~~~~~~~~~~~~~ Deferred to the next run ~~~~~~~~~~~~~~~~~~~~')
+        for testbed in store.testbeds(DEFERRED):
+            self._print('Testbed {}'.format(testbed))
+            checks = OrderedDict()
+            for record in store.records(DEFERRED, testbed):
+                # the detail is what the unit does in the project or testbed, e.g. the image it uploads
+                if record.detail is not None:
+                    unit = '{} ({})'.format(record.detail, record.project) if record.project else str(record.detail)
+                else:
+                    unit = record.project
+                checks.setdefault(record.item, []).append(unit)
+            for check, units in checks.items():
+                if None in units:
+                    self._print('  {}: all projects'.format(check))
+                else:
+                    self._print('  {}: {}'.format(check, ', '.join(units)))
+            self._print()
+
+    def _print(self, *args):
+        print(*args, file=self.stream)
+
+    def _removals(self, indent, removed, failed):
+        if len(removed) > 0:
+            self._print('{}Removed {}: {}'.format(indent, len(removed), ', '.join(removed)))
+        if len(failed) > 0:
+            self._print('{}Failed to remove {}: {}'.format(indent, len(failed), ', '.join(failed)))
+
+    def _vm_zombie(self, store):
+        self._print('~~~~~~~~~~~~~~~~~~~~~ Check for Zombie VMs ~~~~~~~~~~~~~~~~~~~~~~~~')
+        nsd_projects = store.projects(NSD)
+        nsr_projects = store.projects(NSR)
+        if len(nsd_projects) + len(nsr_projects) > 0:
+            self._print('======== NSDs and NSRs ========\n')
+            for project in OrderedDict.fromkeys(nsr_projects + nsd_projects):
+                nsrs = store.records(NSR, project=project)
+                nsds = store.records(NSD, project=project)
+                self._print('Project {}'.format(project))
+                if len(nsrs) > 0:
+                    self._print('  NSRs')
+                    self._removals('    ', _items(nsrs, True), _items(nsrs, False))
+                if len(nsds) > 0:
+                    self._print('  NSDs')
+                    self._removals('    ', _items(nsds, True), _items(nsds, False))
+                self._print('')
+            self._print('')
+
+        vm_testbeds = store.testbeds(VM)
+        if len(vm_testbeds) > 0:
+            self._print('============= VMs =============\n')
+            for testbed in vm_testbeds:
+                self._print('Testbed {}'.format(testbed))
+                for project in store.projects(VM, testbed):
+                    vms = store.records(VM, testbed, project)
+                    self._print('  Project {}'.format(project))
+                    self._removals('    ', _items(vms, True), _items(vms, False))
+                self._print('')
+            self._print('')
+
+        exceptions = [record for record in store.records(EXCEPTION) if record.item == 'vm_zombie']
+        if len(exceptions) > 0:
+            self._print('========= Exceptions ==========\n')
+            for record in exceptions:
+                self._print('Testbed {}'.format(record.testbed))
+                self._print('  {}\n'.format(record.detail))
+
+    def _floating_ip(self, store):
+        self._print('~~~~~~~~~~~~~~~~~~~~ Check floating IPs ~~~~~~~~~~~~~~~~~~~~~~~')
+        exceptions = [record for record in store.records(EXCEPTION) if record.item == 'floating_ip']
+        testbeds = OrderedDict.fromkeys(store.testbeds(FLOATING_IP) + [record.testbed for record in exceptions])
+        for testbed in testbeds:
+            self._print('Testbed {}'.format(testbed))
+            released = store.records(FLOATING_IP, testbed)
+            projects = OrderedDict.fromkeys([record.project for record in released] +
+                                            [record.project for record in exceptions if record.testbed == testbed])
+            for project in projects:
+                self._print('  Project {}'.format(project))
+                addresses = [record.item for record in store.records(FLOATING_IP, testbed, project)]
+                if len(addresses) > 0:
+                    self._print('    Released floating IPs: {}'.format(', '.join(addresses)))
+                project_exceptions = [record.detail for record in exceptions
+                                      if record.testbed == testbed and record.project == project]
+                if len(project_exceptions) > 0:
+                    self._print('    Exceptions: {}'.format(', '.join(project_exceptions)))
+            self._print()
+
+
+class JsonRenderer(object):
+    """
+    Writes the records as one JSON array, element by element as they are added to the store.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def _dumps(self, record):
+        return json.dumps(record.to_dict(), sort_keys=True, default=str)
+
+    def start(self):
+        with self._lock:
+            self._count = 0
+            self.stream.write('[')
+            self.stream.flush()
+
+    def record(self, record):
+        line = self._dumps(record)
+        with self._lock:
+            self.stream.write('{}\n{}'.format(',' if self._count else '', line))
+            self.stream.flush()
+            self._count += 1
+
+    def finish(self, store, checks):
+        with self._lock:
+            self.stream.write('\n]\n')
+            self.stream.flush()
+
+
+class NdjsonRenderer(JsonRenderer):
+    """
+    Writes every record as one line of JSON as soon as it is added to the store.
+    """
+
+    def start(self):
+        pass
+
+    def record(self, record):
+        line = self._dumps(record)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def finish(self, store, checks):
+        pass
+
+
+RENDERERS = OrderedDict([
+    ('text', TextRenderer),
+    ('json', JsonRenderer),
+    ('ndjson', NdjsonRenderer),
+])
+
+
+def create_renderer(output_format='text', stream=None):
+    return RENDERERS.get(output_format)(stream)
+
+
+def write_results(store, path, checks, testbeds=None, shard=None):
+    """
+    Writes the records of a store, e.g. of one shard of a run, so that they can be merged with the records of the
+    other shards.
+    :param checks: the names of the checks that were run
+    :param testbeds: the names of all testbeds of the run, in the order of the credentials file
+    :param shard: the Shard the records belong to, if any
+    """
+    results = {
+        'version': RESULTS_VERSION,
+        'shard': str(shard) if shard is not None else None,
+        'checks': list(checks),
+        'testbeds': list(testbeds if testbeds is not None else store.testbeds(CHECK)),
+        'records': [record.to_dict() for record in store.records()],
+    }
+    write_atomic(path, json.dumps(results, sort_keys=True, default=str))
+
+
+def read_results(path):
+    """
+    :return: the dict written by write_results
+    :raise ResultsFileError: if the file cannot be read or was not written by this version
+    """
+    try:
+        with open(path, 'r') as f:
+            results = json.loads(f.read())
+    except (IOError, OSError, ValueError) as e:
+        raise ResultsFileError('Cannot read the results file {}: {}'.format(path, e))
+    if not isinstance(results, dict) or results.get('version') != RESULTS_VERSION:
+        raise ResultsFileError('{} is not a version {} results file'.format(path, RESULTS_VERSION))
+    return results
+
+
+def merge_results(parts, store):
+    """
+    Adds the records of the results files to store, by testbed in the order of the credentials file and, within a
+    testbed, in the order of the parts, the way a single run would have added them.
+    :param parts: the dicts returned by read_results
+    :return: the names of the checks that were run by any of the parts, in the usual order
+    """
+    testbeds = OrderedDict()
+    for part in parts:
+        for testbed in part.get('testbeds') or []:
+            testbeds.setdefault(testbed, [])
+    for part in parts:
+        for record in part.get('records') or []:
+            testbeds.setdefault(record.get('testbed'), []).append(record)
+    for records in testbeds.values():
+        for record in records:
+            store.add(record.get('testbed'), record.get('project'), record.get('kind'), record.get('item'),
+                      record.get('successful'), record.get('detail'))
+    checks = set(check for part in parts for check in part.get('checks') or [])
+    return [check for check in CHECKS if check in checks]
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+from checkos.results import CHECKS
+
+log = logging.getLogger(__name__)
+
+# the cleanups that free resources come first, the image uploads, which take longest, last
+DEFAULT_PRIORITIES = {
+    'floating_ip': 50,
+    'vm_zombie': 40,
+    'security_group': 30,
+    'networks': 20,
+    'images': 10,
+}
+
+
+class Scheduler(object):
+    """
+    Decides in which order the work units of a run, a check of a project of a testbed or of a whole testbed, or one
+    image upload, are done, and which of them are deferred because the time budget of the run is used up.
+
+    The checks are run one after the other on all testbeds, in the order of their priority, highest first. Within a
+    check the projects that went longest without a successful check come first, according to the StateStore; the
+    ones that never succeeded, or failed the last time, come before all others. Once the deadline has passed, no new
+    unit is started: the units in progress are finished and the others are deferred to the next run.
+    """
+
+    def __init__(self, priorities=None, deadline=None, state=None):
+        """
+        :param priorities: the priority of each check, higher first; missing ones are taken from DEFAULT_PRIORITIES
+        :param deadline: the number of seconds the run may take, None for no limit
+        :param state: the StateStore that tells when the projects were last checked successfully
+        """
+        self.priorities = dict(DEFAULT_PRIORITIES, **(priorities or {}))
+        self.deadline = time.monotonic() + float(deadline) if deadline is not None else None
+        self.state = state
+        self._lock = threading.Lock()
+        self._deferred = []
+
+    def checks(self, enabled):
+        """
+        :param enabled: the names of the checks of the run
+        :return: the checks in the order they are run
+        """
+        return sorted((check for check in CHECKS if check in enabled),
+                      key=lambda check: -self.priorities.get(check, 0))
+
+    def order(self, testbed_name, check, projects):
+        """
+        :return: the projects, the most stale first; projects that are equally stale keep their order
+        """
+        if self.state is None:
+            return list(projects)
+        last_success = self.state.last_success(testbed_name, check)
+        return sorted(projects, key=lambda project: last_success.get(project.id, 0))
+
+    def remaining(self):
+        """
+        :return: the seconds left until the deadline, None if there is none
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def admit(self, testbed_name, check, project=None, item=None):
+        """
+        :param project: the project of the unit, None for a unit of the whole testbed
+        :param item: what the unit does within the project or testbed, e.g. the image it uploads, None for all of it
+        :return: True if the unit can be started, False if it is deferred
+        """
+        if self.deadline is None or time.monotonic() < self.deadline:
+            return True
+        with self._lock:
+            self._deferred.append((testbed_name, check, project, item))
+        log.debug('Deferring {}{} of {} on testbed {}, the deadline has passed'.format(
+            check, ' {}'.format(item) if item is not None else '',
+            project.name if project is not None else 'all projects', testbed_name))
+        return False
+
+    def admission(self, testbed_name, check):
+        return Admission(self, testbed_name, check)
+
+    def deferred(self):
+        """
+        :return: (testbed name, check, project or None, item or None) of the deferred units, in the order they were
+        deferred
+        """
+        with self._lock:
+            return list(self._deferred)
+
+
+class Admission(object):
+    """
+    Admits the projects of one check of one testbed whose actions, e.g. the security groups to create, are spread
+    over several batches or threads. A project is admitted or deferred when its first action is about to start, and
+    its other actions get the same answer, so that a project is never done in part.
+    """
+
+    def __init__(self, scheduler, testbed_name, check):
+        self.scheduler = scheduler
+        self.testbed_name = testbed_name
+        self.check = check
+        self._lock = threading.Lock()
+        self._admitted = {}
+
+    def __call__(self, project):
+        """
+        :return: True if the actions of the project can be started
+        """
+        with self._lock:
+            if project.id not in self._admitted:
+                self._admitted[project.id] = self.scheduler.admit(self.testbed_name, self.check, project)
+            return self._admitted.get(project.id)
+
+    def deferred(self, project):
+        """
+        :return: True if the project was deferred
+        """
+        with self._lock:
+            return self._admitted.get(project.id) is False
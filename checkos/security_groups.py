@@ -0,0 +1,96 @@
+import logging
+
+from checkos import tracing
+from checkos.workers import map_bounded
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 20
+
+# the result of a creation that was not attempted
+_SKIPPED = object()
+
+
+class SecurityGroupReconciler(object):
+    """
+    Creates the configured security groups in the projects of one testbed that miss them.
+
+    The security groups of all projects come from the admin listing of the Inventory, and the missing (project, group)
+    pairs are the difference of the wanted and the existing pairs. They are created in batches, each batch on one of
+    a bounded number of threads, and every new group gets the rules of its template in the config file. Neutron adds
+    its default egress rules by itself.
+    """
+
+    def __init__(self, cl, inventory, rules=None, workers=None, batch_size=None, dry_run=False):
+        """
+        :param rules: the rule templates by security group name, each a list of neutron security group rules without
+        the security_group_id
+        """
+        self.cl = cl
+        self.inventory = inventory
+        self.rules = rules or {}
+        self.workers = max(1, int(workers or DEFAULT_WORKERS))
+        self.batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+        self.dry_run = dry_run
+
+    def plan(self, expected, projects):
+        """
+        :param expected: the names of the security groups every project needs
+        :return: the (project, group name) pairs that are missing, in the order of the projects and by name
+        """
+        wanted = set((project.id, name) for project in projects for name in expected)
+        existing = set((project.id, group.get('name')) for project in projects
+                       for group in self.inventory.list_sec_group(project.id))
+        missing = wanted - existing
+        return [(project, name) for project in projects for name in sorted(expected) if (project.id, name) in missing]
+
+    def _create(self, project, name):
+        """
+        :return: None if the group was created, the error otherwise
+        """
+        if self.dry_run:
+            log.info('Would create security group {} in project {}'.format(name, project.name))
+            return None
+        try:
+            group = self.cl.neutron.create_security_group({'security_group': {
+                'name': name,
+                'tenant_id': project.id,
+                'description': 'Created by check-os',
+            }}).get('security_group')
+        except Exception as e:
+            log.error('Exception while creating security group {} in project {}: {}'.format(name, project.name, e))
+            return str(e)
+        for rule in self.rules.get(name) or []:
+            try:
+                self.cl.neutron.create_security_group_rule({
+                    'security_group_rule': dict(rule, security_group_id=group.get('id'))})
+            except Exception as e:
+                # the group exists now, so later runs will not add the rule either
+                log.error('Exception while adding a rule to security group {} ({}) in project {}: {}'.format(
+                    name, group.get('id'), project.name, e))
+                return 'created without rule {}: {}'.format(dict(rule), e)
+        log.info('Created security group {} ({}) in project {}'.format(name, group.get('id'), project.name))
+        return None
+
+    def reconcile(self, expected, projects, admit=None):
+        """
+        :param admit: if not None, called with a project before a group is created in it; the groups of the projects
+        it returns False for are not created, see checkos.schedule.Admission
+        :return: a list of (project, group name, error) for the missing groups that were not skipped, error is None if
+        the group was created, or would have been in a dry run
+        """
+        missing = self.plan(expected, projects)
+        log.debug('Security groups to create: {}'.format(len(missing)))
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+
+        def create(batch):
+            with tracing.span('create security groups', 'operation', groups=len(batch)):
+                return [self._create(project, name) if admit is None or admit(project) else _SKIPPED
+                        for project, name in batch]
+
+        results = map_bounded(create, batches, self.workers)
+        errors = [error for batch in results for error in batch]
+        if any(error is not _SKIPPED for error in errors) and not self.dry_run:
+            self.inventory.invalidate('security_groups')
+        return [(project, name, error) for (project, name), error in zip(missing, errors) if error is not _SKIPPED]
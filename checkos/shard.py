@@ -0,0 +1,55 @@
+import hashlib
+
+
+class Shard(object):
+    """
+    One of count shards of the work of a run, numbered from 1.
+
+    The work units are (testbed, project, check), with a project of None for the parts of a check that are done once
+    per testbed. Every unit belongs to exactly one shard, chosen by rendezvous hashing of the unit and the shard
+    numbers: every runner computes the same assignment without talking to the others, and when a shard is added only
+    the units that move to it change their shard.
+
+    The zombie VM check is the exception: its unit is the NFVO project with a testbed of None, so the NSRs of a
+    project and its VMs on every testbed belong to the same shard, which can remove the NSRs before the VMs.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError('Shard {}/{} does not exist'.format(index, count))
+        self.index = index
+        self.count = count
+
+    def __str__(self):
+        return '{}/{}'.format(self.index, self.count)
+
+    @staticmethod
+    def _weight(key, index):
+        return hashlib.sha1('{}#{}'.format(key, index).encode('utf-8')).digest()
+
+    def owner(self, testbed_name, project_id, check):
+        """
+        :return: the number of the shard the unit belongs to
+        """
+        key = '{}/{}/{}'.format(testbed_name, project_id or '', check)
+        return max(range(1, self.count + 1), key=lambda index: self._weight(key, index))
+
+    def owns(self, testbed_name, project_id, check):
+        return self.count == 1 or self.owner(testbed_name, project_id, check) == self.index
+
+    def select(self, testbed_name, check, projects):
+        """
+        :return: the projects whose unit of the check belongs to this shard, in their original order
+        """
+        return [project for project in projects if self.owns(testbed_name, project.id, check)]
+
+
+def parse_shard(text):
+    """
+    :param text: I/N
+    :raise ValueError: if text is not of that form or shard I of N does not exist
+    """
+    index, separator, count = str(text).partition('/')
+    if not separator:
+        raise ValueError('Expected I/N, not {}'.format(text))
+    return Shard(int(index), int(count))
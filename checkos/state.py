@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = 'state.sqlite'
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def fingerprint(*inputs):
+    """
+    :return: a digest of the inputs of a check, which have to be JSON serializable
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class StateStore(object):
+    """
+    Remembers, per testbed, project and check, what the last run saw and how the check ended.
+
+    A check of a project can be skipped if its inputs have the same fingerprint as in the last run, that run was
+    successful and it happened less than ttl seconds ago, so that drift is noticed eventually even if the inputs
+    look the same. With full=True nothing is skipped, but the outcomes are still recorded.
+    """
+
+    def __init__(self, state_dir, ttl=DEFAULT_TTL, full=False):
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        self.path = os.path.join(state_dir, STATE_FILE)
+        self.ttl = ttl
+        self.full = full
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS checks ('
+                                     'testbed TEXT, project TEXT, kind TEXT, fingerprint TEXT, successful INTEGER, '
+                                     'resources TEXT, checked_at REAL, PRIMARY KEY (testbed, project, kind))')
+
+    def unchanged(self, testbed_name, project_id, kind, project_fingerprint):
+        if self.full:
+            return False
+        with self._lock:
+            row = self._connection.execute('SELECT fingerprint, successful, checked_at FROM checks '
+                                           'WHERE testbed = ? AND project = ? AND kind = ?',
+                                           (testbed_name, project_id, kind)).fetchone()
+        if row is None:
+            return False
+        last_fingerprint, successful, checked_at = row
+        return last_fingerprint == project_fingerprint and bool(successful) and time.time() - checked_at < self.ttl
+
+    def select(self, testbed_name, kind, projects, fingerprint_of):
+        """
+        :param fingerprint_of: function computing the fingerprint of the inputs of the check for a project
+        :return: (projects, fingerprints) the projects that have to be checked, in their original order, and the
+        fingerprints of all the projects by project ID
+        """
+        fingerprints = {project.id: fingerprint_of(project) for project in projects}
+        selected = []
+        for project in projects:
+            if self.unchanged(testbed_name, project.id, kind, fingerprints.get(project.id)):
+                log.debug('Skipping {} check of project {}, nothing changed since the last run'.format(
+                    kind, project.name))
+            else:
+                selected.append(project)
+        return selected, fingerprints
+
+    def last_success(self, testbed_name, kind):
+        """
+        :return: the time of the last check of every project whose last check was successful, by project ID
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT project, checked_at FROM checks '
+                                            'WHERE testbed = ? AND kind = ? AND successful = 1',
+                                            (testbed_name, kind)).fetchall()
+        return dict(rows)
+
+    def record(self, testbed_name, project_id, kind, project_fingerprint, successful, resources=None):
+        """
+        :param resources: the IDs of the resources the check looked at
+        """
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (testbed_name, project_id, kind, project_fingerprint, 1 if successful else 0,
+                                      json.dumps(sorted(resources or [])), time.time()))
+
+    def expire(self):
+        """
+        Drops the records that are older than the ttl.
+        """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM checks WHERE checked_at < ?', (time.time() - self.ttl,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,159 @@
+import logging
+import time
+
+from checkos import tracing
+from checkos.workers import map_bounded
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 8
+DEFAULT_TIMEOUT = 120
+
+
+def _ignore(kind, resource_id, successful):
+    pass
+
+
+class TeardownEngine(object):
+    """
+    Deletes the zombie NSRs, NSDs and VMs of one project.
+
+    NSR deletions are issued concurrently, up to the configured number of workers. Instead of waiting a fixed time
+    after each of them, the NSR list of the project is polled until the deleted NSRs are gone. The poll interval
+    grows while nothing changes and starts over whenever an NSR disappears. An NSD is deleted as soon as all the
+    deleted NSRs referring to it are gone. If the NSRs do not disappear before the timeout, their NSDs are deleted
+    anyway, like it was done after the fixed wait.
+
+    The results are recorded in the same format as before: a dict from the ID of each NSR, NSD or VM to
+    {'project': ..., 'successful': ...}, with an additional 'testbed' for VMs.
+    """
+
+    def __init__(self, teardown_dict=None):
+        teardown_dict = teardown_dict or {}
+        self.workers = max(1, int(teardown_dict.get('workers', DEFAULT_WORKERS)))
+        self.poll_interval = float(teardown_dict.get('poll-interval', DEFAULT_POLL_INTERVAL))
+        self.max_poll_interval = float(teardown_dict.get('max-poll-interval', DEFAULT_MAX_POLL_INTERVAL))
+        self.timeout = float(teardown_dict.get('timeout', DEFAULT_TIMEOUT))
+
+    def delete_nsrs(self, ob_client, nsrs_to_remove, nsd_ids_to_keep, project_name, dry=False, nsd_ids=None,
+                    on_result=None):
+        """
+        Deletes the NSRs and, once they are gone, the NSDs they were created from unless they are in nsd_ids_to_keep.
+        :param nsd_ids: if not None, the NSDs to delete instead of the ones of nsrs_to_remove, e.g. because their NSRs
+        were deleted already
+        :param on_result: if not None, called with ('nsr' or 'nsd', ID, successful) right after every deletion
+        :return: (nsds, nsrs) the results of the removals
+        """
+        nsds = {}
+        nsrs = {}
+        if nsd_ids is None:
+            nsd_ids = []
+            for nsr in nsrs_to_remove:
+                nsd_id = nsr.get('descriptor_reference')
+                if nsd_id not in nsd_ids_to_keep and nsd_id not in nsd_ids:
+                    nsd_ids.append(nsd_id)
+        on_result = on_result or _ignore
+        if dry:
+            for nsr in nsrs_to_remove:
+                nsrs[nsr.get('id')] = {'project': project_name, 'successful': True}
+            for nsd_id in nsd_ids:
+                nsds[nsd_id] = {'project': project_name, 'successful': True}
+            return nsds, nsrs
+
+        def delete_nsr(nsr):
+            try:
+                with tracing.span('delete NSR', 'operation', id=nsr.get('id')):
+                    ob_client.delete_nsr(nsr.get("id"))
+                on_result('nsr', nsr.get('id'), True)
+                return True
+            except Exception as e:
+                log.error('Exception while deleting the NSR {}: {}'.format(nsr.get('id'), e))
+                on_result('nsr', nsr.get('id'), False)
+                return False
+
+        pending = {}
+        for nsr, successful in zip(nsrs_to_remove, map_bounded(delete_nsr, nsrs_to_remove, self.workers)):
+            nsrs[nsr.get('id')] = {'project': project_name, 'successful': successful}
+            if successful:
+                pending[nsr.get('id')] = nsr.get('descriptor_reference')
+
+        def delete_nsd(nsd_id):
+            try:
+                with tracing.span('delete NSD', 'operation', id=nsd_id):
+                    ob_client.delete_nsd(nsd_id)
+                on_result('nsd', nsd_id, True)
+                return True
+            except Exception as e:
+                log.error('Exception while deleting the NSD {}: {}'.format(nsd_id, e))
+                on_result('nsd', nsd_id, False)
+                return False
+
+        def delete_ready_nsds():
+            ready = [nsd_id for nsd_id in nsd_ids if nsd_id not in nsds and nsd_id not in pending.values()]
+            for nsd_id, successful in zip(ready, map_bounded(delete_nsd, ready, self.workers)):
+                nsds[nsd_id] = {'project': project_name, 'successful': successful}
+
+        delete_ready_nsds()
+        self._wait_until_gone(ob_client, pending, project_name, delete_ready_nsds)
+        if pending:
+            log.warning('NSRs {} of project {} are still present after {} seconds'.format(
+                ', '.join(pending), project_name, self.timeout))
+            pending.clear()
+        delete_ready_nsds()
+        return nsds, nsrs
+
+    def _wait_until_gone(self, ob_client, pending, project_name, on_progress):
+        """
+        Polls the NSRs of the project until none of the pending ones is left or the timeout expires. Every NSR
+        that is gone is removed from pending and on_progress is called.
+        """
+        interval = self.poll_interval
+        deadline = time.time() + self.timeout
+        while pending and time.time() < deadline:
+            tracing.sleep(min(interval, max(0, deadline - time.time())))
+            try:
+                with tracing.span('poll NSRs', 'operation'):
+                    present = set(nsr.get('id') for nsr in ob_client.list_nsrs())
+            except Exception as e:
+                log.warning('Exception while listing the NSRs of project {}: {}'.format(project_name, e))
+                present = set(pending)
+            gone = [nsr_id for nsr_id in pending if nsr_id not in present]
+            if gone:
+                log.debug('NSRs {} of project {} are gone'.format(', '.join(gone), project_name))
+                for nsr_id in gone:
+                    pending.pop(nsr_id)
+                on_progress()
+                interval = self.poll_interval
+            else:
+                interval = min(interval * 2, self.max_poll_interval)
+
+    def delete_servers(self, cl, vm_ids, project_id, project_name, testbed_name, dry=False, on_result=None):
+        """
+        :param on_result: if not None, called with ('vm', ID, successful) right after every deletion
+        :return: the results of the removals of the VMs
+        """
+        vms = {}
+        on_result = on_result or _ignore
+        if dry:
+            for vm_id in vm_ids:
+                vms[vm_id] = {'testbed': testbed_name, 'project': project_name, 'successful': True}
+            return vms
+
+        def delete_server(vm_id):
+            try:
+                log.debug('Removing VM {}'.format(vm_id))
+                # TODO passing the project ID does not make sense; consider changing the SDK
+                with tracing.span('delete VM', 'operation', id=vm_id):
+                    cl.delete_server(vm_id, project_id)
+                on_result('vm', vm_id, True)
+                return True
+            except Exception as e:
+                log.error('Exception while deleting VM {}: {}'.format(vm_id, e))
+                on_result('vm', vm_id, False)
+                return False
+
+        for vm_id, successful in zip(vm_ids, map_bounded(delete_server, vm_ids, self.workers)):
+            vms[vm_id] = {'testbed': testbed_name, 'project': project_name, 'successful': successful}
+        return vms
@@ -0,0 +1,144 @@
+import calendar
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+
+from checkos.files import write_atomic
+
+log = logging.getLogger(__name__)
+
+# tokens expiring within this many seconds are not reused, so that a check does not start with a token that runs out
+# halfway through
+DEFAULT_MARGIN = 300
+
+
+def expires_at(auth_state):
+    """
+    :param auth_state: the auth state of a keystoneauth1 identity plugin, as returned by get_auth_state
+    :return: the expiry of its token in seconds since the epoch, None if it has no token
+    """
+    try:
+        body = json.loads(auth_state).get('body') or {}
+        # v3 tokens have token.expires_at, v2 ones access.token.expires; keystone writes both in UTC
+        token = body.get('token') or (body.get('access') or {}).get('token') or {}
+        expires = token.get('expires_at') or token.get('expires')
+        return calendar.timegm(time.strptime(expires[:19], '%Y-%m-%dT%H:%M:%S')) if expires else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenCache(object):
+    """
+    Keeps the keystone tokens of the OpenStack clients, so that a new client of the same testbed, user and project
+    reuses the token instead of authenticating again. The keystone, nova, neutron and glance clients of an OSClient are
+    created from one keystoneauth1 session, so they share its auth plugin and HTTP connection pool.
+
+    The tokens are kept in memory and, if directory is not None, in one file per testbed, user and project, readable
+    by the owner only, so that the next run reuses them too. Tokens are dropped margin seconds before they expire.
+    """
+
+    def __init__(self, directory=None, margin=DEFAULT_MARGIN):
+        self.directory = directory
+        self.margin = float(margin)
+        self._lock = threading.Lock()
+        self._states = {}
+        self._attached = {}
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+    @staticmethod
+    def key(testbed_name, testbed, project_id=None):
+        """
+        :return: the name of the cached token of the user of testbed, scoped to project_id or to the admin project
+        """
+        scope = [testbed_name, testbed.get('auth_url'), testbed.get('username'), testbed.get('user_domain_name'),
+                 project_id or testbed.get('admin_project_id') or testbed.get('admin_tenant_name'),
+                 # a new password makes a new key, the token of the old one is not reused
+                 hashlib.sha1(str(testbed.get('password')).encode('utf-8')).hexdigest()]
+        return hashlib.sha1(json.dumps(scope).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.json'.format(key))
+
+    def _fresh(self, auth_state):
+        expiry = expires_at(auth_state)
+        return expiry is not None and expiry - time.time() > self.margin
+
+    def _load(self, key):
+        auth_state = self._states.get(key)
+        if auth_state is None and self.directory is not None:
+            path = self._path(key)
+            try:
+                if os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                    log.warning('Ignoring the cached token {}, it can be read by other users'.format(path))
+                    return None
+                with open(path, 'r') as f:
+                    auth_state = json.loads(f.read()).get('state')
+            except (IOError, OSError):
+                return None
+            except ValueError as e:
+                log.warning('Ignoring the cached token {}: {}'.format(path, e))
+                return None
+        if auth_state is not None and not self._fresh(auth_state):
+            self._forget(key)
+            return None
+        return auth_state
+
+    def _forget(self, key):
+        self._states.pop(key, None)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _store(self, key, auth_state):
+        self._states[key] = auth_state
+        if self.directory is None:
+            return
+        write_atomic(self._path(key), json.dumps({'expires_at': expires_at(auth_state), 'state': auth_state}), 0o600)
+
+    def attach(self, session, testbed_name, testbed, project_id=None):
+        """
+        Gives a keystoneauth1 session the cached token, if there is a fresh one, before any client is created from it,
+        so that the clients do not authenticate. The token the session has at the end is written back by save.
+        :return: True if a cached token was used
+        """
+        auth = getattr(session, 'auth', None)
+        if not hasattr(auth, 'get_auth_state') or not hasattr(auth, 'set_auth_state'):
+            log.debug('The session of testbed {} cannot export its token, tokens are not cached'.format(testbed_name))
+            return False
+        key = self.key(testbed_name, testbed, project_id)
+        with self._lock:
+            auth_state = self._load(key)
+            self._attached[key] = auth
+        if auth_state is None:
+            return False
+        try:
+            auth.set_auth_state(auth_state)
+        except Exception as e:
+            log.warning('Cannot use the cached token of testbed {}: {}'.format(testbed_name, e))
+            return False
+        log.debug('Reusing the cached token of testbed {}'.format(testbed_name))
+        return True
+
+    def save(self):
+        """
+        Stores the tokens the attached clients have now, e.g. after they authenticated during a run.
+        """
+        with self._lock:
+            for key, auth in self._attached.items():
+                try:
+                    auth_state = auth.get_auth_state()
+                except Exception as e:
+                    log.debug('Cannot read the token of a client: {}'.format(e))
+                    continue
+                if auth_state and auth_state != self._states.get(key) and self._fresh(auth_state):
+                    try:
+                        self._store(key, auth_state)
+                    except (IOError, OSError) as e:
+                        log.error('Exception while caching a token in {}: {}'.format(self.directory, e))
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from checkos.files import write_atomic
+
+log = logging.getLogger(__name__)
+
+_tracer = None
+
+
+class _NoSpan(object):
+    """
+    What span returns while tracing is off: entering and leaving it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'category', 'args', 'started')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=str(exc_value))
+        self.tracer.add(self.name, self.category, self.started, time.time(), self.args)
+        return False
+
+
+class Tracer(object):
+    """
+    Collects spans as Chrome trace events, which Perfetto, speedscope and chrome://tracing can open. Spans of the same
+    thread nest by time; every thread is named after the testbed it worked for when it recorded its first span.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+        self._pid = os.getpid()
+
+    def add(self, name, category, started, finished, args=None):
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': thread.ident,
+                 'ts': int(started * 1000000), 'dur': int((finished - started) * 1000000)}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            if thread.ident not in self._threads:
+                # project workers are reused for other projects of the testbed, so only the testbed is kept
+                self._threads[thread.ident] = thread.name.split('/')[0]
+
+    def events(self):
+        with self._lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                        for tid, name in self._threads.items()]
+            return metadata + sorted(self._events, key=lambda event: (event.get('ts'), -event.get('dur')))
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+            self._threads = {}
+
+    def write(self, path):
+        write_atomic(path, json.dumps({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}))
+
+
+def start():
+    """
+    Turns tracing on.
+    :return: the Tracer collecting the spans
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    _tracer = None
+
+
+def span(name, category='', **args):
+    """
+    :return: a context manager recording the time spent in it as a span, if tracing is on
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def sleep(seconds):
+    """
+    time.sleep, recorded as a span.
+    """
+    with span('sleep', 'sleep', seconds=seconds):
+        time.sleep(seconds)
+
+
+def write(path):
+    """
+    Writes the spans collected so far to path and starts collecting anew.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    try:
+        tracer.write(path)
+        log.info('Wrote the trace to {}'.format(path))
+    except Exception as e:
+        log.error('Exception while writing the trace to {}: {}'.format(path, e))
+    tracer.clear()
@@ -0,0 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_bounded(function, items, workers=1):
+    """
+    Calls function for every item, on at most workers threads, or on the calling thread if there is only one worker
+    or one item. If a call fails, the exception of the first item whose call failed is raised.
+    :return: the results in the order of items, regardless of the order in which the calls finished
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, items))
@@ -0,0 +1,259 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from checkos import tracing
+from checkos.files import write_atomic
+from checkos.teardown import TeardownEngine
+
+log = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+# the fields of an NSR that are kept once its VMs are known
+NSR_FIELDS = ('id', 'name', 'descriptor_reference')
+
+# what the NFVO has for one project: the OBClient, the NSRs to remove with their NSR_FIELDS only, the NSDs to remove
+# with them, the NSDs of the kept NSRs and the VMs of the kept NSRs
+NfvoProject = namedtuple('NfvoProject', ['client', 'nsrs', 'nsd_ids', 'nsd_ids_to_keep', 'vm_ids_to_keep'])
+
+
+class PlanError(Exception):
+    """
+    A cleanup plan file that cannot be read or has the wrong version.
+    """
+    pass
+
+
+def vc_ids(nsr):
+    """
+    :return: the set of the IDs of the VMs of an NSR, from its vnfr -> vdu -> vnfc_instance tree
+    """
+    return set(vnfci.get('vc_id')
+               for vnfr in nsr.get('vnfr') or []
+               for vdu in vnfr.get('vdu') or []
+               for vnfci in vdu.get('vnfc_instance') or []
+               if vnfci.get('vc_id'))
+
+
+class ZombieDiff(object):
+    """
+    Compares what the Experiment Manager knows about with what exists on the NFVO and on the testbeds.
+
+    The NSRs, NSDs and VMs to keep are kept in sets: the NSRs in the Experiment Manager's resources or in the ignore
+    list, the NSDs these NSRs were created from, and the VMs in the resources, in the ignore list or in the vnfc
+    instances of the kept NSRs.
+
+    The NSRs and NSDs belong to the NFVO project, not to a testbed. One ZombieDiff is shared by all testbeds of a run,
+    so the NSRs of an NFVO project are listed once and, through remove_once, removed once, however many testbeds the
+    project is on and however many of them are checked concurrently.
+    """
+
+    def __init__(self, exp_man, nfvo, ignored_vm_ids=None, ignored_nsr_ids=None):
+        """
+        :param exp_man: the ExperimentManagerSnapshot
+        :param nfvo: the NfvoSessionPool
+        """
+        self.exp_man = exp_man
+        self.nfvo = nfvo
+        self.ignored_vm_ids = frozenset(str(vm_id) for vm_id in ignored_vm_ids or [])
+        self.ignored_nsr_ids = frozenset(str(nsr_id) for nsr_id in ignored_nsr_ids or [])
+        self._lock = threading.Lock()
+        self._listing_locks = {}
+        self._removal_locks = {}
+        self._projects = {}
+        self._removals = {}
+
+    def _project_lock(self, locks, project_name):
+        with self._lock:
+            return locks.setdefault(project_name, threading.Lock())
+
+    def refresh(self):
+        """
+        Forgets the NFVO projects and their removals, so that the next run lists and removes their NSRs again.
+        """
+        with self._lock:
+            self._projects = {}
+            self._removals = {}
+
+    def experimenters(self):
+        return self.exp_man.experimenters()
+
+    def keep(self, project_name, testbed_name):
+        """
+        :return: (NSR IDs, VM IDs) to keep according to the Experiment Manager and the ignore lists, without asking
+        the NFVO
+        """
+        resources = self.exp_man.resources()
+        return (self.ignored_nsr_ids | resources.nsr_ids(project_name),
+                self.ignored_vm_ids | resources.vm_ids(project_name, testbed_name))
+
+    def nfvo_project(self, project_name):
+        """
+        :return: the NfvoProject of the project, None if the NFVO does not know it
+        """
+        with self._project_lock(self._listing_locks, project_name):
+            if project_name not in self._projects:
+                self._projects[project_name] = self._fetch_nfvo_project(project_name)
+            return self._projects.get(project_name)
+
+    def _fetch_nfvo_project(self, project_name):
+        ob_client = self.nfvo.client(project_name)
+        project = None
+        if ob_client is not None:
+            nsrs_to_keep = self.ignored_nsr_ids | self.exp_man.resources().nsr_ids(project_name)
+            nsd_ids_to_keep = set()
+            vm_ids_to_keep = set()
+            removed = []
+            # the NFVO returns all NSRs in one document; only NSR_FIELDS of the removed ones are kept after it
+            for nsr in ob_client.list_nsrs():
+                if nsr.get('id') in nsrs_to_keep:
+                    nsd_ids_to_keep.add(nsr.get('descriptor_reference'))
+                    vm_ids_to_keep.update(vc_ids(nsr))
+                else:
+                    removed.append({field: nsr.get(field) for field in NSR_FIELDS})
+            nsd_ids = OrderedDict.fromkeys(nsr.get('descriptor_reference') for nsr in removed
+                                           if nsr.get('descriptor_reference') not in nsd_ids_to_keep)
+            project = NfvoProject(ob_client, removed, list(nsd_ids), nsd_ids_to_keep, vm_ids_to_keep)
+        return project
+
+    def remove_once(self, project_name, remove):
+        """
+        Calls remove to delete the zombie NSRs and NSDs of an NFVO project, unless it was called for the project
+        before. A testbed that gets here while another one is removing them waits until they are removed, so that its
+        VMs are only deleted after the NSRs, like on the testbed that removed them.
+        :return: what remove returned, None if it was called before
+        """
+        with self._project_lock(self._removal_locks, project_name):
+            with self._lock:
+                if project_name in self._removals:
+                    return None
+                # also if remove fails, so that the other testbeds do not try again
+                self._removals[project_name] = None
+            removal = remove()
+            with self._lock:
+                self._removals[project_name] = removal
+            return removal
+
+    def remaining_nsr_ids(self, project_name, nfvo_project):
+        """
+        :param nfvo_project: the NfvoProject of the project
+        :return: the IDs of the zombie NSRs of the project that were not removed in this run
+        """
+        with self._lock:
+            removal = self._removals.get(project_name)
+        removed = set(nsr_id for nsr_id, record in (removal or ({}, {}))[1].items() if record.get('successful'))
+        return [nsr.get('id') for nsr in nfvo_project.nsrs if nsr.get('id') not in removed]
+
+    def zombie_vms(self, project_name, testbed_name, vm_ids, nfvo_project):
+        """
+        :return: the IDs out of vm_ids that are not to be kept, in their original order
+        """
+        vms_to_keep = self.keep(project_name, testbed_name)[1] | nfvo_project.vm_ids_to_keep
+        return [vm_id for vm_id in vm_ids if vm_id not in vms_to_keep]
+
+
+def create_plan(diff, scopes):
+    """
+    Finds the zombies without deleting anything.
+    :param diff: the ZombieDiff
+    :param scopes: (testbed name, Inventory, projects) for every testbed, the projects already filtered
+    :return: the cleanup plan, a dict that can be written with write_plan and executed with apply_plan
+    """
+    plan = {'version': PLAN_VERSION, 'created': time.time(), 'nsrs': [], 'nsds': [], 'vms': [], 'errors': []}
+    planned = set()
+    for testbed_name, inventory, projects in scopes:
+        try:
+            for project in projects:
+                with tracing.span(project.name, 'project'):
+                    nfvo_project = diff.nfvo_project(project.name)
+                    if nfvo_project is None:
+                        log.warning('Openstack project {} was not found on OB so it will be skipped.'.format(
+                            project.name))
+                        continue
+                    if project.name not in planned:
+                        planned.add(project.name)
+                        plan['nsrs'].extend(dict(nsr, project=project.name) for nsr in nfvo_project.nsrs)
+                        plan['nsds'].extend({'project': project.name, 'id': nsd_id} for nsd_id in nfvo_project.nsd_ids)
+                    servers = OrderedDict((vm.id, getattr(vm, 'name', None))
+                                          for vm in inventory.list_server(project.id))
+                    plan['vms'].extend({'testbed': testbed_name, 'project': project.name, 'project_id': project.id,
+                                        'id': vm_id, 'name': servers.get(vm_id)}
+                                       for vm_id in diff.zombie_vms(project.name, testbed_name, servers,
+                                                                    nfvo_project))
+        except Exception as e:
+            log.error('Exception while planning the cleanup of testbed {}: {}'.format(testbed_name, e))
+            plan['errors'].append({'testbed': testbed_name, 'error': str(e)})
+    return plan
+
+
+def write_plan(plan, path):
+    write_atomic(path, json.dumps(plan, indent=2, sort_keys=True))
+
+
+def read_plan(path):
+    """
+    :raise PlanError: if the file cannot be read or is not a plan of this version
+    """
+    try:
+        with open(path, 'r') as f:
+            plan = json.loads(f.read())
+    except (IOError, OSError, ValueError) as e:
+        raise PlanError('Cannot read the plan {}: {}'.format(path, e))
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        raise PlanError('{} is not a version {} cleanup plan'.format(path, PLAN_VERSION))
+    return plan
+
+
+def _group(entries, *keys):
+    groups = OrderedDict()
+    for entry in entries or []:
+        groups.setdefault(tuple(entry.get(key) for key in keys), []).append(entry)
+    return groups
+
+
+def apply_plan(plan, os_client, nfvo, teardown_dict=None, dry=False):
+    """
+    Deletes what a plan lists, project by project: first the NSRs, then, once they are gone, their NSDs, then the VMs.
+    Entries removed from the plan during the review are kept. An NSD is only deleted together with the NSRs created
+    from it, so removing one of those NSRs from the plan keeps the NSD as well.
+    :param os_client: a function returning the OSClient of a testbed name
+    :param nfvo: the NfvoSessionPool
+    :return: (nsds, nsrs, vms) the results of the removals, in the format of TeardownEngine
+    """
+    teardown = TeardownEngine(teardown_dict)
+    nsds = {}
+    nsrs = {}
+    vms = {}
+    nsds_by_project = _group(plan.get('nsds'), 'project')
+    for (project_name,), entries in _group(plan.get('nsrs'), 'project').items():
+        with tracing.span(project_name, 'project'):
+            project_nsrs = [{'id': entry.get('id'), 'descriptor_reference': entry.get('descriptor_reference')}
+                            for entry in entries]
+            nsd_ids = set(entry.get('id') for entry in nsds_by_project.get((project_name,), []))
+            nsd_ids_to_keep = set(nsr.get('descriptor_reference') for nsr in project_nsrs) - nsd_ids
+            ob_client = nfvo.client(project_name)
+            if ob_client is None:
+                log.warning('Project {} was not found on OB, its NSRs are not removed'.format(project_name))
+                for nsr in project_nsrs:
+                    nsrs[nsr.get('id')] = {'project': project_name, 'successful': False}
+                continue
+            project_nsds, project_nsrs = teardown.delete_nsrs(ob_client, project_nsrs, nsd_ids_to_keep, project_name,
+                                                              dry)
+            nsds.update(project_nsds)
+            nsrs.update(project_nsrs)
+    for (testbed_name, project_name), entries in _group(plan.get('vms'), 'testbed', 'project').items():
+        vm_ids = [entry.get('id') for entry in entries]
+        with tracing.span(project_name, 'project'):
+            try:
+                cl = os_client(testbed_name)
+                vms.update(teardown.delete_servers(cl, vm_ids, nfvo.project_id(project_name), project_name,
+                                                   testbed_name, dry))
+            except Exception as e:
+                log.error('Exception while removing the VMs of project {} on testbed {}: {}'.format(
+                    project_name, testbed_name, e))
+                for vm_id in vm_ids:
+                    vms[vm_id] = {'testbed': testbed_name, 'project': project_name, 'successful': False}
+    return nsds, nsrs, vms
@@ -22,7 +22,7 @@ setup(
     license="Apache 2",
     keywords="python vnfm nfvo open baton openbaton sdk experiment manager softfire tosca openstack rest",
     url="http://softfire.eu/",
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'tests.*']),
     scripts=["check_os"],
     install_requires=[
         'softfire-sdk',
@@ -0,0 +1,3 @@
+"""
+Tests of check-os, run against the fake clients of tests.fakes, e.g. with python -m pytest tests
+"""
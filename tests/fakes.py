@@ -0,0 +1,541 @@
+"""
+In-process stand-ins for OSClient, ExpManClient and OBClient, serving a synthetic federation.
+
+A Federation holds the testbeds, their projects, security groups, networks, floating IPs, servers and images, the
+experimenters and resources of the Experiment Manager and the projects and NSRs of the NFVO. Every call of a fake
+goes through an Endpoints object, which counts it, waits for the configured latency and fails with the configured
+probability. install() makes checkos.clients hand out the fakes instead of the real clients.
+
+The tests and the benchmarks both run against these fakes.
+"""
+import collections
+import json
+import random
+import threading
+import time
+
+EXPECTED_SECURITY_GROUPS = ['ob_sec_group', 'softfire-default']
+EXPECTED_NETWORKS = [
+    {'name': 'softfire-network', 'shared': False, 'router:external': True},
+    {'name': 'softfire-internal', 'shared': True, 'router:external': False},
+]
+
+
+class FakeApiError(Exception):
+    """
+    The error raised by a fake endpoint, carrying an HTTP status like the errors of the client libraries.
+    """
+
+    def __init__(self, endpoint, status_code=503):
+        super(FakeApiError, self).__init__('{} failed with HTTP {}'.format(endpoint, status_code))
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.http_status = status_code
+
+
+class Endpoints(object):
+    """
+    Counts the calls of every endpoint and injects latency and errors.
+    :param latency: seconds every call takes, or a dict from endpoint name prefix to seconds
+    :param error_rate: probability that a call fails, or a dict from endpoint name prefix to probability
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def _lookup(setting, endpoint):
+        if not isinstance(setting, dict):
+            return setting
+        matches = [prefix for prefix in setting if endpoint.startswith(prefix)]
+        return setting.get(max(matches, key=len)) if matches else 0.0
+
+    def call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+            failed = self._random.random() < self._lookup(self.error_rate, endpoint)
+            if failed:
+                self.errors[endpoint] += 1
+        latency = self._lookup(self.latency, endpoint)
+        if latency:
+            time.sleep(latency)
+        if failed:
+            raise FakeApiError(endpoint)
+
+
+class Resource(object):
+    """
+    A nova server, glance image or keystone project; these are objects in the client libraries, the neutron
+    resources are dicts.
+    """
+    __slots__ = ('id', 'name', 'tenant_id', 'owner', 'checksum', 'visibility', 'status')
+
+    def __init__(self, id, name, tenant_id=None, owner=None, checksum=None, visibility=None, status=None):
+        self.id = id
+        self.name = name
+        self.tenant_id = tenant_id
+        self.owner = owner
+        self.checksum = checksum
+        self.visibility = visibility
+        self.status = status
+
+
+class Testbed(object):
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.projects = []
+        self.security_groups = collections.OrderedDict()
+        self.networks = collections.OrderedDict()
+        self.floating_ips = collections.OrderedDict()
+        self.servers = collections.OrderedDict()
+        self.images = collections.OrderedDict()
+        self.created_images = 0
+
+
+class Federation(object):
+    """
+    A synthetic SoftFIRE federation.
+
+    Every experimenter has a project on every testbed and one on the NFVO. Half of the NSRs of an experimenter are
+    known to the Experiment Manager and keep the VMs they refer to, the other half and the remaining VMs are
+    zombies. Half of the floating IPs are associated, the others can be released. Every other project misses one of
+    the expected security groups.
+    """
+
+    def __init__(self, testbeds=10, projects=1000, vms=20, nsrs=4, floating_ips=4):
+        self.testbed_names = ['testbed{}'.format(t) for t in range(testbeds)]
+        self.experimenters = ['experimenter{}'.format(p) for p in range(projects)]
+        self.testbeds = collections.OrderedDict()
+        self.resources = []
+        self.nfvo_projects = [{'id': 'nfvo-admin', 'name': 'default'}]
+        self.nsrs = {}
+        self.nfvo_lock = threading.Lock()
+        for testbed_name in self.testbed_names:
+            self.testbeds[testbed_name] = self._build_testbed(testbed_name, vms, floating_ips)
+        for p, experimenter in enumerate(self.experimenters):
+            nfvo_project_id = 'nfvo-{}'.format(p)
+            self.nfvo_projects.append({'id': nfvo_project_id, 'name': experimenter})
+            project_nsrs = collections.OrderedDict()
+            for n in range(nsrs):
+                nsr_id = '{}-nsr{}'.format(experimenter, n)
+                # a kept NSR refers to VM n of the experimenter on every testbed
+                vc_ids = ['{}-{}-vm{}'.format(testbed_name, p, n) for testbed_name in self.testbed_names] \
+                    if n % 2 == 0 else []
+                vnfc_instances = [{'vc_id': vc_id} for vc_id in vc_ids]
+                project_nsrs[nsr_id] = {'id': nsr_id, 'descriptor_reference': '{}-nsd{}'.format(experimenter, n),
+                                        'vnfr': [{'vdu': [{'vnfc_instance': vnfc_instances}]}]}
+                if n % 2 == 0:
+                    self.resources.append({'username': experimenter, 'node_type': 'NfvResource',
+                                           'resource_id': nsr_id, 'experiment_id': '{}-experiment'.format(p),
+                                           'status': 'DEPLOYED', 'value': json.dumps({'id': nsr_id})})
+            self.nsrs[nfvo_project_id] = project_nsrs
+
+    def _build_testbed(self, testbed_name, vms, floating_ips):
+        testbed = Testbed(testbed_name)
+        admin = Resource('{}-admin'.format(testbed_name), 'admin')
+        testbed.projects.append(admin)
+        for network in EXPECTED_NETWORKS:
+            network_id = '{}-{}'.format(testbed_name, network.get('name'))
+            testbed.networks[network_id] = dict(network, id=network_id, tenant_id=admin.id, project_id=admin.id)
+        image_id = '{}-image'.format(testbed_name)
+        testbed.images[image_id] = Resource(image_id, 'softfire-image', owner=admin.id, visibility='public',
+                                            status='active')
+        for p, experimenter in enumerate(self.experimenters):
+            project_id = '{}-{}'.format(testbed_name, p)
+            testbed.projects.append(Resource(project_id, experimenter))
+            groups = ['default'] + EXPECTED_SECURITY_GROUPS[:len(EXPECTED_SECURITY_GROUPS) - p % 2]
+            for name in groups:
+                group_id = '{}-{}'.format(project_id, name)
+                testbed.security_groups[group_id] = {'id': group_id, 'name': name, 'tenant_id': project_id,
+                                                     'project_id': project_id}
+            network_id = '{}-net'.format(project_id)
+            testbed.networks[network_id] = {'id': network_id, 'name': 'private', 'shared': False,
+                                            'router:external': False, 'tenant_id': project_id,
+                                            'project_id': project_id}
+            for f in range(floating_ips):
+                fip_id = '{}-fip{}'.format(project_id, f)
+                testbed.floating_ips[fip_id] = {
+                    'id': fip_id, 'tenant_id': project_id, 'project_id': project_id,
+                    'floating_ip_address': '10.{}.{}.{}'.format(p // 250, p % 250, f),
+                    'fixed_ip_address': '192.168.0.{}'.format(f) if f % 2 == 0 else None}
+            for v in range(vms):
+                server_id = '{}-{}-vm{}'.format(testbed_name, p, v)
+                testbed.servers[server_id] = Resource(server_id, 'vm{}'.format(v), tenant_id=project_id,
+                                                      status='ACTIVE')
+        return testbed
+
+    def credentials(self):
+        """
+        :return: the content of an openstack-credentials.json file for the testbeds
+        """
+        return collections.OrderedDict(
+            (testbed_name, {'username': 'admin', 'password': 'admin', 'auth_url': 'http://{}:5000/v3'.format(
+                testbed_name), 'api_version': 3, 'admin_project_id': testbed.projects[0].id})
+            for testbed_name, testbed in self.testbeds.items())
+
+
+def _page(resources, marker=None, limit=None):
+    resources = list(resources)
+    if marker is not None:
+        ids = [_id_of(resource) for resource in resources]
+        resources = resources[ids.index(marker) + 1:] if marker in ids else []
+    if limit is not None:
+        resources = resources[:int(limit)]
+    return resources
+
+
+def _id_of(resource):
+    return resource.get('id') if isinstance(resource, dict) else resource.id
+
+
+def _matches(resource, filters):
+    for key, value in filters.items():
+        if key in ('tenant_id', 'project_id'):
+            if resource.get('tenant_id') != value:
+                return False
+        elif key in ('fields', 'limit', 'marker', 'sort_key', 'sort_dir'):
+            continue
+        elif resource.get(key) != value:
+            return False
+    return True
+
+
+class FakeNeutron(object):
+    def __init__(self, testbed, endpoints):
+        self._testbed = testbed
+        self._endpoints = endpoints
+
+    def _list(self, endpoint, collection, resources, retrieve_all, filters):
+        self._endpoints.call(endpoint)
+        with self._testbed.lock:
+            matching = [dict(resource) for resource in resources.values() if _matches(resource, filters)]
+        if retrieve_all:
+            return {collection: matching}
+        limit = int(filters.get('limit') or 1000)
+        # like neutronclient, a generator of pages that fetches the next page while it is consumed
+        return ({collection: matching[start:start + limit]} for start in range(0, max(len(matching), 1), limit))
+
+    def list_security_groups(self, retrieve_all=True, **filters):
+        return self._list('neutron.list_security_groups', 'security_groups', self._testbed.security_groups,
+                          retrieve_all, filters)
+
+    def list_networks(self, retrieve_all=True, **filters):
+        return self._list('neutron.list_networks', 'networks', self._testbed.networks, retrieve_all, filters)
+
+    def list_floatingips(self, retrieve_all=True, **filters):
+        return self._list('neutron.list_floatingips', 'floatingips', self._testbed.floating_ips, retrieve_all,
+                          filters)
+
+    def delete_floatingip(self, floating_ip_id):
+        self._endpoints.call('neutron.delete_floatingip')
+        with self._testbed.lock:
+            self._testbed.floating_ips.pop(floating_ip_id)
+
+    def create_security_group(self, body):
+        self._endpoints.call('neutron.create_security_group')
+        group = dict(body.get('security_group'))
+        with self._testbed.lock:
+            group['id'] = '{}-sg{}'.format(self._testbed.name, len(self._testbed.security_groups))
+            group.setdefault('project_id', group.get('tenant_id'))
+            group.setdefault('tenant_id', group.get('project_id'))
+            self._testbed.security_groups[group.get('id')] = group
+        return {'security_group': dict(group)}
+
+    def create_security_group_rule(self, body):
+        self._endpoints.call('neutron.create_security_group_rule')
+        return {'security_group_rule': dict(body.get('security_group_rule'))}
+
+
+class FakeServers(object):
+    def __init__(self, testbed, endpoints):
+        self._testbed = testbed
+        self._endpoints = endpoints
+
+    def list(self, detailed=True, search_opts=None, marker=None, limit=None, **kwargs):
+        self._endpoints.call('nova.servers.list')
+        search_opts = search_opts or {}
+        with self._testbed.lock:
+            servers = [server for server in self._testbed.servers.values()
+                       if not search_opts.get('tenant_id') or server.tenant_id == search_opts.get('tenant_id')]
+        return _page(servers, marker, limit)
+
+    def delete(self, server_id):
+        self._endpoints.call('nova.servers.delete')
+        with self._testbed.lock:
+            self._testbed.servers.pop(server_id)
+
+
+class FakeImages(object):
+    def __init__(self, testbed, endpoints):
+        self._testbed = testbed
+        self._endpoints = endpoints
+
+    def list(self, **kwargs):
+        self._endpoints.call('glance.images.list')
+        with self._testbed.lock:
+            return iter(list(self._testbed.images.values()))
+
+    def create(self, name=None, visibility='public', owner=None, **kwargs):
+        self._endpoints.call('glance.images.create')
+        with self._testbed.lock:
+            self._testbed.created_images += 1
+            image = Resource('{}-image{}'.format(self._testbed.name, self._testbed.created_images), name, owner=owner,
+                             visibility=visibility, status='queued')
+            self._testbed.images[image.id] = image
+        return image
+
+    def upload(self, image_id, image_data, image_size=None):
+        self._endpoints.call('glance.images.upload')
+        for _ in iter(lambda: image_data.read(65536), b''):
+            pass
+        self._testbed.images.get(image_id).status = 'active'
+
+    def delete(self, image_id):
+        self._endpoints.call('glance.images.delete')
+        with self._testbed.lock:
+            self._testbed.images.pop(image_id)
+
+
+class FakeProjects(object):
+    def __init__(self, testbed, endpoints):
+        self._testbed = testbed
+        self._endpoints = endpoints
+
+    def list(self, name=None, **kwargs):
+        self._endpoints.call('keystone.projects.list')
+        return [project for project in self._testbed.projects if name is None or project.name == name]
+
+
+class _Namespace(object):
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakeAuth(object):
+    """
+    Stands in for a keystoneauth1 identity plugin: it authenticates on the first request and can export and import
+    its token with get_auth_state and set_auth_state.
+    """
+
+    def __init__(self, endpoints, lifetime=3600):
+        self._endpoints = endpoints
+        self._lifetime = lifetime
+        self._lock = threading.Lock()
+        self._state = None
+
+    def get_token(self):
+        with self._lock:
+            if self._state is None:
+                self._endpoints.call('keystone.auth')
+                expires = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(time.time() + self._lifetime))
+                self._state = json.dumps({'auth_token': 'token', 'body': {'token': {'expires_at': expires}}})
+            return self._state
+
+    def get_auth_state(self):
+        return self._state
+
+    def set_auth_state(self, auth_state):
+        self._state = auth_state
+
+
+class FakeSession(object):
+    """
+    Stands in for a keystoneauth1 session.
+    """
+
+    def __init__(self, endpoints):
+        self.auth = FakeAuth(endpoints)
+
+
+class _SessionEndpoints(object):
+    """
+    The endpoints of the clients created from a session: every call authenticates first, like a keystoneauth1
+    session does.
+    """
+
+    def __init__(self, endpoints, session):
+        self._endpoints = endpoints
+        self._session = session
+
+    def call(self, endpoint):
+        self._session.auth.get_token()
+        self._endpoints.call(endpoint)
+
+
+class FakeOSClient(object):
+    """
+    Stands in for sdk.softfire.os_utils.OSClient on one testbed of the federation.
+    """
+
+    def __init__(self, federation, endpoints, testbed_name, testbed, session=None):
+        self.session = session or FakeSession(endpoints)
+        endpoints = _SessionEndpoints(endpoints, self.session)
+        self.testbed_name = testbed_name
+        self.testbed = testbed
+        self.api_version = testbed.get('api_version', 3)
+        self._testbed = federation.testbeds.get(testbed_name)
+        self._endpoints = endpoints
+        self.neutron = FakeNeutron(self._testbed, endpoints)
+        self.nova = _Namespace(servers=FakeServers(self._testbed, endpoints))
+        self.glance = _Namespace(images=FakeImages(self._testbed, endpoints))
+        self.keystone = _Namespace(projects=FakeProjects(self._testbed, endpoints))
+
+    def list_tenants(self):
+        return self.keystone.projects.list()
+
+    def list_sec_group(self, project_id):
+        return self.neutron.list_security_groups(tenant_id=project_id).get('security_groups')
+
+    def list_networks(self, project_id=None):
+        return [net for net in self.neutron.list_networks().get('networks')
+                if net.get('tenant_id') == project_id or net.get('shared') or net.get('router:external')]
+
+    def list_floatingips(self, project_id):
+        return self.neutron.list_floatingips(tenant_id=project_id).get('floatingips')
+
+    def list_server(self, project_id):
+        return self.nova.servers.list(search_opts={'all_tenants': 1, 'tenant_id': project_id})
+
+    def delete_server(self, server_id, project_id=None):
+        self.nova.servers.delete(server_id)
+
+
+class FakeExpManClient(object):
+    """
+    Stands in for sdk.softfire.exp_man_client.ExpManClient.
+    """
+
+    def __init__(self, federation, endpoints, **kwargs):
+        endpoints.call('exp_man.login')
+        self._federation = federation
+        self._endpoints = endpoints
+
+    def get_all_experimenters(self):
+        self._endpoints.call('exp_man.get_all_experimenters')
+        return list(self._federation.experimenters)
+
+    def get_all_resources(self):
+        self._endpoints.call('exp_man.get_all_resources')
+        return list(self._federation.resources)
+
+
+class FakeRestClient(object):
+    def __init__(self, endpoints, project_id):
+        self._endpoints = endpoints
+        self.project_id = project_id
+        self.token = None
+
+    def _get_token(self):
+        self._endpoints.call('nfvo.token')
+        return 'token'
+
+    def check_token(self):
+        if self.token is None:
+            self.token = self._get_token()
+
+
+class FakeOBClient(object):
+    """
+    Stands in for org.openbaton.sdk.client.OBClient, including the token handling of its REST client.
+    """
+
+    def __init__(self, federation, endpoints, project_name=None, project_id=None, **kwargs):
+        self._federation = federation
+        self._endpoints = endpoints
+        self.agent_factory = _Namespace(_client=FakeRestClient(endpoints, project_id))
+        self.project_id = project_id
+        if not project_id and project_name:
+            for project in self.list_projects():
+                if project.get('name') == project_name:
+                    self.project_id = project.get('id')
+            self.agent_factory._client.project_id = self.project_id
+
+    def _call(self, endpoint):
+        self.agent_factory._client.check_token()
+        self._endpoints.call(endpoint)
+
+    def list_projects(self):
+        self._call('nfvo.list_projects')
+        return [dict(project) for project in self._federation.nfvo_projects]
+
+    def _nsrs(self):
+        return self._federation.nsrs.setdefault(self.project_id, collections.OrderedDict())
+
+    def list_nsrs(self):
+        self._call('nfvo.list_nsrs')
+        with self._federation.nfvo_lock:
+            # the NFVO returns a fresh JSON document on every call
+            return json.loads(json.dumps(list(self._nsrs().values())))
+
+    def get_nsr(self, nsr_id):
+        self._call('nfvo.get_nsr')
+        with self._federation.nfvo_lock:
+            return json.loads(json.dumps(self._nsrs().get(nsr_id)))
+
+    def delete_nsr(self, nsr_id):
+        self._call('nfvo.delete_nsr')
+        with self._federation.nfvo_lock:
+            self._nsrs().pop(nsr_id)
+
+    def delete_nsd(self, nsd_id):
+        self._call('nfvo.delete_nsd')
+
+
+def create_config(federation, image_path):
+    """
+    :return: a config file that checks the federation for the expected security groups, networks and image
+    """
+    config = {
+        'ignore_projects': {'any': ['admin']},
+        'images': {'any': {'softfire-image': {'path': image_path, 'shared': True}}},
+        'security_group': {'any': list(EXPECTED_SECURITY_GROUPS)},
+        'networks': {},
+        'ignore_floating_ips': {'any': []},
+        'check-vm': {
+            'experiment-manager': {'username': 'admin', 'password': 'admin', 'ip': 'localhost', 'port': 5080,
+                                   'debug': 'false'},
+            'nfvo': {'username': 'admin', 'password': 'openbaton', 'ip': 'localhost', 'port': 8080},
+            'ignore-vm-ids': [],
+            'ignore-nsr-ids': [],
+            'teardown': {'poll-interval': 0.01, 'max-poll-interval': 0.1},
+        },
+    }
+    for testbed_name in federation.testbed_names:
+        config['images'][testbed_name] = {}
+        config['security_group'][testbed_name] = []
+        config['networks'][testbed_name] = list(EXPECTED_NETWORKS)
+        config['ignore_floating_ips'][testbed_name] = []
+    return config
+
+
+def install(federation, endpoints):
+    """
+    Makes checkos.clients create fakes serving the federation. The fakes are instrumented like the real clients.
+    :return: a function that restores the real clients
+    """
+    from checkos import clients
+    originals = {name: getattr(clients, name) for name in
+                 ['_new_session', '_new_os_client', '_new_ob_client', '_new_exp_man_client', 'unauthorized_error']}
+    clients._new_session = lambda testbed: FakeSession(endpoints)
+    clients._new_os_client = lambda testbed_name, testbed, session=None: FakeOSClient(federation, endpoints,
+                                                                                      testbed_name, testbed, session)
+    clients._new_ob_client = lambda **kwargs: FakeOBClient(federation, endpoints, **kwargs)
+    clients._new_exp_man_client = lambda **kwargs: FakeExpManClient(federation, endpoints, **kwargs)
+    clients.unauthorized_error = lambda: FakeUnauthorized
+
+    def restore():
+        for name, function in originals.items():
+            setattr(clients, name, function)
+
+    return restore
+
+
+class FakeUnauthorized(FakeApiError):
+    def __init__(self, endpoint='keystone'):
+        super(FakeUnauthorized, self).__init__(endpoint, 401)
@@ -0,0 +1,50 @@
+import unittest
+
+from checkos.floating_ips import FloatingIpReclaimer
+from checkos.inventory import Inventory
+from tests import fakes
+
+
+class FloatingIpReclaimerTest(unittest.TestCase):
+    def setUp(self):
+        # floating IPs 0 and 2 of every project are associated, 1 and 3 can be released
+        self.federation = fakes.Federation(testbeds=1, projects=2, vms=0, nsrs=0, floating_ips=4)
+        self.testbed = self.federation.testbeds.get('testbed0')
+        self.projects = self.testbed.projects[1:]
+
+    def reclaim(self, endpoints=None, ignored=None, dry_run=False, on_result=None, admit=None):
+        """
+        :return: (address, error) for every floating IP the reclaimer released or tried to release, by address
+        """
+        cl = fakes.FakeOSClient(self.federation, endpoints or fakes.Endpoints(), 'testbed0',
+                                self.federation.credentials().get('testbed0'))
+        reclaimer = FloatingIpReclaimer(cl, Inventory(cl), ignored, workers=2, dry_run=dry_run)
+        return sorted((address, error) for _, address, error in reclaimer.reclaim(self.projects, on_result, admit))
+
+    def addresses(self):
+        return sorted(fip.get('floating_ip_address') for fip in self.testbed.floating_ips.values())
+
+    def test_unassociated_floating_ips_are_released(self):
+        released = []
+        results = self.reclaim(ignored=['10.0.0.1'],
+                               on_result=lambda project, fip_id, successful: released.append((fip_id, successful)))
+        self.assertEqual([('10.0.0.3', None), ('10.0.1.1', None), ('10.0.1.3', None)], results)
+        self.assertEqual(['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.1.0', '10.0.1.2'], self.addresses())
+        self.assertEqual([('testbed0-0-fip3', True), ('testbed0-1-fip1', True), ('testbed0-1-fip3', True)],
+                         sorted(released))
+
+    def test_failed_release_is_reported(self):
+        endpoints = fakes.Endpoints(error_rate={'neutron.delete_floatingip': 1.0})
+        results = self.reclaim(endpoints)
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(error for _, error in results))
+        self.assertEqual(8, len(self.testbed.floating_ips))
+
+    def test_dry_run_releases_nothing(self):
+        self.assertEqual(4, len(self.reclaim(dry_run=True)))
+        self.assertEqual(8, len(self.testbed.floating_ips))
+
+    def test_floating_ips_of_projects_that_are_not_admitted_are_kept(self):
+        results = self.reclaim(admit=lambda project: project.name == 'experimenter1')
+        self.assertEqual([('10.0.1.1', None), ('10.0.1.3', None)], results)
+        self.assertEqual(6, len(self.testbed.floating_ips))
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkos.images import DigestCache, ImageSync
+from tests import fakes
+
+
+class ImageSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'image')
+        with open(self.path, 'wb') as f:
+            f.write(b'image')
+        self.federation = fakes.Federation(testbeds=1, projects=2, vms=0, nsrs=0, floating_ips=0)
+        self.testbed = self.federation.testbeds.get('testbed0')
+        self.projects = self.testbed.projects[1:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sync(self, images, endpoints=None):
+        """
+        :return: (successful, uploaded) of ImageSync.sync on the testbed
+        """
+        cl = fakes.FakeOSClient(self.federation, endpoints or fakes.Endpoints(), 'testbed0',
+                                self.federation.credentials().get('testbed0'))
+        return ImageSync(cl, DigestCache()).sync(images, self.projects)
+
+    def test_present_image_with_the_local_checksum(self):
+        self.testbed.images['testbed0-image'].checksum = hashlib.md5(b'image').hexdigest()
+        self.assertEqual((True, []), self.sync({'softfire-image': {'path': self.path, 'shared': True}}))
+
+    def test_checksum_mismatch_fails_the_check(self):
+        self.testbed.images['testbed0-image'].checksum = hashlib.md5(b'other').hexdigest()
+        self.assertEqual((False, []), self.sync({'softfire-image': {'path': self.path, 'shared': True}}))
+        self.assertEqual(0, self.testbed.created_images)
+
+    def test_private_image_is_uploaded_to_every_project(self):
+        successful, uploaded = self.sync({'private-image': {'path': self.path, 'shared': False}})
+        self.assertTrue(successful)
+        self.assertEqual(['private-image', 'private-image'], uploaded)
+        owners = [image.owner for image in self.testbed.images.values() if image.name == 'private-image']
+        self.assertEqual(sorted(project.id for project in self.projects), sorted(owners))
+
+    def test_unfinished_upload_is_not_an_image(self):
+        self.testbed.images['testbed0-image'].status = 'queued'
+        successful, uploaded = self.sync({'softfire-image': {'path': self.path, 'shared': True}})
+        self.assertTrue(successful)
+        self.assertEqual(['softfire-image'], uploaded)
+
+    def test_failed_upload_deletes_the_image_record(self):
+        endpoints = fakes.Endpoints(error_rate={'glance.images.upload': 1.0})
+        images = dict(self.testbed.images)
+        self.assertEqual((False, []), self.sync({'new-image': {'path': self.path, 'shared': True}}, endpoints))
+        self.assertEqual(1, self.testbed.created_images)
+        self.assertEqual(1, endpoints.calls['glance.images.delete'])
+        self.assertEqual(images, self.testbed.images)
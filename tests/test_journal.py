@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkos import main as checks
+from checkos.journal import Journal
+from checkos.results import NdjsonRenderer
+from tests import fakes
+
+
+class Crash(BaseException):
+    """
+    Stands for the process being killed: it is not caught by the checks.
+    """
+    pass
+
+
+class CrashingEndpoints(fakes.Endpoints):
+    """
+    Crashes on the crash_at-th call of an endpoint, before the call has any effect.
+    """
+
+    def __init__(self, endpoint, crash_at):
+        super(CrashingEndpoints, self).__init__()
+        self.endpoint = endpoint
+        self.crash_at = crash_at
+
+    def call(self, endpoint):
+        super(CrashingEndpoints, self).call(endpoint)
+        if endpoint == self.endpoint and self.calls[endpoint] == self.crash_at:
+            raise Crash()
+
+
+def run_vm_zombie(federation, config, journal, resume=False):
+    """
+    :return: the records of the run
+    """
+    stream = io.StringIO()
+    checks.check_testbeds(federation.credentials(), config, False, False, False, False, True, dry_run=False,
+                          renderer=NdjsonRenderer(stream), journal=journal, resume=resume)
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.federation = fakes.Federation(testbeds=2, projects=2, vms=4, nsrs=2, floating_ips=0)
+        self.endpoints = CrashingEndpoints('nova.servers.delete', 3)
+        self.restore = fakes.install(self.federation, self.endpoints)
+        self.config = fakes.create_config(self.federation, os.path.join(self.directory, 'image'))
+        self.config['check-vm']['teardown']['workers'] = 1
+        self.path = os.path.join(self.directory, 'journal.ndjson')
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def servers(self):
+        return set(server_id for testbed in self.federation.testbeds.values() for server_id in testbed.servers)
+
+    def test_resume_takes_the_remaining_actions_only(self):
+        servers = self.servers()
+        # VM 0 of every project is kept, it belongs to an NSR the Experiment Manager knows about
+        kept = set(server_id for server_id in servers if server_id.endswith('-vm0'))
+        with self.assertRaises(Crash):
+            run_vm_zombie(self.federation, self.config, Journal(self.path))
+        left = self.servers()
+        self.assertLess(len(kept), len(left))
+        crashed = dict(self.endpoints.calls)
+        # a zombie that shows up in a project the crashed run planned or completed is left for the next run, the
+        # resumed run does not look at these projects again
+        with open(self.path) as f:
+            started = set((event.get('testbed'), event.get('project')) for event in map(json.loads, f)
+                          if event.get('event') in ('plan', 'complete') and event.get('testbed') is not None)
+        self.assertTrue(started)
+        late = set()
+        for testbed_name, project_id in started:
+            server = fakes.Resource('{}-late'.format(project_id), 'late', tenant_id=project_id, status='ACTIVE')
+            self.federation.testbeds.get(testbed_name).servers[server.id] = server
+            late.add(server.id)
+
+        self.endpoints.crash_at = None
+        records = run_vm_zombie(self.federation, self.config, Journal(self.path), resume=True)
+
+        self.assertEqual(kept | late, self.servers())
+        # a VM or NSR removed before the crash would fail to be removed again
+        self.assertTrue(all(record.get('successful') for record in records))
+        self.assertEqual(len(left - kept),
+                         self.endpoints.calls['nova.servers.delete'] - crashed.get('nova.servers.delete'))
+        # one zombie NSR per experimenter, removed once over both runs
+        self.assertEqual(len(self.federation.experimenters), self.endpoints.calls['nfvo.delete_nsr'])
+
+    def test_ended_run_is_not_resumed(self):
+        self.endpoints.crash_at = None
+        run_vm_zombie(self.federation, self.config, Journal(self.path))
+        deletes = self.endpoints.calls['nova.servers.delete']
+        journal = Journal(self.path)
+        self.assertFalse(journal.begin(resume=True))
+        journal.close()
+        self.assertEqual(deletes, self.endpoints.calls['nova.servers.delete'])
+
+    def test_unwritable_journal(self):
+        self.endpoints.crash_at = None
+        # a file where the directory of the journal should be
+        open(os.path.join(self.directory, 'file'), 'w').close()
+        records = run_vm_zombie(self.federation, self.config, Journal(os.path.join(self.directory, 'file', 'journal')))
+        self.assertTrue(records)
+        self.assertTrue(all(record.get('successful') for record in records))
+        self.assertTrue(self.endpoints.calls['nova.servers.delete'])
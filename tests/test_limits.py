@@ -0,0 +1,80 @@
+import unittest
+
+from checkos.limits import DEFAULTS, NO_RETRY, READ, WRITE, CircuitBreaker, CircuitOpenError, Limiter, call_kind
+from tests import fakes
+
+
+class Flaky(object):
+    """
+    Fails with the given HTTP statuses, one per call, and then succeeds.
+    """
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.statuses:
+            raise fakes.FakeApiError('endpoint', self.statuses.pop(0))
+        return 'response'
+
+
+class CallKindTest(unittest.TestCase):
+    def test_call_kinds(self):
+        for method_name in ('list_servers', 'get', 'show_network', 'find'):
+            self.assertEqual(READ, call_kind(method_name))
+        for method_name in ('delete_floatingip', 'create_security_group', 'delete_server'):
+            self.assertEqual(WRITE, call_kind(method_name))
+        for method_name in ('upload', 'upload_image'):
+            self.assertEqual(NO_RETRY, call_kind(method_name))
+
+
+class LimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = Limiter('testbed0/nova', dict(DEFAULTS, backoff=0), CircuitBreaker('testbed0'))
+
+    def test_read_is_retried_after_transient_errors(self):
+        function = Flaky(503, 504, 502)
+        self.assertEqual('response', self.limiter.call_as(READ, function))
+        self.assertEqual(4, function.calls)
+
+    def test_not_retried_after_other_errors(self):
+        for kind in (READ, WRITE, NO_RETRY):
+            for status in (400, 401, 404, 409, 500):
+                function = Flaky(status)
+                with self.assertRaises(fakes.FakeApiError):
+                    self.limiter.call_as(kind, function)
+                self.assertEqual(1, function.calls, '{} after HTTP {}'.format(kind, status))
+
+    def test_write_is_retried_only_if_it_was_rejected(self):
+        function = Flaky(429, 503)
+        self.assertEqual('response', self.limiter.call_as(WRITE, function))
+        self.assertEqual(3, function.calls)
+        for status in (502, 504):
+            function = Flaky(status)
+            with self.assertRaises(fakes.FakeApiError):
+                self.limiter.call(function)
+            self.assertEqual(1, function.calls)
+
+    def test_upload_is_never_retried(self):
+        function = Flaky(503)
+        with self.assertRaises(fakes.FakeApiError):
+            self.limiter.call_as(NO_RETRY, function)
+        self.assertEqual(1, function.calls)
+
+    def test_retries_are_bounded(self):
+        function = Flaky(*[503] * 10)
+        with self.assertRaises(fakes.FakeApiError):
+            self.limiter.call_as(READ, function)
+        self.assertEqual(DEFAULTS.get('retries') + 1, function.calls)
+
+    def test_circuit_breaker_opens_after_transient_errors(self):
+        limiter = Limiter('testbed0/nova', dict(DEFAULTS, retries=0), CircuitBreaker('testbed0', failures=2))
+        for _ in range(2):
+            with self.assertRaises(fakes.FakeApiError):
+                limiter.call_as(READ, Flaky(503))
+        function = Flaky()
+        with self.assertRaises(CircuitOpenError):
+            limiter.call_as(READ, function)
+        self.assertEqual(0, function.calls)
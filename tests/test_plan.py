@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkos import main as checks
+from checkos.policy import compile_policy
+from checkos.zombies import PLAN_VERSION, PlanError, read_plan, write_plan
+from tests import fakes
+
+
+class RecordingEndpoints(fakes.Endpoints):
+    """
+    Keeps the order in which the endpoints were called.
+    """
+
+    def __init__(self):
+        super(RecordingEndpoints, self).__init__()
+        self.order = []
+
+    def call(self, endpoint):
+        super(RecordingEndpoints, self).call(endpoint)
+        self.order.append(endpoint)
+
+
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # NSR 0 of every experimenter is known to the Experiment Manager and keeps VM 0, the rest are zombies
+        self.federation = fakes.Federation(testbeds=2, projects=2, vms=3, nsrs=2, floating_ips=0)
+        self.endpoints = RecordingEndpoints()
+        self.restore = fakes.install(self.federation, self.endpoints)
+        self.testbeds = self.federation.credentials()
+        self.policy = compile_policy(fakes.create_config(self.federation, os.path.join(self.directory, 'image')),
+                                     self.testbeds)
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def servers(self):
+        return sorted(server_id for testbed in self.federation.testbeds.values() for server_id in testbed.servers)
+
+    def nsrs(self):
+        return sorted(nsr_id for nsrs in self.federation.nsrs.values() for nsr_id in nsrs)
+
+    def test_plan_lists_the_zombies_without_deleting_them(self):
+        servers = self.servers()
+        plan = checks.plan_zombies(self.testbeds, self.policy)
+        self.assertEqual(servers, self.servers())
+        self.assertEqual(['experimenter0-nsr1', 'experimenter1-nsr1'], sorted(nsr.get('id') for nsr in plan['nsrs']))
+        self.assertEqual(['experimenter0-nsd1', 'experimenter1-nsd1'], sorted(nsd.get('id') for nsd in plan['nsds']))
+        self.assertEqual(sorted(server_id for server_id in servers if not server_id.endswith('-vm0')),
+                         sorted(vm.get('id') for vm in plan['vms']))
+        self.assertEqual([], plan['errors'])
+        self.assertFalse([endpoint for endpoint in self.endpoints.calls if 'delete' in endpoint])
+
+    def test_apply_removes_the_nsrs_before_the_vms(self):
+        plan = checks.plan_zombies(self.testbeds, self.policy)
+        results = checks.apply_zombie_plan(plan, self.testbeds, self.policy)
+        self.assertFalse(results.failed())
+        self.assertEqual(['experimenter0-nsr0', 'experimenter1-nsr0'], self.nsrs())
+        self.assertTrue(all(server_id.endswith('-vm0') for server_id in self.servers()))
+        order = self.endpoints.order
+        last_nsr = max(index for index, endpoint in enumerate(order) if endpoint == 'nfvo.delete_nsr')
+        self.assertLess(last_nsr, order.index('nova.servers.delete'))
+
+    def test_entries_removed_from_the_plan_are_kept(self):
+        plan = checks.plan_zombies(self.testbeds, self.policy)
+        kept_vm = plan['vms'].pop(0).get('id')
+        kept_nsr = plan['nsrs'].pop(0)
+        checks.apply_zombie_plan(plan, self.testbeds, self.policy)
+        self.assertIn(kept_vm, self.servers())
+        self.assertIn(kept_nsr.get('id'), self.nsrs())
+        # the NSD of the kept NSR is kept with it
+        self.assertEqual(1, self.endpoints.calls['nfvo.delete_nsd'])
+
+    def test_dry_run_deletes_nothing(self):
+        servers = self.servers()
+        nsrs = self.nsrs()
+        checks.apply_zombie_plan(checks.plan_zombies(self.testbeds, self.policy), self.testbeds, self.policy,
+                                 dry_run=True)
+        self.assertEqual(servers, self.servers())
+        self.assertEqual(nsrs, self.nsrs())
+
+    def test_plan_file(self):
+        path = os.path.join(self.directory, 'plan.json')
+        plan = checks.plan_zombies(self.testbeds, self.policy)
+        write_plan(plan, path)
+        self.assertEqual(plan, read_plan(path))
+        with open(path, 'w') as f:
+            f.write(json.dumps(dict(plan, version=PLAN_VERSION + 1)))
+        with self.assertRaises(PlanError):
+            read_plan(path)
+        with self.assertRaises(PlanError):
+            read_plan(os.path.join(self.directory, 'missing.json'))
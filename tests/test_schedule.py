@@ -0,0 +1,131 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from checkos import main as checks
+from checkos.results import DEFERRED, NdjsonRenderer
+from checkos.schedule import Scheduler
+from tests import fakes
+
+
+class Project(object):
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('checkos.schedule.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_checks_by_priority(self):
+        scheduler = Scheduler({'images': 100})
+        self.assertEqual(['images', 'floating_ip', 'vm_zombie', 'networks'],
+                         scheduler.checks(['networks', 'vm_zombie', 'images', 'floating_ip']))
+
+    def test_no_deadline(self):
+        scheduler = Scheduler()
+        self.clock.now += 10 ** 6
+        self.assertTrue(scheduler.admit('testbed0', 'vm_zombie', Project('p0', 'experimenter0')))
+        self.assertIsNone(scheduler.remaining())
+        self.assertEqual([], scheduler.deferred())
+
+    def test_units_after_the_deadline_are_deferred(self):
+        scheduler = Scheduler(deadline=60)
+        project = Project('p0', 'experimenter0')
+        self.assertTrue(scheduler.admit('testbed0', 'vm_zombie', project))
+        self.clock.now += 60
+        self.assertEqual(0, scheduler.remaining())
+        self.assertFalse(scheduler.admit('testbed0', 'vm_zombie', project))
+        self.assertFalse(scheduler.admit('testbed0', 'images', project, 'softfire-image'))
+        self.assertFalse(scheduler.admit('testbed1', 'networks'))
+        self.assertEqual([('testbed0', 'vm_zombie', project, None), ('testbed0', 'images', project, 'softfire-image'),
+                          ('testbed1', 'networks', None, None)], scheduler.deferred())
+
+    def test_admission_keeps_its_answer_per_project(self):
+        scheduler = Scheduler(deadline=60)
+        admission = scheduler.admission('testbed0', 'security_group')
+        started, late = Project('p0', 'experimenter0'), Project('p1', 'experimenter1')
+        self.assertTrue(admission(started))
+        self.clock.now += 60
+        # a project whose first action started before the deadline is finished
+        self.assertTrue(admission(started))
+        self.assertFalse(admission(late))
+        self.assertFalse(admission.deferred(started))
+        self.assertTrue(admission.deferred(late))
+        self.assertEqual(1, len(scheduler.deferred()))
+
+
+class DeadlineEndpoints(fakes.Endpoints):
+    """
+    Lets the time run out with the first deletion of a VM.
+    """
+
+    def __init__(self, clock):
+        super(DeadlineEndpoints, self).__init__()
+        self.clock = clock
+
+    def call(self, endpoint):
+        super(DeadlineEndpoints, self).call(endpoint)
+        if endpoint == 'nova.servers.delete' and self.calls[endpoint] == 1:
+            self.clock.now += 3600
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+        patcher = mock.patch('checkos.schedule.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.federation = fakes.Federation(testbeds=2, projects=3, vms=2, nsrs=2, floating_ips=2)
+        self.endpoints = DeadlineEndpoints(self.clock)
+        self.restore = fakes.install(self.federation, self.endpoints)
+        self.config = fakes.create_config(self.federation, os.path.join(self.directory, 'image'))
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def run_checks(self, deadline):
+        """
+        Runs the floating IP and zombie VM checks, the floating IPs first as they have the higher priority.
+        :return: (testbed, project, check) of the deferred units
+        """
+        stream = io.StringIO()
+        # a deferred unit does not fail the run
+        checks.check_testbeds(self.federation.credentials(), self.config, False, False, False, True, True,
+                              dry_run=False, renderer=NdjsonRenderer(stream), parallel_testbeds=1, deadline=deadline)
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        return sorted((record.get('testbed'), record.get('project'), record.get('item')) for record in records
+                      if record.get('kind') == DEFERRED)
+
+    def test_checks_after_the_deadline_are_deferred(self):
+        self.assertEqual([(testbed_name, None, check) for testbed_name in self.federation.testbed_names
+                          for check in ('floating_ip', 'vm_zombie')], self.run_checks(0))
+        self.assertFalse([endpoint for endpoint in self.endpoints.calls if 'delete' in endpoint])
+
+    def test_projects_after_the_deadline_are_deferred(self):
+        # the floating IPs of all testbeds are done first; the project in progress when the time runs out is
+        # finished, the other projects of the testbed and the testbeds that did not start wait for the next run
+        self.assertEqual([('testbed0', 'experimenter1', 'vm_zombie'), ('testbed0', 'experimenter2', 'vm_zombie'),
+                          ('testbed1', None, 'vm_zombie')], self.run_checks(3600))
+        self.assertEqual(1, self.endpoints.calls['nova.servers.delete'])
+        # one of the two floating IPs of every project is not associated
+        self.assertEqual(len(self.federation.testbed_names) * len(self.federation.experimenters),
+                         self.endpoints.calls['neutron.delete_floatingip'])
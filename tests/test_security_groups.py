@@ -0,0 +1,59 @@
+import unittest
+
+from checkos.inventory import Inventory
+from checkos.security_groups import SecurityGroupReconciler
+from tests import fakes
+
+RULES = {'softfire-default': [{'direction': 'ingress', 'ethertype': 'IPv4', 'protocol': 'tcp',
+                               'port_range_min': 22, 'port_range_max': 22}]}
+
+
+class SecurityGroupReconcilerTest(unittest.TestCase):
+    def setUp(self):
+        # every other project misses softfire-default
+        self.federation = fakes.Federation(testbeds=1, projects=5, vms=0, nsrs=0, floating_ips=0)
+        self.testbed = self.federation.testbeds.get('testbed0')
+        self.projects = self.testbed.projects[1:]
+
+    def reconcile(self, endpoints=None, dry_run=False, admit=None):
+        """
+        :return: (the results of reconcile, the Inventory)
+        """
+        cl = fakes.FakeOSClient(self.federation, endpoints or fakes.Endpoints(), 'testbed0',
+                                self.federation.credentials().get('testbed0'))
+        inventory = Inventory(cl)
+        reconciler = SecurityGroupReconciler(cl, inventory, RULES, workers=2, batch_size=1, dry_run=dry_run)
+        return reconciler.reconcile(fakes.EXPECTED_SECURITY_GROUPS, self.projects, admit), inventory
+
+    def test_missing_groups_are_created_with_their_rules(self):
+        endpoints = fakes.Endpoints()
+        results, inventory = self.reconcile(endpoints)
+        self.assertEqual([('experimenter1', 'softfire-default', None), ('experimenter3', 'softfire-default', None)],
+                         [(project.name, name, error) for project, name, error in results])
+        self.assertEqual(2, endpoints.calls['neutron.create_security_group_rule'])
+        for project in self.projects:
+            self.assertEqual(sorted(['default'] + fakes.EXPECTED_SECURITY_GROUPS),
+                             sorted(group.get('name') for group in inventory.list_sec_group(project.id)))
+        # one admin listing for all projects, and one more after the groups were created
+        self.assertEqual(2, endpoints.calls['neutron.list_security_groups'])
+
+    def test_failed_creation_is_reported(self):
+        endpoints = fakes.Endpoints(error_rate={'neutron.create_security_group': 1.0})
+        results, _ = self.reconcile(endpoints)
+        self.assertEqual(2, len(results))
+        self.assertTrue(all(error for _, _, error in results))
+        self.assertEqual(2, endpoints.calls['neutron.create_security_group'])
+
+    def test_failed_rule_is_reported(self):
+        results, _ = self.reconcile(fakes.Endpoints(error_rate={'neutron.create_security_group_rule': 1.0}))
+        self.assertTrue(all(error.startswith('created without rule') for _, _, error in results))
+
+    def test_dry_run_creates_nothing(self):
+        groups = dict(self.testbed.security_groups)
+        results, _ = self.reconcile(dry_run=True)
+        self.assertEqual(2, len(results))
+        self.assertEqual(groups, self.testbed.security_groups)
+
+    def test_projects_that_are_not_admitted_are_skipped(self):
+        results, _ = self.reconcile(admit=lambda project: project.name != 'experimenter1')
+        self.assertEqual(['experimenter3'], [project.name for project, _, _ in results])
@@ -0,0 +1,89 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkos import main as checks
+from checkos.main import merge_shards
+from checkos.results import CHECK, VM, NdjsonRenderer, ResultsFileError, ResultStore, write_results
+from checkos.shard import Shard
+from tests import fakes
+
+
+class MergeShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_shard(self, index, count, name=None):
+        store = ResultStore()
+        store.add('testbed0', 'experimenter{}'.format(index), VM, 'vm{}'.format(index), True)
+        store.add('testbed0', None, CHECK, 'vm_zombie', True)
+        path = os.path.join(self.directory, name or 'shard{}.json'.format(index))
+        write_results(store, path, ['vm_zombie'], ['testbed0'], Shard(index, count))
+        return path
+
+    def test_all_shards(self):
+        paths = [self.write_shard(index, 3) for index in (3, 1, 2)]
+        results, checks = merge_shards(paths)
+        self.assertEqual(['vm_zombie'], checks)
+        self.assertFalse(results.failed())
+        self.assertEqual(['vm1', 'vm2', 'vm3'], [record.item for record in results.records(VM)])
+
+    def test_missing_shard_fails_the_run(self):
+        results, _ = merge_shards([self.write_shard(1, 3), self.write_shard(3, 3)])
+        self.assertTrue(results.failed())
+        self.assertEqual(['missing 2/3'], [record.detail for record in results.records(CHECK)
+                                           if record.item == 'shards'])
+
+    def test_duplicate_shard(self):
+        paths = [self.write_shard(1, 2), self.write_shard(1, 2, 'again.json'), self.write_shard(2, 2)]
+        with self.assertRaises(ResultsFileError):
+            merge_shards(paths)
+
+    def test_shards_of_different_runs(self):
+        with self.assertRaises(ResultsFileError):
+            merge_shards([self.write_shard(1, 2), self.write_shard(2, 3)])
+
+
+class ZombieShardTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.federation = fakes.Federation(testbeds=3, projects=8, vms=3, nsrs=2, floating_ips=0)
+        self.restore = fakes.install(self.federation, fakes.Endpoints())
+        self.config = fakes.create_config(self.federation, os.path.join(self.directory, 'image'))
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def run_shard(self, shard):
+        checks.check_testbeds(self.federation.credentials(), self.config, False, False, False, False, True,
+                              dry_run=False, renderer=NdjsonRenderer(io.StringIO()), shard=shard)
+
+    def cleaned(self):
+        """
+        :return: {testbed name or None for the NFVO: the experimenters whose zombies are gone}
+        """
+        cleaned = {None: set(project.get('name') for project in self.federation.nfvo_projects
+                             if '{}-nsr1'.format(project.get('name')) not in
+                             self.federation.nsrs.get(project.get('id'), {}))}
+        for testbed_name, testbed in self.federation.testbeds.items():
+            cleaned[testbed_name] = set(experimenter for p, experimenter in enumerate(self.federation.experimenters)
+                                        if '{}-{}-vm1'.format(testbed_name, p) not in testbed.servers)
+        return cleaned
+
+    def test_nsrs_and_vms_of_a_project_on_one_shard(self):
+        self.run_shard(Shard(1, 2))
+        cleaned = self.cleaned()
+        experimenters = cleaned.pop(None) - {'default'}
+        self.assertTrue(experimenters)
+        self.assertLess(len(experimenters), len(self.federation.experimenters))
+        for testbed_name, testbed_experimenters in cleaned.items():
+            self.assertEqual(experimenters, testbed_experimenters, testbed_name)
+        self.run_shard(Shard(2, 2))
+        for testbed_experimenters in self.cleaned().values():
+            self.assertTrue(set(self.federation.experimenters) <= testbed_experimenters)
@@ -0,0 +1,61 @@
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from checkos import clients
+from checkos import main as checks
+from checkos.results import NdjsonRenderer
+from checkos.tokens import TokenCache
+from tests import fakes
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tokens = os.path.join(self.directory, 'tokens')
+        self.federation = fakes.Federation(testbeds=2, projects=2, vms=1, nsrs=0, floating_ips=0)
+        self.endpoints = fakes.Endpoints()
+        self.restore = fakes.install(self.federation, self.endpoints)
+        self.config = fakes.create_config(self.federation, os.path.join(self.directory, 'image'))
+
+    def tearDown(self):
+        clients.cache_tokens(None)
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def run_security_group(self, margin=300):
+        """
+        :return: the number of times the clients authenticated
+        """
+        tokens = TokenCache(self.tokens, margin)
+        clients.cache_tokens(tokens)
+        before = self.endpoints.calls['keystone.auth']
+        checks.check_testbeds(self.federation.credentials(), self.config, False, True, False, False, False,
+                              dry_run=False, renderer=NdjsonRenderer(io.StringIO()))
+        tokens.save()
+        return self.endpoints.calls['keystone.auth'] - before
+
+    def test_second_run_reuses_the_tokens(self):
+        self.assertEqual(2, self.run_security_group())
+        for name in os.listdir(self.tokens):
+            self.assertFalse(os.stat(os.path.join(self.tokens, name)).st_mode & (stat.S_IRWXG | stat.S_IRWXO))
+        self.assertEqual(0, self.run_security_group())
+
+    def test_token_about_to_expire_is_not_reused(self):
+        self.run_security_group()
+        # the fake tokens are valid for an hour, so all of them are within the margin
+        self.assertEqual(2, self.run_security_group(margin=3600))
+
+    def test_new_password_authenticates(self):
+        self.run_security_group()
+        credentials = self.federation.credentials()
+        credentials['testbed0']['password'] = 'changed'
+        tokens = TokenCache(self.tokens)
+        clients.cache_tokens(tokens)
+        before = self.endpoints.calls['keystone.auth']
+        checks.check_testbeds(credentials, self.config, False, True, False, False, False, dry_run=False,
+                              renderer=NdjsonRenderer(io.StringIO()))
+        self.assertEqual(1, self.endpoints.calls['keystone.auth'] - before)
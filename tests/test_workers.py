@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from checkos import main as checks
+from checkos.floating_ips import FloatingIpReclaimer
+from checkos.images import ImageSync
+from checkos.policy import compile_policy
+from checkos.security_groups import SecurityGroupReconciler
+from checkos.teardown import TeardownEngine
+from tests import fakes
+
+POOLS = [ImageSync, SecurityGroupReconciler, FloatingIpReclaimer, TeardownEngine]
+
+
+class ProjectWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        image_path = os.path.join(self.directory, 'image')
+        with open(image_path, 'wb') as f:
+            f.write(b'image')
+        self.federation = fakes.Federation(testbeds=1, projects=2, vms=2, nsrs=2, floating_ips=2)
+        self.restore = fakes.install(self.federation, fakes.Endpoints())
+        self.config = fakes.create_config(self.federation, image_path)
+        self.workers = {}
+        for pool in POOLS:
+            patcher = mock.patch.object(checks, pool.__name__, self.recording(pool))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.restore()
+        shutil.rmtree(self.directory)
+
+    def recording(self, pool):
+        workers = self.workers
+
+        class Recording(pool):
+            def __init__(self, *args, **kwargs):
+                super(Recording, self).__init__(*args, **kwargs)
+                workers[pool.__name__] = self.workers
+
+        return Recording
+
+    def run_checks(self, project_workers):
+        testbeds = self.federation.credentials()
+        policy = compile_policy(self.config, testbeds)
+        checks.run_checks(testbeds, self.config, True, True, True, True, True, dry_run=True,
+                          project_workers=project_workers, shared=checks.create_shared(policy, True, True),
+                          policy=policy)
+
+    def test_project_workers_size_the_pools(self):
+        self.run_checks(3)
+        self.assertEqual({pool.__name__: 3 for pool in POOLS}, self.workers)
+
+    def test_section_of_the_pool_wins(self):
+        self.config['floating_ip_sync'] = {'workers': 5}
+        self.config['check-vm']['teardown']['workers'] = 6
+        self.config['project_workers'] = {'any': 2}
+        self.run_checks(3)
+        self.assertEqual({'ImageSync': 2, 'SecurityGroupReconciler': 2, 'FloatingIpReclaimer': 5,
+                          'TeardownEngine': 6}, self.workers)
+
+    def test_defaults_without_project_workers(self):
+        self.run_checks(None)
+        self.assertEqual({'ImageSync': 2, 'SecurityGroupReconciler': 4, 'FloatingIpReclaimer': 8,
+                          'TeardownEngine': 8}, self.workers)